@@ -47,14 +47,30 @@ def run_simple_cases(saver:Saver):
         print('#'*80)
         print('#', case_name)
         mmh = MMH(case, pop_size=POP_SIZE, config=config, data_handler=saver.save)
-        for pops in mmh.corun():
-            assert len(pops) == 1  # currently multipop is not implemented
-            pop = pops[0]
-            assert len(pop) == POP_SIZE
+        try:
+            for pops in mmh.corun():
+                assert len(pops) == 1  # currently multipop is not implemented
+                pop = pops[0]
+                assert len(pop) == POP_SIZE
+        finally:
+            mmh.close()
         print('#'*80)
         print()
 
 
+def run_sweep(_:Saver):
+    """Compare the time to solution of configurations, over a few seeds"""
+    import sweep, commons
+    cases = {
+        'hi !': Case('', 'hi !'),
+        'hello world': Case('', 'hello, world!'),
+    }
+    codes = sweep.code_grid(score=('IOC', 'IOCBM'), select=('PLDD', 'RSD'), reproduce=('PRPW', 'PAP'))
+    rows = sweep.run_sweep(cases, codes, seeds=range(5), filename=commons.DATA_DIR + 'sweep.csv', pop_size=POP_SIZE)
+    for row in rows:
+        print(*(row[field] for field in sweep.SUMMARY_FIELDS), sep='\t')
+
+
 MOTIF = r"""
 /////\\\\\/////\\\\\/////\\\\\/////\\\\\/////\\\\\/////\\\\\
 /////\\\\\/////\\\\\/////\\\\\/////\\\\\/////\\\\\/////\\\\\
@@ -105,6 +121,7 @@ def main(saver:Saver=None):
     methods = (
         # ((), run_interpreter_testing),
         run_simple_cases,
+        # run_sweep,
         # (('score', 'step'), run_test_motif),
     )
     for method in methods:
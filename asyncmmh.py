@@ -0,0 +1,283 @@
+"""asyncio API of the meta meta heuristic.
+
+An AsyncMMH computes its steps without blocking the event loop, so that
+one loop can drive many runs, of different cases and configurations, and
+stream their progress to monitoring coroutines.
+
+The steps of the configuration are synchronous functions: each run
+computes them in its own thread, and their scoring is awaited in the
+event loop, by a scoring backend, that is any object with a coroutine
+method score(units, test, score) -> {unit: result}, and a method
+submit(unit, test, score, callback, error_callback) starting the scoring
+of one unit, like EvaluationService.submit, for the steady-state steps.
+A backend with a coroutine method create_scored, with the parameters of
+EvaluationService.create_scored, also creates the children of the 'DIVC' step.
+Backends are:
+- ProcessPoolBackend scores the units in a concurrent.futures.ProcessPoolExecutor,
+  that all runs can share
+- EvaluatorBackend awaits a synchronous evaluator, like an
+  evaluation.EvaluationService or a farm.WorkerFarm, run in an executor
+
+"""
+
+
+import asyncio
+import itertools
+import functools
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from mmh import MMH
+from unit import Unit
+from config import Configuration
+from evaluation import default_processes, CHUNKS_PER_WORKER
+
+
+def _score_sources(score:callable, test:tuple, sources:[str]) -> list:
+    """Return the results of the units of given sources"""
+    return [score(Unit(source), test) for source in sources]
+
+
+def _create_sources(scored_parents:dict, reproduce:callable, cross:callable, mutate:callable,
+                    test:tuple, score:callable, number:int) -> [(str, int, 'RunResult')]:
+    """Return the source, chromosome size and result of given number of children of given parents"""
+    children = reproduce(scored_parents, number, cross, mutator=mutate, keep_parents=False)
+    return [(child.source, child.chrom_size, score(child, test)) for child in children]
+
+
+def _callbacks(callback:callable, error_callback:callable) -> callable:
+    """Return a done callback of a future, calling given callbacks like EvaluationService.submit"""
+    def done(future):
+        if future.exception() is not None:
+            error_callback(future.exception())
+        else:
+            callback(future.result())
+    return done
+
+
+class ProcessPoolBackend:
+    """Scoring backend sending chunks of sources to a pool of processes,
+    started at first use. Chunks of concurrent calls are interleaved.
+
+    >>> import scoring
+    >>> async def main():
+    ...     backend = ProcessPoolBackend(processes=2)
+    ...     results = await backend.score([Unit(',.'), Unit(',+.')], ('a', 'b'), scoring.io_comparison)
+    ...     backend.close()
+    ...     return [result.score for result in results.values()]
+    >>> asyncio.run(main())
+    [9999, 10000]
+
+    """
+
+    def __init__(self, processes:int=None):
+        self.processes = int(processes or default_processes())
+        self._executor = None
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def _started_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.processes)
+        return self._executor
+
+    def _chunk_size(self, number:int) -> int:
+        return max(1, -(-number // (self.processes * CHUNKS_PER_WORKER)))
+
+    async def score(self, units:[Unit], test:tuple, score:callable) -> dict:
+        """Return {unit: result of given scoring function for given test}"""
+        executor, loop = self._started_executor(), asyncio.get_running_loop()
+        sources = tuple(dict.fromkeys(unit.source for unit in units))
+        size = self._chunk_size(len(sources))
+        chunks = [sources[start:start + size] for start in range(0, len(sources), size)]
+        scored = await asyncio.gather(*(loop.run_in_executor(executor, _score_sources, score, test, chunk)
+                                        for chunk in chunks))
+        results = dict(zip(sources, itertools.chain.from_iterable(scored)))
+        return {unit: results[unit.source] for unit in units}
+
+    def submit(self, unit:Unit, test:tuple, score:callable, callback:callable, error_callback:callable):
+        """Start the scoring of given unit, like EvaluationService.submit"""
+        future = self._started_executor().submit(score, unit, test)
+        future.add_done_callback(_callbacks(callback, error_callback))
+
+    async def create_scored(self, scored_parents:dict, number:int, reproduce:callable, cross:callable,
+                            mutate:callable, test:tuple, score:callable) -> dict:
+        """Return {child: result} of given number of children of given parents,
+        created and scored by the workers, like EvaluationService.create_scored"""
+        executor, loop = self._started_executor(), asyncio.get_running_loop()
+        size = self._chunk_size(number)
+        created = await asyncio.gather(*(
+            loop.run_in_executor(executor, _create_sources, scored_parents, reproduce, cross, mutate,
+                                 test, score, min(size, number - start))
+            for start in range(0, number, size)
+        ))
+        return {Unit(source, chrom_size): result
+                for source, chrom_size, result in itertools.chain.from_iterable(created)}
+
+
+class EvaluatorBackend:
+    """Scoring backend awaiting given synchronous evaluator, whose calls
+    are made one at a time by a thread."""
+
+    def __init__(self, evaluator:'EvaluationService'):
+        self.evaluator = evaluator
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='evaluator')
+
+    @property
+    def processes(self) -> int:
+        return self.evaluator.processes
+
+    def close(self):
+        self._executor.shutdown()
+
+    async def score(self, units:[Unit], test:tuple, score:callable) -> dict:
+        """Return {unit: result of given scoring function for given test}"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self.evaluator.score, units, test, score)
+
+    def submit(self, unit:Unit, test:tuple, score:callable, callback:callable, error_callback:callable):
+        """Start the scoring of given unit, with the submit method of the
+        evaluator, or else by scoring it alone"""
+        if hasattr(self.evaluator, 'submit'):
+            self.evaluator.submit(unit, test, score, callback, error_callback)
+        else:
+            future = self._executor.submit(self.evaluator.score, (unit,), test, score)
+            future.add_done_callback(_callbacks(lambda results: callback(results[unit]), error_callback))
+
+    @property
+    def create_scored(self) -> callable:
+        """Coroutine function awaiting the create_scored method of the evaluator.
+        Evaluators without one, like farm.WorkerFarm, raise AttributeError."""
+        create_scored = self.evaluator.create_scored
+        async def awaited(*args) -> dict:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, create_scored, *args)
+        return awaited
+
+
+class _AwaitingEvaluator:
+    """Evaluator given to the step functions, that run in another thread,
+    scoring the units with given backend in given event loop."""
+
+    def __init__(self, backend, loop:asyncio.AbstractEventLoop):
+        self.backend = backend
+        self.loop = loop
+
+    @property
+    def processes(self) -> int:
+        return self.backend.processes
+
+    def score(self, units:[Unit], test:tuple, score:callable) -> dict:
+        return asyncio.run_coroutine_threadsafe(self.backend.score(units, test, score), self.loop).result()
+
+    def submit(self, unit:Unit, test:tuple, score:callable, callback:callable, error_callback:callable):
+        self.backend.submit(unit, test, score, callback, error_callback)
+
+    @property
+    def create_scored(self) -> callable:
+        """Raise AttributeError when the backend can't create units,
+        so that the step functions create them themselves"""
+        create_scored = self.backend.create_scored
+        def awaited(*args) -> dict:
+            return asyncio.run_coroutine_threadsafe(create_scored(*args), self.loop).result()
+        return awaited
+
+
+class AsyncMMH(MMH):
+    """MMH whose steps are awaited.
+
+    Its step functions get an evaluator scoring the units with the
+    backend in the event loop. Step functions that don't use the
+    evaluator (like the ones of the 'thread' backend) still run in the
+    thread of the run, without blocking the loop.
+
+    """
+
+    def __init__(self, case:'Case', pop_size:int, config:Configuration,
+                 pop_number:int=1, data_handler:callable=None, backend=None, processes:int=None):
+        """
+
+        backend -- the scoring backend, by default an EvaluatorBackend
+            of an evaluation.EvaluationService of given number of processes.
+            Only the default backend is closed by close.
+        Other parameters are the ones of MMH.
+
+        """
+        super().__init__(case, pop_size, config, pop_number, data_handler, processes)
+        self.prompt_at = lambda sn: False  # input() would block the run
+        self._service = self.evaluator  # replaced by the one awaiting the backend during steps
+        self._own_backend = backend is None
+        self.backend = EvaluatorBackend(self._service) if backend is None else backend
+        self._thread = ThreadPoolExecutor(max_workers=1, thread_name_prefix='mmh')
+        self._listeners = []  # (loop, queue) of progress coroutines
+
+
+    def close(self):
+        """Stop the thread of the run, and the backend, if it was started by this instance"""
+        if self._own_backend:
+            self.backend.close()
+        self.evaluator = self._service
+        super().close()
+        self._thread.shutdown()
+
+
+    def callback_stat_adaptator(self, **data):
+        data = {**data, 'step': self.current_step, 'config': self.current_config}
+        if self.data_handler:
+            self.data_handler(**data)
+        for loop, queue in tuple(self._listeners):
+            loop.call_soon_threadsafe(queue.put_nowait, data)
+
+
+    async def progress(self):
+        """Yield the data given to data_handler at each step, until the end
+        of current call to run or corun.
+
+        """
+        queue = asyncio.Queue()
+        listener = asyncio.get_running_loop(), queue
+        self._listeners.append(listener)
+        try:
+            while (data := await queue.get()) is not None:
+                yield data
+        finally:
+            self._listeners.remove(listener)
+
+
+    def _end_progress(self):
+        for loop, queue in tuple(self._listeners):
+            loop.call_soon_threadsafe(queue.put_nowait, None)
+
+
+    async def step(self):
+        """Compute next step"""
+        loop = asyncio.get_running_loop()
+        if not isinstance(self.evaluator, _AwaitingEvaluator) or self.evaluator.loop is not loop:
+            self.evaluator = _AwaitingEvaluator(self.backend, loop)
+        return await loop.run_in_executor(self._thread, functools.partial(MMH.step, self))
+
+
+    async def run(self, step:int=0):
+        """Execute 'step' steps, or run forever if step <= 0"""
+        async for _ in self.corun(step):
+            pass
+
+
+    async def corun(self, step:int=0):
+        """Asynchronous generator. Execute 'step' steps, yielding populations
+        at each step, expecting to receive nothing or a new template config
+        (with asend).
+
+        If step is <= 0, will run forever.
+
+        """
+        if step > 0:
+            _range = range(self.current_step, self.current_step + step + 1)
+        else:  # run forever
+            _range = itertools.count(self.current_step)
+        try:
+            for step_num in _range:
+                self.config_template = (yield await self.step()) or self.config_template
+        finally:
+            self._end_progress()
@@ -0,0 +1,447 @@
+"""Benchmarks of the interpreter implementations.
+
+Run with `python benchmark.py`.
+
+"""
+
+import os
+import timeit
+
+from interpreter import load_interpreter, simplified_source_code, RunStatus
+
+
+MAX_OUT_SIZE = 2**14  # enough for the whole output of beer.bf
+
+
+# loop-heavy sources, similar to what evolution produce on long targets
+LOOP_HEAVY_SOURCES = (
+    '++++++++[>++++++++[>++++++++[>+>++<<-]<-]<-]>>>.',
+    '+[>++++[>+++++<-]>[<+++>-]<<-]>>.<<,[>+>+<<-]>[<+>-]>.',
+    '-[>+>++[-->+<]<<-]>>.>.' * 4,
+    ',[>+++[>++++[>+<-]<-]<-]>>>.' * 8,
+)
+
+
+# units as produced by the addition and number_complementary mutations
+EVOLVED_SOURCES = (
+    '+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++.++++++++++++++++++++++++++++++++++++++++++++.',
+    '>++++++++++[<+++++++++++>-]<-.---.+++++++.>++++[<-------->-]<.>++++++++[<++++++++>-]<+.',
+    '++++++++[>++++[>++>+++>+++>+<<<<-]>+>+>->>+[<]<-]>>.>---.+++++++..+++.>>.<-.<.+++.------.--------.>>+.',
+)
+
+
+# a long target, built like MOTIF in __main__.py
+LONG_TARGET = '\n' + (('/////' + '\\' * 5) * 6 + '\n') * 4
+LONG_TARGET += ((('\\' * 5 + '/////') * 6 + '\n') * 4 + LONG_TARGET[1:]) * 2
+LONG_TARGET += (('\\' * 5 + '/////') * 6 + '\n') * 4
+
+
+def naive_interprete(source:str, input:str='', max_output_size:int=MAX_OUT_SIZE) -> (str, int):
+    """Interprete given source character by character, as the C interpreter did
+    before compiling to its intermediate representation.
+
+    Return the output and the number of executed instructions.
+
+    """
+    source = simplified_source_code(source)
+    jumps, stack = {}, []
+    for idx, char in enumerate(source):
+        if char == '[':
+            stack.append(idx)
+        elif char == ']' and stack:
+            jumps[idx] = stack.pop()
+            jumps[jumps[idx]] = idx
+    memory, pointer, pc, steps = [0] * 2048, 0, 0, 0
+    input, output = list(input), []
+    while pc < len(source) and len(output) < max_output_size - 1:
+        char = source[pc]
+        if char == '>':
+            pointer = min(pointer + 1, len(memory) - 1)
+        elif char == '<':
+            pointer = max(pointer - 1, 0)
+        elif char in '+-':
+            memory[pointer] = (memory[pointer] + (1 if char == '+' else -1)) % 256
+        elif char == '0':
+            memory[pointer] = 0
+        elif char == ',':
+            memory[pointer] = ord(input.pop(0)) if input else 0
+        elif char == '.':
+            output.append(chr(memory[pointer] % 128))
+        elif char == '[' and not memory[pointer]:
+            pc = jumps.get(pc, len(source))
+        elif char == ']' and memory[pointer]:
+            pc = jumps.get(pc, len(source))
+        pc += 1
+        steps += 1
+    return ''.join(output), steps
+
+
+def read_source(filename:str) -> str:
+    with open(filename) as fd:
+        return ''.join(line.strip() for line in fd if line.strip())
+
+
+def timed(func:callable, number:int) -> float:
+    """Return the mean time in µs of given function"""
+    return timeit.timeit(func, number=number) / number * 1e6
+
+
+def benchmarked_sources() -> dict:
+    """Return {name: source} of the sources used in benchmarks"""
+    sources = {'beer.bf': read_source('sources/beer.bf')}
+    sources.update({'loop#{}'.format(idx): src for idx, src in enumerate(LOOP_HEAVY_SOURCES)})
+    sources.update({'evolved#{}'.format(idx): src for idx, src in enumerate(EVOLVED_SOURCES)})
+    return sources
+
+
+def bench_precompiled(number:int=50):
+    """Compare compile-at-each-call interpretation with reuse of a compiled program"""
+    interp = load_interpreter()
+    print('PRECOMPILED PROGRAMS (µs per run)')
+    for name, source in benchmarked_sources().items():
+        program = interp.program(source)
+        each_call = timed(lambda: interp.inline.__wrapped__(source, 'a', max_output_size=MAX_OUT_SIZE), number)
+        reused = timed(lambda: program.run('a', max_output_size=MAX_OUT_SIZE), number)
+        print(f'\t{name:<10} each call: {each_call:10.1f}\treused program: {reused:10.1f}')
+
+
+def bench_intermediate_representation():
+    """Compare the number of executed instructions before and after compilation"""
+    interp = load_interpreter()
+    print('INTERMEDIATE REPRESENTATION (executed instructions)')
+    for name, source in benchmarked_sources().items():
+        program = interp.program(source)
+        output, naive_steps = naive_interprete(source, 'a')
+        assert program.run('a', max_output_size=MAX_OUT_SIZE) == output.rstrip('\0'), name
+        steps = program.steps('a', max_output_size=MAX_OUT_SIZE)
+        print(f'\t{name:<10} source: {naive_steps:10}\tcompiled: {steps:10}\tratio: {naive_steps / steps:6.1f}')
+
+
+def random_population(size:int, max_steps:int=None, stdin:str='a') -> [str]:
+    """Return sources of a newly created population.
+
+    max_steps -- if given, keep only units terminating in less than max_steps
+        instructions, so that runaway units do not hide the measured overhead.
+
+    """
+    from creation import memory_oriented_diversity
+    interp = load_interpreter()
+    sources = []
+    while len(sources) < size:
+        for unit in memory_oriented_diversity(size - len(sources)):
+            if max_steps is None or interp.program(unit.source).steps(stdin, max_output_size=2048) < max_steps:
+                sources.append(unit.source)
+    return sources
+
+
+def bench_batch(pop_sizes:[int]=(400, 4000), number:int=5):
+    """Compare one call per unit with a single batch call for the whole population"""
+    interp = load_interpreter()
+    print('BATCH EVALUATION (ms per population)')
+    for pop_size in pop_sizes:
+        sources = random_population(pop_size, max_steps=10_000)
+        per_call = timed(lambda: [interp.inline.__wrapped__(source, 'a', max_output_size=2048) for source in sources], number)
+        batch = timed(lambda: list(interp.batch(sources, ['a'], max_output_size=2048)), number)
+        print(f'\t{pop_size:<10} per call: {per_call / 1000:10.1f}\tbatch: {batch / 1000:10.1f}')
+
+
+def bench_fused_scoring(pop_size:int=400, number:int=3):
+    """Compare scoring after complete runs with scoring during runs, aborted
+    when the unit can't reach the minimal score anymore.
+
+    """
+    import scoring
+    interp = load_interpreter()
+    stdin, expected = '/\\\n', LONG_TARGET
+    sources = random_population(pop_size, max_steps=100_000, stdin=stdin)
+    sources = [source + '+[.>+]' for source in sources]  # make them print a lot, like a long target requires
+    print(f'FUSED SCORING ON MOTIF (ms per population of {pop_size})')
+    def run_then_compare():
+        for source in sources:
+            found = interp.inline.__wrapped__(source, stdin, max_output_size=scoring.MAX_OUT_SIZE)
+            scoring.compare_str(expected, found)
+    full = timed(run_then_compare, number)
+    print(f'\t{"run then compare":<24} {full / 1000:10.1f}')
+    for min_score in (scoring.SCORE_MINIMAL, scoring.SCORE_BASE // 2):
+        bound = scoring.SCORE_BASE - min_score
+        fused = timed(lambda: [interp.inline_scored.__wrapped__(source, stdin, expected, bound, max_output_size=scoring.MAX_OUT_SIZE) for source in sources], number)
+        print(f'\t{"fused, min score " + str(min_score):<24} {fused / 1000:10.1f}')
+
+
+def bench_runaway_units(pop_size:int=400):
+    """Compare the time spent on a population, with and without cycle detection"""
+    interp = load_interpreter()
+    sources = random_population(pop_size)
+    print(f'RUNAWAY UNITS (ms per population of {pop_size})')
+    for detect_cycles in (False, True):
+        context = interp.context(2048, detect_cycles=detect_cycles)
+        programs = [interp.program(source) for source in sources]
+        def run_all():
+            runaways = 0
+            for program in programs:
+                context.run(program, 'a')
+                runaways += context.result.termination in (RunStatus.BUDGET, RunStatus.CYCLE)
+            return runaways
+        runaways = run_all()
+        duration = timed(run_all, 1)
+        print(f'\t{"cycle detection" if detect_cycles else "full budget":<16} {duration / 1000:10.1f}\t({runaways} runaway units)')
+
+
+def bench_prefix_checkpoints(pop_size:int=400, number:int=3):
+    """Compare direct runs of parents and children with runs starting from
+    the checkpoints of the prefixes they share.
+
+    """
+    import random
+    from unit import Unit
+    from crossing import crossby_pivot
+    interp = load_interpreter()
+    print(f'PREFIX CHECKPOINTS (ms per population of {pop_size} parents and {pop_size} children)')
+    for name, prefix in (('cheap prefix', '++++++++[>++++++++[>++++++++<-]<-]'), ('costly prefix', '-[>-[-<]<-]')):
+        parents = [prefix + source for source in random_population(pop_size, max_steps=100_000)]
+        children = [crossby_pivot([Unit(source) for source in random.sample(parents, 2)]) for _ in range(pop_size)]
+        def direct():
+            context = interp.context(2048)
+            for source in parents + children:
+                context.run(source, 'a')
+        def checkpointed():
+            checkpoints = interp.checkpoints('a', max_output_size=2048)
+            for source in parents + children:
+                checkpoints.run(source)
+        print(f'\t{name:<14} direct: {timed(direct, number) / 1000:10.1f}\tcheckpointed: {timed(checkpointed, number) / 1000:10.1f}')
+
+
+def bench_trace(number:int=50):
+    """Compare runs with and without the collection of their statistics"""
+    interp = load_interpreter()
+    context = interp.context(MAX_OUT_SIZE)
+    print('RUN TRACE (µs per run)')
+    for name, source in benchmarked_sources().items():
+        program = interp.program(source)
+        untraced = timed(lambda: context.run(program, 'a'), number)
+        traced = timed(lambda: context.trace(program, 'a'), number)
+        print(f'\t{name:<10} untraced: {untraced:10.1f}\ttraced: {traced:10.1f}')
+
+
+def bench_jit(number:int=50):
+    """Compare interpreted runs with runs of sources compiled to native code"""
+    interp = load_interpreter()
+    jit = interp.jit(min_runs=1)
+    print('NATIVE CODE (µs per run)')
+    for name, source in benchmarked_sources().items():
+        program = interp.program(source)
+        jit.inline(source, 'a', max_output_size=MAX_OUT_SIZE)  # compile it, if not already cached
+        native = jit.native(source)
+        interpreted = timed(lambda: program.run('a', max_output_size=MAX_OUT_SIZE), number)
+        compiled = timed(lambda: native.run('a', max_output_size=MAX_OUT_SIZE), number)
+        print(f'\t{name:<10} interpreted: {interpreted:10.1f}\tnative: {compiled:10.1f}')
+
+
+def bench_lockstep(pop_sizes:[int]=(400, 4000, 20_000, 100_000), number:int=1):
+    """Compare the batch evaluation of the C interpreter with the NumPy
+    lockstep interpreter, running all units together.
+
+    """
+    from lockstep import LockstepInterpreter
+    interp, lockstep = load_interpreter(), LockstepInterpreter()
+    print('LOCKSTEP EVALUATION (ms per population)')
+    sources = random_population(max(pop_sizes), max_steps=10_000)
+    for pop_size in pop_sizes:
+        population = sources[:pop_size]
+        c_batch = timed(lambda: list(interp.batch(population, ['a'], max_output_size=2048)), number)
+        numpy_batch = timed(lambda: list(lockstep.batch(population, ['a'], max_output_size=2048)), number)
+        print(f'\t{pop_size:<10} C batch: {c_batch / 1000:10.1f}\tlockstep: {numpy_batch / 1000:10.1f}')
+
+
+def bench_transpiled(number:int=10):
+    """Compare the C interpreter with the pure-Python transpiling fallback,
+    and with the naive interpretation it replaces"""
+    from transpiler import transpiled
+    interp = load_interpreter()
+    print('PYTHON FALLBACK (µs per run)')
+    for name, source in benchmarked_sources().items():
+        program, run = interp.program(source), transpiled(source)
+        c_run = timed(lambda: program.run('a', max_output_size=MAX_OUT_SIZE), number)
+        python_run = timed(lambda: run(b'a', MAX_OUT_SIZE - 1, 2**30), number)
+        naive_run = timed(lambda: naive_interprete(source, 'a'), number)
+        print(f'\t{name:<10} C: {c_run:10.1f}\ttranspiled: {python_run:10.1f}\tnaive: {naive_run:10.1f}')
+
+
+def bench_standalone_batch(pop_size:int=200):
+    """Compare one run of the standalone module per source with a single
+    run in batch mode, like when re-scoring an archived population.
+
+    """
+    import json, tempfile, subprocess
+    sources = random_population(pop_size, max_steps=10_000)
+    print('STANDALONE MODULE (ms per population)')
+    with tempfile.TemporaryDirectory() as tmpdir:
+        filenames = []
+        for idx, source in enumerate(sources):
+            filenames.append(os.path.join(tmpdir, f'{idx}.bf'))
+            with open(filenames[-1], 'w') as fd:
+                fd.write(source)
+        records = os.path.join(tmpdir, 'records.jsonl')
+        with open(records, 'w') as fd:
+            fd.writelines(json.dumps({'source': source, 'input': 'a'}) + '\n' for source in sources)
+        processes = timed(lambda: [subprocess.run(['./bfinterp', filename, 'a'], capture_output=True)
+                                   for filename in filenames], number=1)
+        batch = timed(lambda: subprocess.run(['./bfinterp', '--batch', records], capture_output=True), number=1)
+    print(f'\t{pop_size:<10} one process per source: {processes / 1000:10.1f}\tbatch: {batch / 1000:10.1f}')
+
+
+def bench_shared_cache(pop_size:int=1000, min_steps:int=2**12):
+    """Compare the scoring of a population by fresh worker processes,
+    without cache and with the cache shared by all processes, the second
+    generation re-scoring the units of the first one. Units running at
+    least min_steps instructions make the long-running population.
+
+    """
+    import tempfile, scoring, stepping
+    from unit import Unit
+    interp = load_interpreter()
+    sources = random_population(pop_size * 20)
+    populations = {
+        'random': sources[:pop_size],
+        'long': [source for source in sources if interp.program(source).steps('a', max_output_size=2048) >= min_steps][:pop_size],
+    }
+    print('SHARED RUN CACHE (ms per population)')
+    with tempfile.TemporaryDirectory() as tmpdir:
+        scoring.runcache.RUN_CACHE_PATH = os.path.join(tmpdir, 'runs')
+        for name, population in populations.items():
+            population = tuple(Unit(source) for source in population)
+            for shared in (False, True):
+                scoring.USE_SHARED_CACHE = shared
+                times = [timed(lambda: stepping._multisolve_scoring('a', 'hello', population, scoring.io_comparison), 1)
+                         for generation in range(2)]
+                print(f'\t{name:<8}{len(population):<6} {"shared" if shared else "per process":<12}'
+                      f' first: {times[0] / 1000:10.1f}\tsecond: {times[1] / 1000:10.1f}')
+        scoring.USE_SHARED_CACHE = False
+        print('\t', scoring.runcache.shared_cache(scoring.INTERPRETER).stats())
+
+def bench_scoring_backends(pop_sizes:[int]=(400, 4000, 50_000)):
+    """Compare the scoring of a population by the pool of processes
+    and by the pool of threads of stepping._multisolve_scoring.
+
+    """
+    import scoring, stepping
+    from unit import Unit
+    sources = random_population(max(pop_sizes))
+    print('SCORING BACKENDS (ms per population)')
+    for pop_size in pop_sizes:
+        population = tuple(Unit(source) for source in sources[:pop_size])
+        times = {backend: timed(lambda: stepping._multisolve_scoring('a', 'hello', population, scoring.io_comparison, backend), 1)
+                 for backend in stepping.BACKENDS}
+        print(f'\t{pop_size:<10}', '\t'.join(f'{backend}: {time / 1000:10.1f}' for backend, time in times.items()))
+
+
+def bench_evaluation_service(pop_sizes:[int]=(400, 4000), generations:int=5):
+    """Compare the scoring of successive generations by a pool of processes
+    created at each step, and by the long-lived evaluation.EvaluationService.
+
+    """
+    import scoring, stepping
+    from unit import Unit
+    from evaluation import EvaluationService
+    sources = random_population(max(pop_sizes) * generations)
+    print('EVALUATION SERVICE (ms per generation)')
+    for pop_size in pop_sizes:
+        populations = [tuple(Unit(source) for source in sources[start:start + pop_size])
+                       for start in range(0, pop_size * generations, pop_size)]
+        per_step = timed(lambda: [stepping._multisolve_scoring('a', 'hello', population, scoring.io_comparison)
+                                  for population in populations], 1) / generations
+        with EvaluationService() as service:
+            kept = timed(lambda: [stepping._multisolve_scoring('a', 'hello', population, scoring.io_comparison,
+                                                               evaluator=service)
+                                  for population in populations], 1) / generations
+        print(f'\t{pop_size:<10} pool per step: {per_step / 1000:10.1f}\tservice ({service.processes} workers): {kept / 1000:10.1f}')
+
+
+def bench_scheduling(pop_size:int=4000, slow_units:int=8, generations:int=3, processes:int=4):
+    """Compare the wall time of scoring a population with a few slow units,
+    divided by the CPU time of its units, with sources sent in population
+    order, or by decreasing predicted cost (evaluation.USE_COST_MODEL).
+
+    The ratio is also given for the measured CPU times of the units,
+    replayed on given number of workers, since it can only be
+    measured on a machine with that many CPUs.
+
+    """
+    import heapq, scoring, evaluation
+    from unit import Unit
+    from evaluation import EvaluationService
+
+    def replayed(costs:[float], ranges:[(int, int)]) -> float:
+        ends = [0.] * processes
+        for start, stop in ranges:  # each chunk given to the first idle worker
+            heapq.heappush(ends, heapq.heappop(ends) + sum(costs[start:stop]))
+        return max(ends) / sum(costs)
+
+    slow = [f'-[>-[>-[>-[>-<-]<-]<-]<-].{">" * idx}' for idx in range(slow_units)]
+    print(f'SCHEDULING (wall / cpu, {processes} workers, ideal {1 / processes:.2f})')
+    for use_cost_model in (False, True):
+        evaluation.USE_COST_MODEL = use_cost_model
+        ratios, replays = [], []
+        with EvaluationService(processes) as service:
+            for _ in range(generations):
+                # new units, and children of the slow ones, last in population order
+                population = tuple(Unit(source) for source in random_population(pop_size))
+                population += tuple(Unit(source + '+', parents=[source]) for source in slow)
+                predicted = [service.costs.predict(unit) for unit in population]
+                service.score(population, ('a', 'hello'), scoring.io_comparison)
+                ratios.append(service.last_stats.wall / service.last_stats.cpu)
+                costs = [service.costs.measured[unit.source] for unit in population]
+                if use_cost_model:
+                    costs = [cost for _, cost in sorted(zip(predicted, costs), reverse=True)]
+                    ranges = evaluation.guided_chunks(sorted(predicted, reverse=True), processes)
+                else:
+                    size = -(-len(costs) // (processes * evaluation.CHUNKS_PER_WORKER))
+                    ranges = [(start, start + size) for start in range(0, len(costs), size)]
+                replays.append(replayed(costs, ranges))
+        print(f'\t{"cost model" if use_cost_model else "population order":<20}',
+              'measured:', ' '.join(f'{ratio:.2f}' for ratio in ratios),
+              '\treplayed:', ' '.join(f'{ratio:.2f}' for ratio in replays))
+    evaluation.USE_COST_MODEL = True
+
+
+def bench_create_in_workers(pop_sizes:[int]=(4000, 20_000), processes:int=None):
+    """Compare the creation and scoring of a generation, with the children
+    created by the coordinator, or by the workers (stepping.step create_in_workers).
+
+    """
+    import scoring, stepping, selection, reproduction, crossing, mutator
+    from unit import Unit
+    from evaluation import EvaluationService
+    select, reproduce = selection.named_functions('RSD'), reproduction.named_functions('PRW')
+    cross, mutate = crossing.named_functions('CP'), mutator.named_functions('ALL')
+    test = 'a', 'hello'
+    print('CREATE IN WORKERS (ms per generation)')
+    for pop_size in pop_sizes:
+        with EvaluationService(processes) as service:
+            pop = tuple(Unit(source) for source in random_population(pop_size))
+            selected = dict(select(service.score(pop, test, scoring.io_comparison)))
+            coordinator = timed(lambda: stepping._multisolve_scoring(
+                *test, tuple(reproduce(selected, pop_size, cross, mutator=mutate)), scoring.io_comparison, evaluator=service), 1)
+            workers = timed(lambda: stepping._multisolve_scoring(
+                *test, stepping._create_scored(selected, pop_size, reproduce, cross, mutate, test, scoring.io_comparison, service),
+                scoring.io_comparison, evaluator=service), 1)
+        print(f'\t{pop_size:<10} coordinator: {coordinator / 1000:10.1f}\tworkers ({service.processes}): {workers / 1000:10.1f}')
+
+
+if __name__ == "__main__":
+    bench_precompiled()
+    bench_intermediate_representation()
+    bench_batch()
+    bench_fused_scoring()
+    bench_runaway_units()
+    bench_prefix_checkpoints()
+    bench_trace()
+    bench_jit()
+    bench_lockstep()
+    bench_transpiled()
+    bench_standalone_batch()
+    bench_shared_cache()
+    bench_scoring_backends()
+    bench_evaluation_service()
+    bench_scheduling()
+    bench_create_in_workers()
@@ -1,251 +1,772 @@
 #include "bfinterp.h"
 
 
-const uint64_t MEMORY_SIZE = 2048;
-const uint64_t MAXIMAL_MATCH_NUMBER = 512*2;
+const uint64_t MEMORY_SIZE = BF_MEMORY_SIZE;
 const uint64_t MAXIMAL_INSTRUCTION_EXECUTION = 2048*2048*8;
 
 
-char* get_matching_bracket(char const* position, char*** opening, char*** closing, uint64_t nb_match) {
+enum { LOOP_KEPT, LOOP_REPLACED, LOOP_PRECEDED };
+
+
+static uint64_t execute(bf_context* context, bf_program const* program,
+                        char const* input, const uint64_t input_size,
+                        char* output, const uint64_t output_size, const uint8_t resume);
+
+
+// Distance between two letters, as computed by compare_str.c.
+static inline uint64_t letter_distance(const char expected, const char found) {
+    const int8_t one = (int8_t)(expected % (INT8_MAX + 1));
+    const int8_t two = (int8_t)(found % (INT8_MAX + 1));
+    const int64_t diff = one - two;
+    return (uint64_t)(diff < 0 ? -diff : diff) % (INT8_MAX + 1);
+}
+
+
+static inline int32_t clamp(const int32_t value, const int32_t lo, const int32_t hi) {
+    return value < lo ? lo : (value > hi ? hi : value);
+}
+
+
+// Return a copy of source code where the empty loops are removed,
+//  then the [-] loops (with any number of -) are replaced by 0,
+//  in the same way than interpreter.simplified_source_code.
+//  origins[i] is set to the index in source code of the i-th character.
+uint64_t simplify_source(char const* source_code, const uint64_t size,
+                         char* simplified, uint32_t* origins) {
     LOGOK
-    for(uint64_t i = 0; i < nb_match; i++) {
-        LOGOK
-        if((*opening)[i] == position) {
-            LOGOK
-            return (*closing)[i];
+    // first pass: remove the empty loops, as str.replace('[]', '') does
+    uint64_t len = 0;
+    for(uint64_t i = 0 ; i < size ; i++) {
+        if(source_code[i] == '[' && i + 1 < size && source_code[i+1] == ']') {
+            ++i;
+        } else {
+            simplified[len] = source_code[i];
+            origins[len] = i;
+            ++len;
         }
     }
-    LOGOK
-    return NULL;  // no matching char
+    // second pass, inplace: replace [-+] by 0, as re.sub(r"\[-+]", '0') does
+    uint64_t final_len = 0;
+    for(uint64_t i = 0 ; i < len ; i++) {
+        if(simplified[i] == '[' && i + 1 < len && simplified[i+1] == '-') {
+            uint64_t j = i + 1;
+            while(j < len && simplified[j] == '-') ++j;
+            if(j < len && simplified[j] == ']') {
+                simplified[final_len] = '0';
+                origins[final_len] = origins[i];
+                ++final_len;
+                i = j;
+                continue;
+            }
+        }
+        simplified[final_len] = simplified[i];
+        origins[final_len] = origins[i];
+        ++final_len;
+    }
+    simplified[final_len] = '\0';
+    return final_len;
 }
 
-// return number of matching structure
-uint64_t get_matching_structs(char* source_code, uint64_t source_code_size, char*** opening, char*** closing) {
-    LOGOK
-    uint64_t cur_struct = 0;
-    *opening = (char**)malloc(MAXIMAL_MATCH_NUMBER * sizeof(char*));
-    *closing = (char**)malloc(MAXIMAL_MATCH_NUMBER * sizeof(char*));
-    if(opening == NULL) {
-        fprintf(stderr, "Malloc of opening brackets container failed.\n");
-        exit(1);
+
+// Return the last emitted op of given program, or NULL if there is none.
+static inline bf_op* last_op(bf_program* program) {
+    return program->size ? &program->ops[program->size - 1] : NULL;
+}
+
+
+// Emit a new op in given program, and return it.
+static bf_op* emit(bf_program* program, const uint8_t code, const int32_t arg, const uint32_t src) {
+    bf_op* op = &program->ops[program->size];
+    op->code = code;
+    op->arg = arg;
+    op->lo = 0;
+    op->hi = MEMORY_SIZE - 1;
+    op->first = 0;
+    op->count = 0;
+    op->src = src;
+    ++program->size;
+    return op;
+}
+
+
+// Fold one move into last op if possible, or emit a new one.
+//  The moves are composed exactly, including the fact that the memory
+//  pointer can't go before or beyond the memory: a sequence of moves
+//  is always equivalent to p = clamp(p + arg, lo, hi).
+static void emit_move(bf_program* program, const int32_t delta, const uint32_t src) {
+    bf_op* op = last_op(program);
+    if(op == NULL || op->code != OP_MOVE) {
+        op = emit(program, OP_MOVE, 0, src);
     }
-    if(closing == NULL) {
-        fprintf(stderr, "Malloc of opening brackets container failed.\n");
-        exit(1);
+    op->arg += delta;
+    op->lo = clamp(op->lo + delta, 0, MEMORY_SIZE - 1);
+    op->hi = clamp(op->hi + delta, 0, MEMORY_SIZE - 1);
+    if(op->arg == 0 && op->lo == 0 && op->hi == MEMORY_SIZE - 1) {
+        --program->size;  // moves cancelled each others
+    }
+}
+
+
+static void emit_add(bf_program* program, const int32_t value, const uint32_t src) {
+    bf_op* op = last_op(program);
+    if(op == NULL || op->code != OP_ADD) {
+        op = emit(program, OP_ADD, 0, src);
+    }
+    op->arg = (uint8_t)(op->arg + value);
+    if(op->arg == 0) {
+        --program->size;  // additions cancelled each others
+    }
+}
+
+
+// Emit a repeatable op (input or output), folding it with last op if possible.
+static void emit_repeated(bf_program* program, const uint8_t code, const uint32_t src) {
+    bf_op* op = last_op(program);
+    if(op != NULL && op->code == code) {
+        ++op->arg;
+    } else {
+        emit(program, code, 1, src);
+    }
+}
+
+
+// Try to replace the loop starting at given op by a specialized op,
+//  knowing its body in the simplified source code.
+//  Return LOOP_KEPT, LOOP_REPLACED if the loop was replaced by
+//  a specialized op, or LOOP_PRECEDED if a specialized op was inserted before.
+static int specialize_loop(bf_program* program, const uint64_t start,
+                           char const* body, const uint64_t body_size) {
+    int32_t offset = 0, min_offset = 0, max_offset = 0;
+    int32_t deltas[2*BF_MAXIMAL_MUL_OFFSET+1] = {0};
+    for(uint64_t i = 0 ; i < body_size ; i++) {
+        switch(body[i]) {
+            case '>': ++offset; break;
+            case '<': --offset; break;
+            case '+': case '-':
+                if(offset < -BF_MAXIMAL_MUL_OFFSET || offset > BF_MAXIMAL_MUL_OFFSET) return LOOP_KEPT;
+                deltas[offset + BF_MAXIMAL_MUL_OFFSET] += body[i] == '+' ? 1 : -1;
+                break;
+            case '[': case ']': case ',': case '.': case '0': case '!':
+                return LOOP_KEPT;  // not a simple loop
+        }
+        min_offset = offset < min_offset ? offset : min_offset;
+        max_offset = offset > max_offset ? offset : max_offset;
     }
-    char** stack = (char**)malloc(MAXIMAL_MATCH_NUMBER * sizeof(char*));
-    char** p_stack = stack;
-    for(uint64_t i = 0 ; i < MAXIMAL_MATCH_NUMBER; i++) {
-        (*opening)[i] = NULL;
-        (*closing)[i] = NULL;
+    const uint64_t body_ops = program->size - start - 1;
+    bf_op* loop = &program->ops[start];
+    bf_op* first = &program->ops[start + 1];
+
+    // scan loop, like [>] or [<<]: the body is a single move
+    if(body_ops == 1 && first->code == OP_MOVE) {
+        loop->code = OP_SCAN;
+        loop->arg = first->arg;
+        loop->lo = first->lo;
+        loop->hi = first->hi;
+        program->size = start + 1;
+        return LOOP_REPLACED;
     }
+    if(offset != 0) return LOOP_KEPT;
+    const int32_t origin_delta = (uint8_t)deltas[BF_MAXIMAL_MUL_OFFSET];
+    // clear loop, like [+] or [---]: the body only changes the current cell
+    //  of an odd value, so that it will reach 0
+    if(body_ops == 1 && first->code == OP_ADD && first->arg % 2) {
+        loop->code = OP_CLEAR;
+        program->size = start + 1;
+        return LOOP_REPLACED;
+    }
+    // move/multiply loop, like [->+>++<<]: the current cell is decremented
+    //  (or incremented) by one, and its value is multiplied into others
+    if(origin_delta != 1 && origin_delta != UINT8_MAX) return LOOP_KEPT;
+    // the op is placed before the loop, that is kept as a fallback
+    //  in case the pointer would reach memory boundaries
+    memmove(loop + 1, loop, (body_ops + 1) * sizeof(bf_op));
+    ++program->size;
+    loop->code = OP_MUL;
+    loop->lo = min_offset;
+    loop->hi = max_offset;
+    loop->first = program->nb_terms;
+    for(int32_t off = -BF_MAXIMAL_MUL_OFFSET ; off <= BF_MAXIMAL_MUL_OFFSET ; off++) {
+        const uint8_t factor = (uint8_t)deltas[off + BF_MAXIMAL_MUL_OFFSET];
+        if(factor != 0 || off == 0) {  // origin is always the first term
+            bf_term* term = &program->terms[program->nb_terms + (off == 0 ? 0 : ++loop->count)];
+            term->offset = off;
+            term->factor = factor;
+        }
+    }
+    program->nb_terms += loop->count + 1;
+    return LOOP_PRECEDED;
+}
+
+
+// Build the ops of given program from the simplified source code.
+void lower(bf_program* program, char const* code, const uint64_t size,
+           uint32_t const* origins, uint64_t* stack) {
     LOGOK
-    for(uint64_t i = 0 ; i < source_code_size; i++) {
-        switch (source_code[i]) {
+    uint64_t* p_stack = stack;  // pairs (op index, index in code) of opened loops
+    for(uint64_t i = 0 ; i < size ; i++) {
+        const uint32_t src = origins[i];
+        switch(code[i]) {
+            case '>': emit_move(program, 1, src); break;
+            case '<': emit_move(program, -1, src); break;
+            case '+': emit_add(program, 1, src); break;
+            case '-': emit_add(program, -1, src); break;
+            case ',': emit_repeated(program, OP_IN, src); break;
+            case '.': emit_repeated(program, OP_OUT, src); break;
+#ifdef EXT_SET_ZERO
+            case '0': emit(program, OP_CLEAR, 0, src); break;  // replaces [-]
+#endif
+            case '!': emit(program, OP_BREAKPOINT, 0, src); break;
             case '[':
-                (*p_stack) = &source_code[i];
-                ++p_stack;
+                p_stack[0] = program->size;
+                p_stack[1] = i;
+                p_stack += 2;
+                emit(program, OP_JZ, BF_UNMATCHED, src);
                 break;
             case ']':
-                if(p_stack == stack) {  // nothing on stack
-                    (*opening)[cur_struct] = NULL;
-                } else {  // regular case: something on stack
-                    --p_stack;
-                    (*opening)[cur_struct] = *p_stack;
+                if(p_stack == stack) {  // nothing on stack, no matching bracket
+                    emit(program, OP_JNZ, BF_UNMATCHED, src);
+                    break;
                 }
-                (*closing)[cur_struct] = &source_code[i];
-                ++cur_struct;
+                p_stack -= 2;
+                uint64_t start = p_stack[0];
+                const int kind = specialize_loop(program, start, &code[p_stack[1] + 1], i - p_stack[1] - 1);
+                if(kind == LOOP_REPLACED) break;
+                if(kind == LOOP_PRECEDED) ++start;  // the loop itself is just after
+                // go directly to next instruction, not to matching bracket
+                emit(program, OP_JNZ, start + 1, src);
+                program->ops[start].arg = program->size;
+                if(kind == LOOP_PRECEDED) program->ops[start - 1].arg = program->size;
                 break;
         }
     }
     LOGOK
-    while(p_stack > stack) {
-        (*opening)[cur_struct] = *p_stack;
-        (*closing)[cur_struct] = NULL;
-        ++cur_struct;
-        --p_stack;
+    // an unmatched jump leads to the end of the program
+    for(uint64_t i = 0 ; i < program->size ; i++) {
+        if(program->ops[i].arg == BF_UNMATCHED && (program->ops[i].code == OP_JZ || program->ops[i].code == OP_JNZ)) {
+            program->ops[i].arg = program->size;
+        }
+    }
+}
+
+
+// Ensure that given program and scratch tables can handle a source of given size.
+//  There is at most one op per character, plus one per mul loop.
+static void reserve(bf_program* program, bf_scratch* scratch, const uint64_t size) {
+    if(size < program->capacity && size < scratch->capacity) return;
+    const uint64_t capacity = 2 * size + 1;
+    program->ops = (bf_op*)realloc(program->ops, capacity * sizeof(bf_op));
+    program->terms = (bf_term*)realloc(program->terms, capacity * sizeof(bf_term));
+    scratch->simplified = (char*)realloc(scratch->simplified, capacity * sizeof(char));
+    scratch->origins = (uint32_t*)realloc(scratch->origins, capacity * sizeof(uint32_t));
+    scratch->stack = (uint64_t*)realloc(scratch->stack, 2 * capacity * sizeof(uint64_t));
+    if(program->ops == NULL || program->terms == NULL || scratch->simplified == NULL
+       || scratch->origins == NULL || scratch->stack == NULL) {
+        fprintf(stderr, "Malloc of program content failed.\n");
+        exit(1);
     }
+    program->capacity = scratch->capacity = capacity;
+}
+
+
+// Compile given source in given program, using given scratch tables.
+static void compile_into(bf_program* program, bf_scratch* scratch,
+                         char const* source_code, const uint64_t size) {
+    reserve(program, scratch, size);
+    program->size = 0;
+    program->nb_terms = 0;
+    const uint64_t simplified_size = simplify_source(source_code, size, scratch->simplified, scratch->origins);
+    lower(program, scratch->simplified, simplified_size, scratch->origins, scratch->stack);
+#ifdef DEBUG
+    print_program(program);
+#endif
+}
+
+
+static void free_scratch(bf_scratch* scratch) {
+    free(scratch->simplified);
+    free(scratch->origins);
+    free(scratch->stack);
+}
+
+
+bf_program* compile_bf(char const* source_code) {
+    return compile_sized_bf(source_code, strlen(source_code));
+}
+
+
+bf_program* compile_sized_bf(char const* source_code, const uint64_t size) {
     LOGOK
-    return cur_struct;
+    bf_program* program = (bf_program*)calloc(1, sizeof(bf_program));
+    if(program == NULL) {
+        fprintf(stderr, "Malloc of program failed.\n");
+        exit(1);
+    }
+    bf_scratch scratch = {0};
+    compile_into(program, &scratch, source_code, size);
+    free_scratch(&scratch);
+    return program;
 }
 
 
-void interpret_bf(char* source_code, char* input, char* output, const uint64_t output_size) {
+void free_bf(bf_program* program) {
+    if(program == NULL) return;
+    free(program->ops);
+    free(program->terms);
+    free(program);
+}
+
 
-    uint64_t instruction_count = 0;  // incremented at each instruction
-    const uint64_t SOURCE_SIZE = strlen(source_code);
-    const uint64_t INPUT_SIZE = strlen(input);
-    uint8_t memory[MEMORY_SIZE];
-    for(uint64_t i = 0 ; i < MEMORY_SIZE ; i++) { memory[i] = 0; }
-    uint8_t* p_mem = memory;
-    char const* p_src = source_code;
-    char const* p_input = input;
-    char* p_output = output;
+uint64_t program_size(bf_program const* program) {
+    return program->size;
+}
 
-    // Get matching brackets
-    char** openings;
-    char** closings;
-    uint64_t nb_match = get_matching_structs(source_code, SOURCE_SIZE, &openings, &closings);
 
-#ifdef DEBUG
-    printf("%d matches = {", (int)nb_match);
-    for(uint64_t i = 0; i < nb_match ; i++) {
-        printf("\t%p -> %p\n", openings[i], closings[i]);
+bf_op const* program_ops(bf_program const* program) {
+    return program->ops;
+}
+
+
+bf_term const* program_terms(bf_program const* program) {
+    return program->terms;
+}
+
+
+bf_context* new_context(const uint64_t output_size) {
+    bf_context* context = (bf_context*)calloc(1, sizeof(bf_context));
+    if(context == NULL) {
+        fprintf(stderr, "Malloc of context failed.\n");
+        exit(1);
+    }
+    context->output_size = output_size;
+    configure_context(context, 0, 1);
+    if(output_size) {
+        context->output = (char*)calloc(output_size, sizeof(char));
+        if(context->output == NULL) {
+            fprintf(stderr, "Malloc of context output failed.\n");
+            exit(1);
+        }
+    }
+    return context;
+}
+
+
+void free_context(bf_context* context) {
+    if(context == NULL) return;
+    free(context->output);
+    free(context->program.ops);
+    free(context->program.terms);
+    free_scratch(&context->scratch);
+    free(context);
+}
+
+
+char* context_output(bf_context const* context) {
+    return context->output;
+}
+
+
+bf_result const* context_result(bf_context const* context) {
+    return &context->result;
+}
+
+
+void configure_context(bf_context* context, const uint64_t budget, const uint8_t detect_cycles) {
+    context->budget = budget ? budget : MAXIMAL_INSTRUCTION_EXECUTION;
+    context->detect_cycles = detect_cycles;
+}
+
+
+void context_trace(bf_context* context, bf_trace* trace) {
+    context->trace = trace;
+}
+
+
+uint64_t context_run(bf_context* context, bf_program const* program,
+                     char const* input, const uint64_t input_size) {
+    return execute(context, program, input, input_size, context->output, context->output_size, 0);
+}
+
+
+uint64_t context_interpret(bf_context* context, char const* source_code, const uint64_t source_size,
+                           char const* input, const uint64_t input_size) {
+    compile_into(&context->program, &context->scratch, source_code, source_size);
+    return context_run(context, &context->program, input, input_size);
+}
+
+
+uint64_t context_score(bf_context* context, bf_program const* program,
+                       char const* input, const uint64_t input_size,
+                       char const* expected, const uint64_t expected_size, const uint64_t bound) {
+    context->expected = expected;
+    context->expected_size = expected_size;
+    context->bound = bound;
+    context_run(context, program, input, input_size);
+    context->expected = NULL;
+    return context->result.distance;
+}
+
+
+uint64_t context_interpret_score(bf_context* context, char const* source_code, const uint64_t source_size,
+                                 char const* input, const uint64_t input_size,
+                                 char const* expected, const uint64_t expected_size, const uint64_t bound) {
+    compile_into(&context->program, &context->scratch, source_code, source_size);
+    return context_score(context, &context->program, input, input_size, expected, expected_size, bound);
+}
+
+
+bf_checkpoint* context_checkpoint(bf_context const* context) {
+    const uint64_t memory_size = context->dirty + 1;
+    const uint64_t output_length = context->result.output_length;
+    bf_checkpoint* checkpoint = (bf_checkpoint*)malloc(sizeof(bf_checkpoint) + memory_size + output_length);
+    if(checkpoint == NULL) {
+        fprintf(stderr, "Malloc of checkpoint failed.\n");
+        exit(1);
+    }
+    checkpoint->result = context->result;
+    checkpoint->dirty = context->dirty;
+    checkpoint->pointer = context->pointer;
+    checkpoint->input_position = context->input_position;
+    checkpoint->written_distance = context->written_distance;
+    checkpoint->memory = (uint8_t*)(checkpoint + 1);
+    checkpoint->output = (char*)(checkpoint->memory + memory_size);
+    memcpy(checkpoint->memory, context->memory, memory_size);
+    memcpy(checkpoint->output, context->output, output_length);
+    return checkpoint;
+}
+
+
+void free_checkpoint(bf_checkpoint* checkpoint) {
+    free(checkpoint);
+}
+
+
+void context_restore(bf_context* context, bf_checkpoint const* checkpoint) {
+    memset(context->memory, 0, context->dirty + 1);
+    if(checkpoint == NULL) {
+        memset(&context->result, 0, sizeof(bf_result));
+        context->dirty = context->pointer = 0;
+        context->input_position = context->written_distance = 0;
+        return;
+    }
+    context->result = checkpoint->result;
+    context->dirty = checkpoint->dirty;
+    context->pointer = checkpoint->pointer;
+    context->input_position = checkpoint->input_position;
+    context->written_distance = checkpoint->written_distance;
+    memcpy(context->memory, checkpoint->memory, checkpoint->dirty + 1);
+    memcpy(context->output, checkpoint->output, checkpoint->result.output_length);
+}
+
+
+uint64_t context_continue(bf_context* context, char const* source_code, const uint64_t source_size,
+                          char const* input, const uint64_t input_size,
+                          char const* expected, const uint64_t expected_size, const uint64_t bound) {
+    compile_into(&context->program, &context->scratch, source_code, source_size);
+    context->expected = expected;
+    context->expected_size = expected_size;
+    context->bound = bound;
+    const uint64_t output_length = execute(context, &context->program, input, input_size,
+                                           context->output, context->output_size, 1);
+    context->expected = NULL;
+    return output_length;
+}
+
+
+uint64_t interpret_bf(char* source_code, char* input, char* output, const uint64_t output_size) {
+    bf_program* program = compile_bf(source_code);
+    const uint64_t instruction_count = run_bf(program, input, output, output_size);
+    free_bf(program);
+    return instruction_count;
+}
+
+
+uint64_t run_bf(bf_program const* program, char* input, char* output, const uint64_t output_size) {
+    bf_context* context = new_context(0);
+    execute(context, program, input, strlen(input), output, output_size, 0);
+    const uint64_t instruction_count = context->result.steps;
+    free_context(context);
+    return instruction_count;
+}
+
+
+void run_bf_batch(char const* sources, uint64_t const* source_offsets, const uint64_t nb_sources,
+                  char const* inputs, uint64_t const* input_offsets, const uint64_t nb_inputs,
+                  char* outputs, uint64_t* output_lengths, const uint64_t output_size) {
+    bf_context* context = new_context(0);
+    for(uint64_t i = 0 ; i < nb_sources ; i++) {
+        compile_into(&context->program, &context->scratch, &sources[source_offsets[i]],
+                     source_offsets[i+1] - source_offsets[i]);
+        for(uint64_t j = 0 ; j < nb_inputs ; j++) {
+            const uint64_t k = i * nb_inputs + j;
+            output_lengths[k] = execute(
+                context, &context->program,
+                &inputs[input_offsets[j]], input_offsets[j+1] - input_offsets[j],
+                &outputs[k * output_size], output_size, 0
+            );
+        }
+    }
+    free_context(context);
+}
+
+
+// Run given program on given input, using the memory of given context.
+//  Output is null-terminated, and at most output_size-1 characters long.
+//  Return the output length ; the number of executed instructions
+//  is kept in the context.
+//  If resume is set, the run starts in the state where the last run of the
+//  context ended (or was restored), as if the program was appended to the
+//  previous one. Such a run does nothing if the previous one didn't reach its end.
+//  If tracing is set, the statistics of the run are collected in the context trace.
+//  This function is inlined with a constant tracing, so that runs without
+//  trace don't pay for its collection.
+static inline __attribute__((always_inline)) uint64_t execute_ops(
+        bf_context* context, bf_program const* program,
+        char const* input, const uint64_t INPUT_SIZE,
+        char* output, const uint64_t output_size, const uint8_t resume, const uint8_t tracing) {
+
+    uint64_t instruction_count = resume ? context->result.steps : 0;  // incremented at each instruction
+    const uint64_t budget = context->budget;
+    bf_op const* const ops = program->ops;
+    const uint64_t PROGRAM_SIZE = resume && context->result.termination != BF_END ? 0 : program->size;
+    uint8_t* const memory = context->memory;
+    if(!resume) {  // only the memory used by previous run needs to be reset
+        memset(memory, 0, context->dirty + 1);
+    }
+    int32_t dirty = resume ? context->dirty : 0;  // highest memory cell written during this run
+    uint8_t termination = resume ? context->result.termination : BF_END;
+    // when an expected output is given, the distance is computed during the run
+    char const* const expected = context->expected;
+    const uint64_t expected_size = context->expected_size;
+    uint64_t distance = resume ? context->written_distance : 0;
+    int32_t p = resume ? context->pointer : 0;  // index of the current memory cell
+    uint64_t pc = 0;  // index of the current op
+    char const* p_input = resume ? &input[context->input_position] : input;
+    char* p_output = resume ? &output[context->result.output_length] : output;
+    // Cycle detection (Brent): the state at a loop back jump is saved each time
+    //  the number of back jumps reaches a power of two, and compared to the states
+    //  met until the next save. A run coming back to a saved state loops forever.
+    //  Memory beyond dirty is zero, so only the dirty part is saved and compared.
+    uint8_t* const snapshot = context->snapshot;
+    uint64_t snapshot_pc = PROGRAM_SIZE;  // no state saved yet
+    int32_t snapshot_p = 0, snapshot_dirty = 0;
+    char const* snapshot_input = NULL;
+    char const* snapshot_output = NULL;
+    uint64_t back_jumps = 0, next_snapshot = 1;
+    bf_trace* const trace = context->trace;
+    if(tracing && !resume) {
+        memset(trace->counts, 0, trace->counts_size * sizeof(uint64_t));
     }
-    printf("}\n");
-#endif
 
-    while(p_src != NULL && p_src < &source_code[SOURCE_SIZE] && instruction_count < MAXIMAL_INSTRUCTION_EXECUTION) {
+    while(pc < PROGRAM_SIZE && instruction_count < budget) {
         LOGOK
-        const char statement = *p_src;
-        //printf("%c %i\n", statement, (int)statement);
-        switch(statement) {
-            case '>':
-                // avoid going beyond memory
-                p_mem < &memory[MEMORY_SIZE-1] ? ++p_mem : NULL ;
-                ++p_src;
-                break;
-            case '<':
-                // avoid going before memory
-                p_mem > memory ? --p_mem : NULL ;
-                ++p_src;
-                break;
-            case '+':
-                ++(*p_mem);
-                ++p_src;
+        bf_op const* const op = &ops[pc];
+        if(tracing && op->src < trace->counts_size) {
+            ++trace->counts[op->src];
+        }
+        switch(op->code) {
+            case OP_MOVE:
+                // avoid going before or beyond memory
+                p = clamp(p + op->arg, op->lo, op->hi);
+                dirty = p > dirty ? p : dirty;
+                ++pc;
                 break;
-            case '-':
-                --(*p_mem);
-                ++p_src;
+            case OP_ADD:
+                memory[p] += op->arg;
+                ++pc;
                 break;
-            case ',':
+            case OP_IN:
                 LOGOK
-                if(p_input < &input[INPUT_SIZE]) {
-                    *p_mem = *p_input;
-                    ++p_input;
-                } else {
-                    *p_mem = '\0';
+                for(int32_t i = 0 ; i < op->arg ; i++) {
+                    if(p_input < &input[INPUT_SIZE]) {
+                        memory[p] = *p_input;
+                        ++p_input;
+                    } else {
+                        memory[p] = '\0';
+                    }
                 }
-                ++p_src;
+                ++pc;
                 break;
-            case '.':
+            case OP_OUT:
+                for(int32_t i = 0 ; i < op->arg ; i++) {
 #ifdef NO_EXTENDED_ASCII
-                // The modulo 128 is here to prevent output of extended
-                //  ascii letters, that are encoded on two bytes and
-                //  that have an ascii number > 128.
-                *p_output = (*p_mem) % 128;
+                    // The modulo 128 is here to prevent output of extended
+                    //  ascii letters, that are encoded on two bytes and
+                    //  that have an ascii number > 128.
+                    *p_output = memory[p] % 128;
 #else
-                *p_output = *p_mem;
+                    *p_output = memory[p];
 #endif
-                ++p_output;
-                ++p_src;
-                if(p_output >= &output[output_size-1]) {
+                    if(tracing) {
+                        trace->output_sources[p_output - output] = op->src;
+                    }
+                    if(expected != NULL) {
+                        const uint64_t idx = p_output - output;
+                        distance += idx < expected_size ? letter_distance(expected[idx], *p_output) : UINT8_MAX;
+                        if(distance > context->bound) {  // this run can't reach expected score
+                            ++p_output;
+                            ++instruction_count;
+                            termination = BF_ABORTED;
+                            goto end;
+                        }
+                    }
+                    ++p_output;
+                    if(p_output >= &output[output_size-1]) {
 #ifdef LOG_TOO_MUCH_OUTPUT
-                    fprintf(stderr, "ERROR: too much output. End.\n");
+                        fprintf(stderr, "ERROR: too much output. End.\n");
 #endif
-                    return;
+                        ++instruction_count;
+                        termination = BF_OUTPUT_FULL;
+                        goto end;
+                    }
                 }
+                ++pc;
                 break;
-#ifdef EXT_SET_ZERO
-            case '0':  // replaces [-]
-                *p_mem = 0;
-                ++p_src;
+            case OP_CLEAR:
+                memory[p] = 0;
+                ++pc;
                 break;
-#endif
-            case '[':
-                LOGOK
-                if(!*p_mem) {
-                    LOGOK
-                    p_src = get_matching_bracket(
-                        p_src,
-                        &openings,
-                        &closings,
-                        nb_match
-                    );
-                    LOGOK
-                    // go directly to next instruction, not to matching bracket
-                    if(p_src != NULL) ++p_src;
-                    LOGOK
-                } else {
-                    LOGOK
-                    ++p_src;
+            case OP_SCAN:
+                while(memory[p]) {
+                    const int32_t next = clamp(p + op->arg, op->lo, op->hi);
+                    if(next == p && context->detect_cycles) {
+                        // stuck on a memory boundary: the loop never ends
+                        ++instruction_count;
+                        termination = BF_CYCLE;
+                        goto end;
+                    }
+                    if(next == p || instruction_count >= budget) {
+                        instruction_count = budget;
+                        break;
+                    }
+                    p = next;
+                    ++instruction_count;
+                    if(tracing && op->src < trace->counts_size) {
+                        ++trace->counts[op->src];
+                    }
                 }
-                LOGOK
+                dirty = p > dirty ? p : dirty;
+                ++pc;
                 break;
-            case ']':
-                LOGOK
-                if(*p_mem) {
-                    LOGOK
-                    p_src = get_matching_bracket(
-                        p_src,
-                        &closings,  // revert the search
-                        &openings,
-                        nb_match
-                    );
-                    // go directly to next instruction, not to matching bracket
-                    if(p_src != NULL) ++p_src;
-                } else {
-                    ++p_src;
+            case OP_MUL:
+                if(p + op->lo < 0 || p + op->hi >= (int32_t)MEMORY_SIZE) {
+                    ++pc;  // the loop would reach memory boundaries: run it
+                    break;
+                }
+                dirty = p + op->hi > dirty ? p + op->hi : dirty;
+                if(memory[p]) {
+                    bf_term const* const terms = &program->terms[op->first];
+                    // number of iterations before reaching 0
+                    const uint8_t times = terms[0].factor == 1 ? -memory[p] : memory[p];
+                    for(uint32_t i = 1 ; i <= op->count ; i++) {
+                        memory[p + terms[i].offset] += terms[i].factor * times;
+                    }
+                    memory[p] = 0;
+                }
+                pc = op->arg;
+                break;
+            case OP_JZ:
+                pc = memory[p] ? pc + 1 : (uint64_t)op->arg;
+                break;
+            case OP_JNZ:
+                if(!memory[p]) {
+                    ++pc;
+                    break;
+                }
+                pc = op->arg;
+                if(context->detect_cycles) {
+                    if(pc == snapshot_pc && p == snapshot_p && dirty == snapshot_dirty
+                       && p_input == snapshot_input && p_output == snapshot_output
+                       && memory[p] == snapshot[p] && memcmp(memory, snapshot, dirty + 1) == 0) {
+                        ++instruction_count;
+                        termination = BF_CYCLE;
+                        goto end;
+                    }
+                    if(++back_jumps == next_snapshot) {
+                        next_snapshot *= 2;
+                        snapshot_pc = pc;
+                        snapshot_p = p;
+                        snapshot_dirty = dirty;
+                        snapshot_input = p_input;
+                        snapshot_output = p_output;
+                        memcpy(snapshot, memory, dirty + 1);
+                    }
                 }
                 break;
-            case '!':
+            case OP_BREAKPOINT:
                 LOGOK
                 printf("BREAKPOINT\n|");
-                for(uint8_t* i = p_mem-10 >= memory ? p_mem-10 : memory ; i <= p_mem+10; i++) {
-                    printf(" %i ", (int)*i);
+                for(int32_t i = p-10 >= 0 ? p-10 : 0 ; i <= p+10; i++) {
+                    printf(" %i ", (int)memory[i]);
                 }
                 printf("|\n|");
-                for(uint8_t* i = p_mem-10 >= memory ? p_mem-10 : memory ; i <= p_mem+10; i++) {
-                    if(isalnum(*i)) {
-                        printf(" %c ", *i);
+                for(int32_t i = p-10 >= 0 ? p-10 : 0 ; i <= p+10; i++) {
+                    if(isalnum(memory[i])) {
+                        printf(" %c ", memory[i]);
                     } else {
                         printf(" _ ");
                     }
                 }
                 printf("|\n");
-                for(uint8_t* i = p_mem-10 >= memory ? p_mem-10 : memory ; i < p_mem ; i++) {
+                for(int32_t i = p-10 >= 0 ? p-10 : 0 ; i < p ; i++) {
                     printf("   ");
                 }
                 printf("  ^\n");
                 getchar();
-                ++p_src;
+                ++pc;
                 break;
-            default:
-                ++p_src;
-#ifdef DEBUG
-                fprintf(stderr, "ERROR: Non valid character '%c' found in source code. Exit.\n", *p_src);
-                //exit(1);
-#endif
         } // end switch
         LOGOK
 #ifdef DEBUG
-        printf("END: Now at %i\n", (int)(p_src - source_code));
-        print_source_code(source_code, p_src, SOURCE_SIZE);
+        printf("END: Now at op %i, cell %i\n", (int)pc, (int)p);
 #endif
         ++instruction_count;
     } // end while
+    if(instruction_count >= budget && termination == BF_END) {
+        termination = BF_BUDGET;
+    }
 #ifdef LOG_TOO_MUCH_INSTRUCTION
-    if(instruction_count >= MAXIMAL_INSTRUCTION_EXECUTION) {
-        fprintf(stderr, "ERROR: too much instructions (Maximal of %" PRIu64 " reached).\n", MAXIMAL_INSTRUCTION_EXECUTION);
+    if(instruction_count >= budget) {
+        fprintf(stderr, "ERROR: too much instructions (Maximal of %" PRIu64 " reached).\n", budget);
     }
 #endif
-    return;
+end:
+    *p_output = '\0';
+    const uint64_t output_length = p_output - output;
+    context->pointer = p;
+    context->input_position = p_input - input;
+    context->written_distance = distance;
+    if(expected != NULL && termination != BF_ABORTED && output_length < expected_size) {
+        distance += UINT8_MAX * (expected_size - output_length);  // missing letters
+    }
+    context->dirty = dirty;
+    context->result.steps = instruction_count;
+    context->result.output_length = output_length;
+    context->result.distance = distance;
+    context->result.termination = termination;
+    if(tracing) {
+        trace->highest_cell = dirty;
+    }
+    return output_length;
 }
 
 
-#ifdef DEBUG
-void print_source_code(char const * const source_code, char const* const p_src, const uint64_t source_code_size) {
-    printf("SOURCE CODE\n");
-    char* i = (char*)((p_src-10 >= source_code) ? p_src-10 : source_code);
-    for(; i <= p_src+10 && (int)(i - source_code) <= source_code_size; i++) {
-        printf("%c", *i);
+static uint64_t execute(bf_context* context, bf_program const* program,
+                        char const* input, const uint64_t input_size,
+                        char* output, const uint64_t output_size, const uint8_t resume) {
+    if(context->trace != NULL) {
+        return execute_ops(context, program, input, input_size, output, output_size, resume, 1);
     }
-    printf("\n");
-    i = (char*)((p_src-10 >= source_code) ? p_src-10 : source_code);
-    for(; i < p_src && (int)(i - source_code) <= source_code_size ; i++) {
-        printf(" ");
+    return execute_ops(context, program, input, input_size, output, output_size, resume, 0);
+}
+
+
+#ifdef DEBUG
+void print_program(bf_program const* program) {
+    static char const* const NAMES[] = {"MOVE", "ADD", "IN", "OUT", "CLEAR", "SCAN", "MUL", "JZ", "JNZ", "BREAKPOINT"};
+    printf("PROGRAM\n");
+    for(uint64_t i = 0 ; i < program->size ; i++) {
+        bf_op const* const op = &program->ops[i];
+        printf("%4" PRIu64 " %-10s %5i [%i;%i] (source %u)\n", i, NAMES[op->code], op->arg, op->lo, op->hi, op->src);
     }
-    printf("^\n");
 }
 #endif
-
@@ -21,15 +21,188 @@
 #define EXT_SET_ZERO  // Allow the use of 0 to replace [-]
 
 
-void interpret_bf(
+#define BF_MEMORY_SIZE 2048
+#define BF_UNMATCHED -1  // jump target of unmatched brackets, before compilation ends
+#define BF_MAXIMAL_MUL_OFFSET 32  // farthest cell modified by a move/multiply loop
+
+
+// Instructions of the intermediate representation
+enum {
+    OP_MOVE,   // p = clamp(p + arg, lo, hi)
+    OP_ADD,    // *p += arg
+    OP_IN,     // read arg characters in *p
+    OP_OUT,    // write *p arg times
+    OP_CLEAR,  // *p = 0  (loops like [-])
+    OP_SCAN,   // while(*p) move like OP_MOVE  (loops like [>])
+    OP_MUL,    // p[term.offset] += term.factor * *p for each term, then *p = 0, then jump to arg
+    OP_JZ,     // jump to arg if *p is zero
+    OP_JNZ,    // jump to arg if *p is not zero
+    OP_BREAKPOINT,
+};
+
+
+typedef struct {
+    uint8_t code;
+    int32_t arg;
+    int32_t lo, hi;  // bounds of memory reachable by a move, or offsets visited by a mul loop
+    uint32_t first, count;  // first term and number of terms of a mul loop, origin excluded
+    uint32_t src;  // index of the instruction in source code
+} bf_op;
+
+typedef struct {
+    int32_t offset;
+    uint8_t factor;
+} bf_term;
+
+
+// A compiled program: the sequence of ops, reusable for any number of runs.
+typedef struct {
+    bf_op* ops;
+    uint64_t size;
+    bf_term* terms;  // terms of all mul loops
+    uint64_t nb_terms;
+    uint64_t capacity;  // allocated ops and terms
+} bf_program;
+
+// Tables used during compilation.
+typedef struct {
+    char* simplified;
+    uint32_t* origins;
+    uint64_t* stack;
+    uint64_t capacity;
+} bf_scratch;
+
+// Reasons for a run to end
+enum {
+    BF_END,          // end of program reached
+    BF_BUDGET,       // maximal number of instructions reached
+    BF_OUTPUT_FULL,  // output buffer is full
+    BF_ABORTED,      // distance to expected output exceeded the bound
+    BF_CYCLE,        // the run reached a state it already was in: it never ends
+};
+
+// Description of the last run of a context
+typedef struct {
+    uint64_t output_length;
+    uint64_t steps;  // number of executed instructions
+    uint64_t distance;  // distance to expected output, when scoring
+    uint8_t termination;
+} bf_result;
+
+// Statistics collected during the runs of a context, when it has a trace.
+//  The arrays are allocated by the caller.
+typedef struct {
+    int32_t highest_cell;  // highest memory cell used by the last run
+    uint64_t* counts;  // counts[i]: executed instructions compiled from the i-th source character
+    uint64_t counts_size;
+    uint32_t* output_sources;  // output_sources[k]: source character that wrote the k-th output letter
+} bf_trace;
+
+// Everything needed to run programs, allocated once and reused by each run.
+typedef struct {
+    uint8_t memory[BF_MEMORY_SIZE];
+    int32_t dirty;  // highest memory cell that may be non zero
+    bf_result result;
+    int32_t pointer;  // memory cell and input position at the end of the last run
+    uint64_t input_position;
+    uint64_t written_distance;  // distance of the written letters, without the missing ones
+    char const* expected;  // expected output, or NULL if not scoring
+    uint64_t expected_size;
+    uint64_t bound;  // maximal distance before aborting the run
+    char* output;
+    uint64_t output_size;
+    uint64_t budget;  // maximal number of instructions of a run
+    uint8_t detect_cycles;  // stop runs that come back to a previous state
+    uint8_t snapshot[BF_MEMORY_SIZE];  // memory of the state compared for cycle detection
+    bf_trace* trace;  // statistics of the runs, or NULL if they are not collected
+    bf_program program;  // program compiled by context_interpret
+    bf_scratch scratch;
+} bf_context;
+
+// State of a context at the end of a run, from which other runs can be continued.
+typedef struct {
+    bf_result result;
+    int32_t dirty;
+    int32_t pointer;
+    uint64_t input_position;
+    uint64_t written_distance;
+    uint8_t* memory;  // the dirty+1 first cells
+    char* output;  // the result.output_length letters of output
+} bf_checkpoint;
+
+
+bf_program* compile_bf(char const* source_code);
+bf_program* compile_sized_bf(char const* source_code, const uint64_t size);
+void free_bf(bf_program* program);
+uint64_t program_size(bf_program const* program);
+// Ops and mul loop terms of a compiled program, for code generation.
+bf_op const* program_ops(bf_program const* program);
+bf_term const* program_terms(bf_program const* program);
+uint64_t run_bf(
+        bf_program const* program, char* input,
+        char* output, const uint64_t output_size
+);
+bf_context* new_context(const uint64_t output_size);
+void free_context(bf_context* context);
+char* context_output(bf_context const* context);
+bf_result const* context_result(bf_context const* context);
+// Set the maximal number of instructions of next runs (0 for the default one),
+//  and whether non-terminating runs are detected and stopped early.
+void configure_context(bf_context* context, const uint64_t budget, const uint8_t detect_cycles);
+// Collect the statistics of next runs in given trace, or stop collecting them
+//  if trace is NULL. Its output_sources must hold the output size of the context.
+void context_trace(bf_context* context, bf_trace* trace);
+// Run the program on given input, and return the output length.
+uint64_t context_run(
+        bf_context* context, bf_program const* program,
+        char const* input, const uint64_t input_size
+);
+// Compile the source without allocation, then run it like context_run.
+uint64_t context_interpret(
+        bf_context* context, char const* source_code, const uint64_t source_size,
+        char const* input, const uint64_t input_size
+);
+// Run the program on given input, computing the distance of output to expected
+//  output, as compare_str.c does, while it is written. The run is aborted as soon
+//  as the distance is greater than bound. Return the distance.
+uint64_t context_score(
+        bf_context* context, bf_program const* program,
+        char const* input, const uint64_t input_size,
+        char const* expected, const uint64_t expected_size, const uint64_t bound
+);
+uint64_t context_interpret_score(
+        bf_context* context, char const* source_code, const uint64_t source_size,
+        char const* input, const uint64_t input_size,
+        char const* expected, const uint64_t expected_size, const uint64_t bound
+);
+// Return a copy of the state of the context at the end of its last run.
+bf_checkpoint* context_checkpoint(bf_context const* context);
+void free_checkpoint(bf_checkpoint* checkpoint);
+// Set the state of the context to the given checkpoint, or to the initial
+//  state of any run if checkpoint is NULL.
+void context_restore(bf_context* context, bf_checkpoint const* checkpoint);
+// Compile the source, and run it from the state of the context, as if it was
+//  appended to the source of the previous runs, on the same input.
+//  If expected is not NULL, the distance is computed like context_score does.
+//  Return the output length.
+uint64_t context_continue(
+        bf_context* context, char const* source_code, const uint64_t source_size,
+        char const* input, const uint64_t input_size,
+        char const* expected, const uint64_t expected_size, const uint64_t bound
+);
+// Run each source on each input. Sources (resp. inputs) are concatenated,
+//  the i-th one spanning from offsets[i] to offsets[i+1].
+//  Output of source i on input j starts at outputs[(i * nb_inputs + j) * output_size].
+void run_bf_batch(
+        char const* sources, uint64_t const* source_offsets, const uint64_t nb_sources,
+        char const* inputs, uint64_t const* input_offsets, const uint64_t nb_inputs,
+        char* outputs, uint64_t* output_lengths, const uint64_t output_size
+);
+uint64_t interpret_bf(
         char* source_code, char* input,
         char* output, const uint64_t output_size
 );
 
 #ifdef DEBUG
-void print_source_code(
-        char const * const source_code,
-        char const* const p_src,
-        const uint64_t source_code_size
-);
+void print_program(bf_program const* program);
 #endif
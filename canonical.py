@@ -0,0 +1,158 @@
+"""Canonical form of brainfuck sources.
+
+Two sources with the same canonical form produce the same output on any
+input, and are compiled by the C interpreter into the same instructions
+until their last output. The canonical form, or its hash, can therefore
+be used in place of a source to key scores and cached outputs.
+
+"""
+
+import re
+import hashlib
+from functools import lru_cache
+
+from interpreter import simplified_source_code, CACHE_SIZE, MEMORY_END
+
+
+IGNORED = re.compile(r"[^<>+\-\[\],.0!]")  # characters ignored by the C interpreter
+HANGING_LOOP = '[+-]'  # canonical loop with an empty body, that can't be simplified
+TOKENS = re.compile(r"[<>]+|[+-]+|.")
+CANONICAL_CACHE_SIZE = 2**16  # larger than populations, so that kept units are not canonicalized again
+
+
+def move_effect(moves:str) -> (int, int, int):
+    """Return (delta, lo, hi) so that given sequence of moves brings the
+    memory pointer p to clamp(p + delta, lo, hi), like the C interpreter
+    composes them.
+
+    >>> move_effect('>>'), move_effect('<>')
+    ((2, 2, 2047), (0, 1, 2047))
+
+    """
+    delta, lo, hi = 0, 0, MEMORY_END
+    for move in moves:
+        step = 1 if move == '>' else -1
+        delta += step
+        lo = min(max(lo + step, 0), MEMORY_END)
+        hi = min(max(hi + step, 0), MEMORY_END)
+    return delta, lo, hi
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def canonical_moves(moves:str) -> str:
+    """Return the shortest sequence of moves equivalent to given one.
+
+    >>> canonical_moves('>><>'), canonical_moves('<<>>><'), canonical_moves('><')
+    ('>>', '<<>>><', '><')
+
+    """
+    if '<' not in moves or '>' not in moves:
+        return moves[:MEMORY_END]  # farther moves are stopped by memory boundaries
+    effect = move_effect(moves)
+    if effect == (0, 0, MEMORY_END):
+        return ''
+    candidates = []
+    for left, right, (delta, lo, hi) in (('<', '>', effect), ('>', '<', _mirrored(*effect))):
+        # sequences like <<<>>>>><<, going left, then right, then left
+        last = MEMORY_END - hi
+        middle = lo + last if lo else max(0, last + delta)
+        first = middle - last - delta
+        if first >= 0:
+            candidates.append(left * first + right * middle + left * last)
+    candidates = [candidate for candidate in candidates if move_effect(candidate) == effect]
+    return min(candidates, key=len) if candidates else moves
+
+def _mirrored(delta:int, lo:int, hi:int) -> (int, int, int):
+    """Return the effect of given one on a memory read from the end"""
+    return -delta, MEMORY_END - hi, MEMORY_END - lo
+
+
+def canonical_additions(additions:str) -> str:
+    """Return the shortest sequence of + or - equivalent to given one.
+
+    >>> canonical_additions('+-++'), canonical_additions('-' * 200)
+    ('++', '++++++++++++++++++++++++++++++++++++++++++++++++++++++++')
+
+    """
+    value = (additions.count('+') - additions.count('-')) % 256
+    return '+' * value if value <= 128 else '-' * (256 - value)
+
+
+@lru_cache(maxsize=CANONICAL_CACHE_SIZE)
+def canonical_source(source:str) -> str:
+    """Return the canonical form of given source.
+
+    The source is simplified as the C interpreter does, then its ignored
+    characters and the code after its last output are removed, and its
+    runs of moves and additions are replaced by the shortest equivalent ones.
+
+    >>> canonical_source('+++ +--[-]>>,<>[.]>><< end')
+    '++0>>,<>[.]'
+    >>> canonical_source('+[ ]+-.')
+    '+[+-].'
+
+    """
+    code = IGNORED.sub('', simplified_source_code(source))
+    canonical = []
+    for token in TOKENS.findall(code[:_output_end(code)]):
+        if token[0] in '<>+-':
+            if canonical and _same_run(canonical[-1], token):
+                token = canonical.pop() + token
+            token = (canonical_moves if token[0] in '<>' else canonical_additions)(token)
+            if token:  # else the run cancelled itself, and the previous one may continue
+                canonical.append(token)
+        elif token == ']' and canonical and canonical[-1] == '[':
+            canonical[-1] = HANGING_LOOP
+        elif token == ']' and len(canonical) > 1 and canonical[-2] == '[' and _is_odd_addition(canonical[-1]):
+            canonical[-2:] = '0'  # loop that reaches 0, like [-] or [+++]
+        elif token == ']' and len(canonical) > 1 and canonical[-2] == '[' and canonical[-1][0] == '-':
+            # loop like [----], that may never end: it must not be simplified into 0
+            canonical[-1] = '+' * (256 - len(canonical[-1]))
+            canonical.append(token)
+        else:
+            canonical.append(token)
+    return ''.join(canonical)
+
+def _output_end(code:str) -> int:
+    """Return the index after the last output of given code, including
+    the loops enclosing it, or 0 if there is no output.
+
+    """
+    last_output = code.rfind('.')
+    if last_output < 0:
+        return 0
+    depth = 0
+    for char in code[:last_output]:
+        if char == '[':
+            depth += 1
+        elif char == ']':
+            depth = max(0, depth - 1)  # unmatched ] are not closing anything
+    end, enclosing = last_output + 1, depth
+    for idx in range(last_output + 1, len(code)):
+        if enclosing == 0:
+            break
+        if code[idx] == '[':
+            depth += 1
+        elif code[idx] == ']':
+            depth -= 1
+            if depth < enclosing:  # end of a loop enclosing the output
+                end, enclosing = idx + 1, depth
+    return end
+
+def _same_run(one:str, two:str) -> bool:
+    """True if given tokens are both runs of moves, or both runs of additions"""
+    return one[0] in '<>+-' and (one[0] in '<>') == (two[0] in '<>')
+
+def _is_odd_addition(token:str) -> bool:
+    return token[:1] in '+-' and len(token) % 2 == 1
+
+
+def source_hash(source:str) -> str:
+    """Return a hash of the canonical form of given source, that is
+    stable between runs and processes.
+
+    >>> source_hash('++-.') == source_hash('+. comment')
+    True
+
+    """
+    return hashlib.blake2b(canonical_source(source).encode(), digest_size=16).hexdigest()
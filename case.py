@@ -2,6 +2,14 @@
 
 """
 
+from functools import lru_cache
+
+import interpreter
+
+
+BUDGET_FACTOR = 16  # a unit may execute this much more instructions than the reference
+MINIMAL_BUDGET = 2**12  # budget given to units even if the reference is very fast
+
 
 class Case:
     """Implementation of a test case, which is a pair (stdin, expected stdout).
@@ -13,10 +21,17 @@ class Case:
     expected can be either a string (could contains the substring "{stdin}"),
     or a callable (stdin value -> expected string).
 
+    reference is an optional brainfuck source solving the case. When given,
+    the number of instructions units may execute on a stdin is limited
+    to budget_factor times the one of the reference on the same stdin.
+
     """
-    def __init__(self, input:str or callable, expected:str or callable):
+    def __init__(self, input:str or callable, expected:str or callable,
+                 reference:str=None, budget_factor:float=BUDGET_FACTOR):
         self._input = input if callable(input) else str(input)
         self._expected = expected if callable(expected) else str(expected)
+        self.reference = reference
+        self.budget_factor = budget_factor
 
     @property
     def callable_input(self):
@@ -34,3 +49,22 @@ class Case:
             return iter((stdin, expected))
         else:
             return iter((self._input, self._expected))
+
+    def budget(self, stdin:str) -> int or None:
+        """Return the maximal number of instructions a unit may execute
+        on given stdin, or None if the case has no reference.
+
+        """
+        if self.reference is None:
+            return None
+        steps = _reference_steps(self.reference, stdin)
+        return max(MINIMAL_BUDGET, int(steps * self.budget_factor))
+
+
+@lru_cache(maxsize=interpreter.CACHE_SIZE)
+def _reference_steps(source:str, stdin:str) -> int:
+    return _reference_interpreter().program(source).steps(stdin)
+
+@lru_cache(maxsize=1)
+def _reference_interpreter():
+    return interpreter.load_interpreter()
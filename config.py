@@ -115,7 +115,7 @@ class Configuration:
 
     @staticmethod
     def from_codes(score:str=None, select:str=None, mutate:str=None,
-                   reproduce:str=None, create:str=None, step:str=None):
+                   reproduce:str=None, cross:str=None, create:str=None, step:str=None):
         """Create configuration from given codes of named functions.
 
         Code can be either None, a valid codename, or an iterable of
@@ -0,0 +1,400 @@
+"""Long-lived pool of processes scoring units, reused across steps,
+populations and cases.
+
+Workers are started once, and keep their interpreter and its caches
+warm for the whole run.
+
+A population is not pickled: its distinct sources are packed in a single
+shared memory block, with their offsets, and each worker is only given a
+range of indexes. Workers write the score, and the found output, of each
+source in arrays of the same block, where each found output has a slot of
+FOUND_SLOT_SIZE bytes, or of the size of the expected output if larger.
+Only the results that don't fit there, like long found outputs or runs
+with a trace, are pickled back.
+
+Sources are scheduled by predicted cost: a few units run up to the
+instruction budget, and would leave the other workers idle at the end
+of the call. The CostModel predicts the scoring time of each unit from the
+measured time of its source or of its parents, else from its length and
+loop nesting. Sources are sent from the most to the least expensive one,
+in chunks of decreasing predicted cost, each given to the next idle worker.
+
+Children can also be created by the workers, that get the parents once,
+and send back only the sources and results of the children they made.
+These results are kept, so that the children are not scored again
+by the next call to score for the same test.
+
+"""
+
+import os
+import time
+import pickle
+import itertools
+from functools import partial
+from array import array
+from contextlib import contextmanager
+from collections import namedtuple
+from multiprocessing import Pool, resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+
+from unit import Unit
+from scoring import RunResult
+
+
+USE_COST_MODEL = True  # schedule the most expensive sources first, else in population order
+CHUNKS_PER_WORKER = 4  # number of chunks of sources given to each worker by a call, without cost model
+GUIDED_CHUNKS = 4  # each chunk has at most 1/(GUIDED_CHUNKS * processes) of the remaining predicted cost
+MAX_MEASURED = 2**18  # number of measured sources kept by a cost model
+MAX_KNOWN = 2**20  # number of results of created units kept until they are scored
+FOUND_SLOT_SIZE = 2**6  # minimal number of bytes of each found output in shared memory
+NOT_SHARED = -1  # found length of results given back by pickling
+
+# Description of a shared block: number of sources, total size of the
+#  encoded sources, and size of a found output slot.
+Layout = namedtuple('Layout', 'size sources found_slot')
+# Wall time of last call to EvaluationService.score, and sum of the CPU times
+#  of its units. Their ratio is 1/processes with a perfect scheduling.
+SchedulingStats = namedtuple('SchedulingStats', 'wall cpu')
+
+
+def default_processes() -> int:
+    """Return the number of CPUs usable by the current process"""
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def loop_depth(source:str) -> int:
+    """Return the maximal nesting of loops in given source
+
+    >>> loop_depth('+[>[-]<[>+<-]]'), loop_depth('+.')
+    (2, 0)
+
+    """
+    depth = deepest = 0
+    for char in source:
+        if char == '[':
+            depth += 1
+            deepest = max(deepest, depth)
+        elif char == ']' and depth:
+            depth -= 1
+    return deepest
+
+
+class CostModel:
+    """Prediction of the time needed to score units.
+
+    The cost of a unit is the measured time of its source, else the
+    greatest measured time of its parents, else the static cost of its
+    source, converted in seconds with the ratio observed on measured sources.
+
+    >>> model = CostModel()
+    >>> model.update(['+[-]', '+.'], [2e-5, 1e-5])
+    >>> model.predict(Unit('+[-]')), model.predict(Unit('+[->]', parents=['+[-]', '+.']))
+    (2e-05, 2e-05)
+    >>> model.predict(Unit('+.+.')) == CostModel.static_cost('+.+.') * (2e-5 + 1e-5) / (8 + 2)
+    True
+
+    """
+
+    def __init__(self):
+        self.measured = {}  # source -> seconds
+        self._seconds = self._static = 0.
+
+    @staticmethod
+    def static_cost(source:str) -> float:
+        """Cost of given source, in arbitrary unit, growing with its length and loop nesting"""
+        return len(source) * (1 + loop_depth(source))
+
+    def predict(self, unit:Unit) -> float:
+        """Return the predicted scoring time of given unit, in seconds"""
+        if unit.source in self.measured:
+            return self.measured[unit.source]
+        parents = [self.measured[parent] for parent in unit.parents if parent in self.measured]
+        if parents:
+            return max(parents)
+        ratio = self._seconds / self._static if self._static else 1e-6
+        return self.static_cost(unit.source) * ratio
+
+    def update(self, sources:[str], seconds:[float]):
+        """Record the measured scoring times of given sources"""
+        for source, cost in zip(sources, seconds):
+            self.measured.pop(source, None)  # measured last, forgotten last
+            self.measured[source] = cost
+            self._seconds += cost
+            self._static += self.static_cost(source)
+        for source in tuple(itertools.islice(self.measured, max(0, len(self.measured) - MAX_MEASURED))):
+            del self.measured[source]
+
+
+def guided_chunks(costs:[float], workers:int) -> [(int, int)]:
+    """Return the (start, stop) of consecutive chunks of given costs, sorted
+    in decreasing order, each one having at most 1/(GUIDED_CHUNKS * workers)
+    of the remaining cost, or a single element.
+
+    The first chunks hold the most expensive elements, so that they start
+    first, and the cheapest ones are grouped in smaller chunks, filling the
+    idle workers at the end. Chunks have at least 1/GUIDED_CHUNKS of
+    the maximal chunk cost, so that the last ones are not single elements.
+
+    >>> chunks = guided_chunks([80] + [1] * 400, 2)
+    >>> chunks[:4], chunks[-2:]
+    ([(0, 1), (1, 51), (51, 94), (94, 132)], [(383, 398), (398, 401)])
+
+    """
+    total = remaining = sum(costs)
+    start, chunks = 0, []
+    while start < len(costs):
+        target = max(remaining, total / GUIDED_CHUNKS) / (GUIDED_CHUNKS * workers)
+        stop, cost = start + 1, costs[start]
+        while stop < len(costs) and cost + costs[stop] <= target:
+            cost += costs[stop]
+            stop += 1
+        chunks.append((start, stop))
+        remaining -= cost
+        start = stop
+    return chunks
+
+
+def block_size(layout:Layout) -> int:
+    """Return the number of bytes of a shared block of given layout"""
+    return 8 * (4 * layout.size + 1) + layout.sources + layout.found_slot * layout.size
+
+
+@contextmanager
+def shared_views(block:SharedMemory, layout:Layout):
+    """Yield the views on the source offsets, the scores, the found lengths,
+    the scoring times, the sources and the found outputs of given shared block.
+
+    """
+    size = layout.size
+    ends = tuple(itertools.accumulate((8 * (size + 1), 8 * size, 8 * size, 8 * size, layout.sources, layout.found_slot * size)))
+    starts = (0,) + ends[:-1]
+    views = [block.buf[start:end] for start, end in zip(starts, ends)]
+    views[:4] = [view.cast(fmt) for view, fmt in zip(views[:4], 'Qqqd')]
+    try:
+        yield views
+    finally:
+        for view in views:
+            view.release()
+
+
+def _shareable_found(result:RunResult, expected:str, slot:int) -> bytes or None:
+    """Return the encoded found output of given result, or None if the
+    result can't be rebuilt from its score and found output only.
+
+    """
+    if type(result) is not RunResult or type(result.score) is not int or result.trace or result.expected != expected:
+        return None
+    found = result.found.encode('ISO-8859-1', errors='replace')
+    if len(found) > slot or found.decode('ISO-8859-1') != result.found:
+        return None
+    return found
+
+
+def _score_shared(score:callable, test:tuple, name:str, layout:Layout, start:int, stop:int) -> [(int, RunResult)]:
+    """Score the sources of given indexes in the shared block of given name,
+    and write their results and scoring times in it.
+
+    Return the (index, result) of the results that can't be written in the block.
+
+    """
+    block, unshared = SharedMemory(name), []
+    try:
+        with shared_views(block, layout) as (offsets, scores, lengths, costs, sources, founds):
+            for idx in range(start, stop):
+                started = time.process_time()
+                result = score(Unit(str(sources[offsets[idx]:offsets[idx + 1]], 'utf-8')), test)
+                costs[idx] = time.process_time() - started
+                found = _shareable_found(result, test[1], layout.found_slot)
+                if found is not None:
+                    scores[idx], lengths[idx] = result.score, len(found)
+                    founds[idx * layout.found_slot:idx * layout.found_slot + len(found)] = found
+                else:
+                    lengths[idx] = NOT_SHARED
+                    unshared.append((idx, result))
+    finally:
+        block.close()
+    return unshared
+
+
+# (name of the shared block, call number, unpickled content) of the parents
+#  of the last call to EvaluationService.create_scored, kept by each worker
+_PARENTS = None
+
+
+def _parents_of(name:str, size:int, call:int) -> tuple:
+    """Return the parents, with their results, and the functions sent by
+    given call to create_scored, unpickled once by each worker"""
+    global _PARENTS
+    if _PARENTS is None or _PARENTS[:2] != (name, call):
+        block = SharedMemory(name)
+        try:
+            _PARENTS = name, call, pickle.loads(bytes(block.buf[:size]))
+        finally:
+            block.close()
+    return _PARENTS[2]
+
+
+def _create_scored(name:str, size:int, call:int, number:int) -> [(str, int, RunResult)]:
+    """Create and score given number of children of the parents of given call.
+
+    Return the source, chromosome size and result of each child.
+
+    """
+    scored_parents, reproduce, cross, mutate, test, score = _parents_of(name, size, call)
+    children = reproduce(scored_parents, number, cross, mutator=mutate, keep_parents=False)
+    return [(child.source, child.chrom_size, score(child, test)) for child in children]
+
+
+class EvaluationService:
+    """Pool of worker processes scoring units, started at first use.
+
+    >>> import scoring
+    >>> with EvaluationService(processes=2) as service:
+    ...     results = service.score([Unit(',.'), Unit(',+.')], ('a', 'b'), scoring.io_comparison)
+    >>> [result.score for result in results.values()]
+    [9999, 10000]
+
+    """
+
+    def __init__(self, processes:int=None):
+        self.processes = int(processes or default_processes())
+        self.costs = CostModel()
+        self.last_stats = SchedulingStats(0., 0.)
+        self._pool = None
+        self._calls = 0
+        self._known = None, {}  # (test, pickled scoring function), {source: result} of created units
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def close(self):
+        """Stop the workers. They will be restarted by next call to score"""
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def _started_pool(self) -> Pool:
+        """Return the pool of workers, started if needed"""
+        if self._pool is None:
+            # forked workers must share the tracker of shared blocks of this process,
+            #  else their own ones would see the blocks as leaked
+            resource_tracker.ensure_running()
+            self._pool = Pool(processes=self.processes)
+        return self._pool
+
+    def submit(self, unit:Unit, test:tuple, score:callable, callback:callable, error_callback:callable):
+        """Start the scoring of given unit, and return at once.
+
+        callback will be called with the result, or error_callback with the
+        exception raised by the scoring function, in a thread of the pool.
+        Units are pickled, so that this is suited to units produced one
+        by one, rather than to whole populations.
+
+        """
+        self._started_pool().apply_async(score, (unit, test), callback=callback, error_callback=error_callback)
+
+    def _known_results(self, test:tuple, score:callable) -> dict:
+        """Return the {source: result} of created units, kept for given test and scoring function.
+        Its prescreened argument doesn't change the results (see scoring.io_comparison)."""
+        if isinstance(score, partial) and 'prescreened' in score.keywords:
+            score = partial(score.func, *score.args, **{name: value for name, value in score.keywords.items()
+                                                        if name != 'prescreened'})
+        key = test, pickle.dumps(score)
+        if self._known[0] != key or len(self._known[1]) > MAX_KNOWN:
+            self._known = key, {}
+        return self._known[1]
+
+    def create_scored(self, scored_parents:dict, number:int, reproduce:callable, cross:callable,
+                      mutate:callable, test:tuple, score:callable) -> dict:
+        """Return {child: result} of given number of children of given parents.
+
+        The workers get the parents, their results and the functions once,
+        through a shared block, and create, mutate and score their share
+        of children, with reproduce(scored_parents, n, cross, mutator=mutate,
+        keep_parents=False). Functions must be picklable.
+
+        The results of the parents and of the children are kept, so that
+        next call to score for the same test and scoring function doesn't
+        score them again.
+
+        """
+        pool = self._started_pool()
+        if number <= 0:
+            return {}
+        payload = pickle.dumps((scored_parents, reproduce, cross, mutate, test, score))
+        block = SharedMemory(create=True, size=len(payload))
+        try:
+            block.buf[:len(payload)] = payload
+            self._calls += 1
+            size = -(-number // (self.processes * CHUNKS_PER_WORKER))
+            shares = ((block.name, len(payload), self._calls, min(size, number - start))
+                      for start in range(0, number, size))
+            created = pool.starmap(_create_scored, shares, chunksize=1)
+        finally:
+            block.close()
+            block.unlink()
+        children = {Unit(source, chrom_size): result
+                    for source, chrom_size, result in itertools.chain.from_iterable(created)}
+        known = self._known_results(test, score)
+        known.update((unit.source, result) for unit, result in scored_parents.items())
+        known.update((unit.source, result) for unit, result in children.items())
+        return children
+
+    def score(self, units:[Unit], test:tuple, score:callable) -> dict:
+        """Return {unit: result of given scoring function for given test}.
+
+        Units sharing the same source are scored once. The scoring function
+        must be picklable, like module functions and partials of them.
+
+        """
+        pool = self._started_pool()
+        started = time.perf_counter()
+        known, results = self._known_results(test, score), {}
+        distinct = {}
+        for unit in units:
+            if unit.source in known:
+                results[unit.source] = known.pop(unit.source)
+            elif unit.source not in results:
+                distinct.setdefault(unit.source, unit)
+        if not distinct:
+            return {unit: results[unit.source] for unit in units}
+        if USE_COST_MODEL:  # longest processing time first
+            predicted = sorted(((self.costs.predict(unit), source) for source, unit in distinct.items()), reverse=True)
+            sources = tuple(source for _, source in predicted)
+            ranges = guided_chunks([cost for cost, _ in predicted], self.processes)
+        else:
+            sources = tuple(distinct)
+            size = -(-len(sources) // (self.processes * CHUNKS_PER_WORKER))
+            ranges = [(start, min(start + size, len(sources))) for start in range(0, len(sources), size)]
+        encoded = tuple(source.encode() for source in sources)
+        expected = test[1]
+        layout = Layout(len(sources), sum(map(len, encoded)), max(FOUND_SLOT_SIZE, len(expected.encode())))
+        block = SharedMemory(create=True, size=block_size(layout))
+        try:
+            with shared_views(block, layout) as (offsets, scores, lengths, costs, packed, founds):
+                offsets[1:] = array('Q', itertools.accumulate(map(len, encoded)))
+                packed[:] = b''.join(encoded)
+                chunks = ((score, test, block.name, layout, start, stop) for start, stop in ranges)
+                # one chunk at a time, given to the next idle worker
+                unshared = pool.starmap(_score_shared, chunks, chunksize=1)
+                costs = costs.tolist()
+                slot, founds = layout.found_slot, founds.tobytes()
+                results.update(
+                    (source, RunResult(score, expected, founds[start:start + length].decode('ISO-8859-1')))
+                    for source, score, length, start in zip(sources, scores.tolist(), lengths.tolist(),
+                                                            range(0, len(founds), slot))
+                    if length != NOT_SHARED
+                )
+            results.update((sources[idx], result) for chunk in unshared for idx, result in chunk)
+        finally:
+            block.close()
+            block.unlink()
+        self.costs.update(sources, costs)
+        self.last_stats = SchedulingStats(time.perf_counter() - started, sum(costs))
+        return {unit: results[unit.source] for unit in units}
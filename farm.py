@@ -0,0 +1,352 @@
+"""Farm of remote workers scoring units, usable in place of the
+evaluation.EvaluationService of an MMH run.
+
+Workers connect to the farm over TCP, with the authenticated connections
+of multiprocessing.connection, and are sent batches of sources with the
+test and the scoring function, that must be picklable. They answer
+with the results of the batch, and send a heartbeat every heartbeat
+period while they are scoring.
+
+Units submitted one by one, like by the steady-state steps, are sent by
+a thread of the farm in batches of the units submitted meanwhile, spread
+over the workers.
+
+A worker scoring a batch that doesn't send anything during
+HEARTBEAT_TIMEOUT seconds, or whose connection is lost, is dropped, and its batch is given to another
+worker. The farm keeps the number of batches and units scored by each
+worker, and the time it spent on them.
+
+Workers are started on each box with:
+
+    FARM_AUTHKEY=secret python farm.py HOST:PORT [PROCESSES]
+
+"""
+
+import os
+import sys
+import time
+import queue
+import socket
+import threading
+from collections import deque, namedtuple
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Listener, Client, wait
+
+from unit import Unit
+from evaluation import EvaluationService
+
+
+BATCH_SIZE = 256  # number of sources sent to a worker at once
+HEARTBEAT_PERIOD = 1.  # seconds between two heartbeats of a worker
+HEARTBEAT_TIMEOUT = 5.  # seconds of silence after which a worker is dropped
+POLL_PERIOD = 0.05  # seconds between two checks of the connections of new workers
+
+WorkerStats = namedtuple('WorkerStats', 'batches units seconds lost')
+
+
+def throughput(stats:WorkerStats) -> float:
+    """Return the number of units scored per second by a worker"""
+    return stats.units / stats.seconds if stats.seconds else 0.
+
+
+def default_authkey() -> bytes:
+    """Return the key shared by the farm and its workers, from FARM_AUTHKEY if set"""
+    key = os.environ.get('FARM_AUTHKEY')
+    return key.encode() if key else os.urandom(16)
+
+
+class _Worker:
+    """A connected worker, as seen by the farm"""
+
+    def __init__(self, connection, name:str):
+        self.connection = connection
+        self.name = name
+        self.batch = None  # id of the batch being scored
+        self.sent_at = None
+        self.last_seen = time.monotonic()
+
+
+class WorkerFarm:
+    """Farm listening to workers at given address.
+
+    >>> from multiprocessing import Process
+    >>> import scoring
+    >>> with WorkerFarm() as farm:
+    ...     worker = Process(target=serve, args=(farm.address, farm.authkey)); worker.start()
+    ...     results = farm.score([Unit(',.'), Unit(',+.')], ('a', 'b'), scoring.io_comparison)
+    >>> worker.join()
+    >>> [result.score for result in results.values()]
+    [9999, 10000]
+
+    """
+
+    def __init__(self, address:tuple=('localhost', 0), authkey:bytes=None, *,
+                 batch_size:int=BATCH_SIZE, heartbeat_timeout:float=HEARTBEAT_TIMEOUT, timeout:float=None):
+        """
+
+        address -- (host, port) to listen to, by default a free port of localhost
+        authkey -- key expected from the workers, by default default_authkey()
+        batch_size -- number of sources sent to a worker at once
+        heartbeat_timeout -- seconds of silence after which a worker is dropped
+        timeout -- seconds after which scoring fails with TimeoutError
+            when no worker is connected, or None to wait for them
+
+        """
+        self.authkey = authkey or default_authkey()
+        self.batch_size = int(batch_size)
+        self.heartbeat_timeout = float(heartbeat_timeout)
+        self.timeout = timeout
+        self._listener = Listener(address, authkey=self.authkey)
+        self.address = self._listener.address
+        self._workers = []
+        self._arrived = queue.SimpleQueue()  # workers accepted by the listening thread
+        self._stats = {}  # worker name -> WorkerStats
+        self._closed = False
+        self._calls = 0  # number of calls to score, identifying their batches
+        self._scoring = threading.Lock()  # score is called by the caller and by the submitting thread
+        self._submitted = queue.SimpleQueue()  # (unit, test, score, callback, error_callback), or None to stop
+        self._submitting = None
+        self._accepting = threading.Thread(target=self._accept, daemon=True)
+        self._accepting.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    @property
+    def processes(self) -> int:
+        """Number of connected workers"""
+        return max(1, len(self._workers) + self._arrived.qsize())
+
+    def close(self):
+        """Stop the workers and the listening"""
+        if self._closed:
+            return
+        self._closed = True
+        if self._submitting is not None:
+            self._submitted.put(None)
+            self._submitting.join()
+        self._take_arrived()
+        for worker in self._workers:
+            try:
+                worker.connection.send(('stop',))
+            except OSError:
+                pass
+            worker.connection.close()
+        self._workers = []
+        if self._accepting.is_alive():
+            # wake up the listening thread, before its socket can be reused by another one
+            try:
+                socket.create_connection(self.address, timeout=1).close()
+            except OSError:
+                pass
+            self._accepting.join()
+        self._listener.close()
+
+    def _accept(self):
+        while not self._closed:
+            try:
+                connection = self._listener.accept()
+                _, name = connection.recv()
+            except (AuthenticationError, EOFError, ValueError, OSError):
+                continue  # not a worker, or the farm is closing
+            if self._closed:
+                connection.close()
+                return
+            self._arrived.put(_Worker(connection, name))
+
+    def _take_arrived(self):
+        while not self._arrived.empty():
+            worker = self._arrived.get()
+            self._workers.append(worker)
+            self._stats.setdefault(worker.name, WorkerStats(0, 0, 0., 0))
+
+    def _drop(self, worker:_Worker, pending:deque):
+        """Forget given worker, and give its batch to the next idle worker"""
+        self._workers.remove(worker)
+        worker.connection.close()
+        if worker.batch is not None:
+            pending.appendleft(worker.batch)
+            self._stats[worker.name] = self._stats[worker.name]._replace(lost=self._stats[worker.name].lost + 1)
+        print(f'FARM: worker {worker.name} lost', file=sys.stderr)
+
+    def wait_workers(self, number:int, timeout:float=None) -> bool:
+        """Wait until given number of workers are connected, return False on timeout"""
+        end = None if timeout is None else time.monotonic() + timeout
+        while self.processes < number or not self._workers:
+            with self._scoring:
+                self._take_arrived()
+            if end is not None and time.monotonic() >= end:
+                return False
+            time.sleep(POLL_PERIOD)
+        return True
+
+    def stats(self) -> {str: WorkerStats}:
+        """Return the stats of each worker that connected to the farm"""
+        with self._scoring:
+            self._take_arrived()
+        return dict(self._stats)
+
+    def submit(self, unit:Unit, test:tuple, score:callable, callback:callable, error_callback:callable):
+        """Start the scoring of given unit, and return at once, like
+        evaluation.EvaluationService.submit.
+
+        callback or error_callback are called by the thread sending
+        the submitted units.
+
+        """
+        if self._submitting is None:
+            self._submitting = threading.Thread(target=self._send_submitted, daemon=True)
+            self._submitting.start()
+        self._submitted.put((unit, test, score, callback, error_callback))
+
+    def _send_submitted(self):
+        """Score the units submitted since the last batch, with the same test
+        and scoring function, spread over the workers, until None is submitted"""
+        def next_submitted():
+            try:
+                return self._submitted.get(block=False)
+            except queue.Empty:
+                return EMPTY
+        EMPTY = object()
+        waiting = self._submitted.get()
+        while waiting is not None:
+            batch, waiting = [waiting], next_submitted()
+            while (waiting is not EMPTY and waiting is not None and waiting[1:3] == batch[0][1:3]
+                   and len(batch) < self.batch_size * self.processes):
+                batch.append(waiting)
+                waiting = next_submitted()
+            _, test, score, *_ = batch[0]
+            units = [unit for unit, *_ in batch]
+            try:
+                results = self._score(units, test, score, -(-len(units) // self.processes))
+            except Exception as error:
+                for *_, error_callback in batch:
+                    error_callback(error)
+            else:
+                for unit, *_, callback, _ in batch:
+                    callback(results[unit])
+            if waiting is EMPTY:
+                waiting = self._submitted.get()
+
+    def score(self, units:[Unit], test:tuple, score:callable) -> dict:
+        """Return {unit: result of given scoring function for given test}.
+
+        Units sharing the same source are scored once. The scoring function
+        must be picklable, like module functions and partials of them.
+
+        """
+        return self._score(units, test, score, self.batch_size)
+
+    def _score(self, units:[Unit], test:tuple, score:callable, batch_size:int) -> dict:
+        with self._scoring:
+            return self._score_batches(units, test, score, batch_size)
+
+    def _score_batches(self, units:[Unit], test:tuple, score:callable, batch_size:int) -> dict:
+        sources = tuple(dict.fromkeys(unit.source for unit in units))
+        # results of the batches of a previous call, that failed, are ignored
+        self._calls += 1
+        batches = {(self._calls, start): sources[start:start + batch_size]
+                   for start in range(0, len(sources), batch_size)}
+        pending, results = deque(batches), {}
+        idle_since = time.monotonic()
+        while len(results) < len(sources):
+            self._take_arrived()
+            now = time.monotonic()
+            for worker in tuple(self._workers):
+                # idle workers are not listened to between calls
+                if worker.batch is not None and now - worker.last_seen > self.heartbeat_timeout:
+                    self._drop(worker, pending)
+            for worker in tuple(self._workers):
+                if worker.batch is None and pending:
+                    batch = pending.popleft()
+                    try:
+                        worker.connection.send(('batch', batch, score, test, batches[batch]))
+                    except OSError:
+                        pending.appendleft(batch)
+                        self._drop(worker, pending)
+                        continue
+                    worker.batch, worker.sent_at, worker.last_seen = batch, now, now
+            if not self._workers:
+                if self.timeout is not None and now - idle_since > self.timeout:
+                    raise TimeoutError(f"No worker connected to the farm at {self.address} since {self.timeout}s.")
+                time.sleep(POLL_PERIOD)
+                continue
+            idle_since = now
+            by_connection = {worker.connection: worker for worker in self._workers}
+            for connection in wait(list(by_connection), timeout=POLL_PERIOD):
+                worker = by_connection[connection]
+                try:
+                    message = connection.recv()
+                except (EOFError, OSError):
+                    self._drop(worker, pending)
+                    continue
+                worker.last_seen = time.monotonic()
+                if message[0] == 'error':
+                    # the workers are given the batches of the next calls
+                    for other in self._workers:
+                        other.batch = None
+                    raise message[2]
+                if message[0] == 'results' and message[1] == worker.batch:
+                    results.update(zip(batches[worker.batch], message[2]))
+                    stats = self._stats[worker.name]
+                    self._stats[worker.name] = stats._replace(
+                        batches=stats.batches + 1, units=stats.units + len(batches[worker.batch]),
+                        seconds=stats.seconds + worker.last_seen - worker.sent_at)
+                    worker.batch = None
+        return {unit: results[unit.source] for unit in units}
+
+
+def serve(address:tuple, authkey:bytes=None, processes:int=1, heartbeat_period:float=HEARTBEAT_PERIOD):
+    """Score the batches sent by the farm at given address, until it stops.
+
+    With more than one process, batches are scored by an
+    evaluation.EvaluationService.
+
+    """
+    connection = Client(address, authkey=authkey or default_authkey())
+    lock, stopped = threading.Lock(), threading.Event()
+
+    def send(message:tuple):
+        with lock:
+            connection.send(message)
+
+    def beat():
+        while not stopped.wait(heartbeat_period):
+            try:
+                send(('heartbeat',))
+            except OSError:
+                return
+
+    send(('hello', f'{socket.gethostname()}:{os.getpid()}'))
+    threading.Thread(target=beat, daemon=True).start()
+    evaluator = EvaluationService(processes) if processes > 1 else None
+    try:
+        while True:
+            try:
+                message = connection.recv()
+            except (EOFError, OSError):
+                break
+            if message[0] == 'stop':
+                break
+            _, batch, score, test, sources = message
+            units = tuple(map(Unit, sources))
+            try:
+                # the scoring function prescreens the units, unless the caller of the farm did
+                scored = evaluator.score(units, test, score) if evaluator else {unit: score(unit, test) for unit in units}
+            except Exception as error:
+                send(('error', batch, error))
+                continue
+            send(('results', batch, [scored[unit] for unit in units]))
+    finally:
+        stopped.set()
+        if evaluator is not None:
+            evaluator.close()
+        connection.close()
+
+
+if __name__ == '__main__':
+    host, port = sys.argv[1].rsplit(':', 1)
+    serve((host, int(port)), processes=int(sys.argv[2]) if len(sys.argv) > 2 else 1)
@@ -1,40 +1,886 @@
-
-
+import os
 import re
 import ctypes
+import tempfile
+import warnings
+import threading
+import subprocess
 from functools import partial, lru_cache
+from collections import namedtuple
 
 
 BFIA_C_LIB = './bfinterp.so'
 BF_STATEMENTS = '<>+-[],.'
 CACHE_SIZE = 2**8
+PREFIX_TRIES = 4  # number of (input, expected output) with kept checkpoints
+MEMORY_SIZE = 2048  # comes from bfinterp.h
+MEMORY_END = MEMORY_SIZE - 1
+MAXIMAL_INSTRUCTION_EXECUTION = 2048 * 2048 * 8  # comes from bfinterp.c
+UINT8_MAX = 255  # comes from C stdint.h
+
+# Instructions of the intermediate representation, from bfinterp.h
+OP_MOVE, OP_ADD, OP_IN, OP_OUT, OP_CLEAR, OP_SCAN, OP_MUL, OP_JZ, OP_JNZ, OP_BREAKPOINT = range(10)
+
+# Compilation to native code, see JitEngine
+JIT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.jitcache')
+JIT_VERSION = 1  # to increase when the generated code changes, invalidating the cache
+JIT_MIN_RUNS = 64  # number of runs of a source before its compilation
+JIT_MIN_STEPS = 2**20  # number of instructions of a run leading to compilation
+JIT_GCC_OPTIONS = ('-shared', '-fPIC', '-fsigned-char', '-O2', '-w')
 
 ZERO_INSTRUCTION = re.compile(r"\[-+]")
 assert re.sub(ZERO_INSTRUCTION, '0', '[-----][-][]') == '00[]', re.sub(ZERO_INSTRUCTION, '0', '[-----][-][]')
 
+StaticAnalysis = namedtuple('StaticAnalysis', 'max_output_length reads_input')
+# Statistics of a run. counts[i] is the number of executed instructions compiled
+#  from the i-th character of the source, and output_sources[k] is the index
+#  of the source character that wrote the k-th output letter.
+RunTrace = namedtuple('RunTrace', 'steps termination highest_cell counts output_sources')
+
 
 def load_interpreter():
-    ret = ctypes.cdll.LoadLibrary(BFIA_C_LIB)
+    """Return the C interpreter, or the pure-Python one of transpiler.py
+    if the C library is not built.
+
+    """
+    try:
+        ret = ctypes.cdll.LoadLibrary(BFIA_C_LIB)
+    except OSError:
+        warnings.warn(f"{BFIA_C_LIB} can't be loaded (run make compile): using the slower pure-Python interpreter")
+        from transpiler import PythonInterpreter  # transpiler depends on this module
+        return PythonInterpreter()
+    ret.compile_bf.restype = ctypes.c_void_p  # opaque handle on a bf_program
+    ret.compile_bf.argtypes = (ctypes.c_char_p,)
+    ret.free_bf.argtypes = (ctypes.c_void_p,)
+    ret.run_bf.argtypes = (ctypes.c_void_p, ctypes.c_char_p, ctypes.c_char_p, ctypes.c_uint64)
+    ret.run_bf.restype = ctypes.c_uint64  # number of executed instructions
+    ret.program_size.argtypes = (ctypes.c_void_p,)
+    ret.program_size.restype = ctypes.c_uint64
+    ret.program_ops.argtypes = (ctypes.c_void_p,)
+    ret.program_ops.restype = ctypes.POINTER(Op)
+    ret.program_terms.argtypes = (ctypes.c_void_p,)
+    ret.program_terms.restype = ctypes.POINTER(Term)
+    ret.run_bf_batch.argtypes = (
+        ctypes.c_char_p, ctypes.POINTER(ctypes.c_uint64), ctypes.c_uint64,
+        ctypes.c_char_p, ctypes.POINTER(ctypes.c_uint64), ctypes.c_uint64,
+        ctypes.c_char_p, ctypes.POINTER(ctypes.c_uint64), ctypes.c_uint64,
+    )
+    ret.run_bf_batch.restype = None
+    ret.new_context.argtypes = (ctypes.c_uint64,)
+    ret.new_context.restype = ctypes.c_void_p  # opaque handle on a bf_context
+    ret.free_context.argtypes = (ctypes.c_void_p,)
+    ret.context_output.argtypes = (ctypes.c_void_p,)
+    ret.context_output.restype = ctypes.c_void_p
+    ret.context_result.argtypes = (ctypes.c_void_p,)
+    ret.context_result.restype = ctypes.POINTER(RunStatus)
+    ret.context_run.argtypes = (ctypes.c_void_p, ctypes.c_void_p, ctypes.c_char_p, ctypes.c_uint64)
+    ret.context_run.restype = ctypes.c_uint64  # output length
+    ret.context_interpret.argtypes = (ctypes.c_void_p, ctypes.c_char_p, ctypes.c_uint64, ctypes.c_char_p, ctypes.c_uint64)
+    ret.context_interpret.restype = ctypes.c_uint64  # output length
+    ret.context_score.argtypes = (ctypes.c_void_p, ctypes.c_void_p, ctypes.c_char_p, ctypes.c_uint64, ctypes.c_char_p, ctypes.c_uint64, ctypes.c_uint64)
+    ret.context_score.restype = ctypes.c_uint64  # distance
+    ret.context_interpret_score.argtypes = (ctypes.c_void_p, ctypes.c_char_p, ctypes.c_uint64, ctypes.c_char_p, ctypes.c_uint64, ctypes.c_char_p, ctypes.c_uint64, ctypes.c_uint64)
+    ret.context_interpret_score.restype = ctypes.c_uint64  # distance
+    ret.configure_context.argtypes = (ctypes.c_void_p, ctypes.c_uint64, ctypes.c_uint8)
+    ret.configure_context.restype = None
+    ret.context_checkpoint.argtypes = (ctypes.c_void_p,)
+    ret.context_checkpoint.restype = ctypes.c_void_p  # opaque handle on a bf_checkpoint
+    ret.free_checkpoint.argtypes = (ctypes.c_void_p,)
+    ret.context_restore.argtypes = (ctypes.c_void_p, ctypes.c_void_p)
+    ret.context_restore.restype = None
+    ret.context_continue.argtypes = (ctypes.c_void_p, ctypes.c_char_p, ctypes.c_uint64, ctypes.c_char_p, ctypes.c_uint64, ctypes.c_char_p, ctypes.c_uint64, ctypes.c_uint64)
+    ret.context_continue.restype = ctypes.c_uint64  # output length
+    ret.context_trace.argtypes = (ctypes.c_void_p, ctypes.POINTER(TraceBuffers))
+    ret.context_trace.restype = None
+    # contexts are used by one thread at a time: each thread has its own
+    #  contexts and prefixes dicts, see thread_state
+    ret.local = threading.local()
     ret.inline = lru_cache(maxsize=CACHE_SIZE)(partial(interprete, interpreter=ret))
+    ret.inline_scored = lru_cache(maxsize=CACHE_SIZE)(partial(interprete_scored, interpreter=ret))
+    ret.checkpointed_scored = lru_cache(maxsize=CACHE_SIZE)(partial(interprete_checkpointed, interpreter=ret))
+    ret.traced = partial(interprete_traced, interpreter=ret)
+    ret.jit = partial(JitEngine, interpreter=ret)
+    ret.program = partial(Program, interpreter=ret)
+    ret.context = partial(InterpreterContext, interpreter=ret)
+    ret.batch = partial(interprete_batch, interpreter=ret)
+    ret.checkpoints = partial(PrefixCheckpoints, interpreter=ret)
     return ret
 
 
+def thread_state(interpreter:ctypes.cdll, name:str) -> dict:
+    """Return the dict of given name of the current thread:
+
+    contexts -- (max output size, budget) -> default InterpreterContext
+    prefixes -- (input, expected, max output size, budget) -> PrefixCheckpoints
+
+    The C functions have no global state, and release the GIL: threads
+    can run programs concurrently, as long as they don't share contexts.
+
+    """
+    return interpreter.local.__dict__.setdefault(name, {})
+
+
+def default_context(interpreter:ctypes.cdll, max_output_size:int, budget:int=None) -> 'InterpreterContext':
+    """Return the context of the current thread used for given output size and budget"""
+    contexts = thread_state(interpreter, 'contexts')
+    context = contexts.get((max_output_size, budget))
+    if context is None:
+        context = InterpreterContext(max_output_size, budget=budget, interpreter=interpreter)
+        contexts[max_output_size, budget] = context
+    return context
+
+
 def simplified_source_code(source: str) -> str:
+    """Return given source without empty loops, and with [-] loops replaced
+    by the SET_ZERO extension.
+
+    The C interpreter performs the same simplification when compiling.
+
+    """
     source = source.replace('[]', '')
     source = re.sub(ZERO_INSTRUCTION, '0', source)
     return source
 
 
+def prefix_segments(source:str) -> [str]:
+    """Return given source cut after each of its top level loops.
+
+    Running the segments one after the other, without resetting the memory,
+    is running the source: the C interpreter simplifies and compiles them
+    in the same way. The last segment may be empty.
+
+    >>> prefix_segments('+[->+<]>[-]++.[.]')
+    ['+[->+<]', '>[-]', '++.[.]', '']
+    >>> prefix_segments('+[.]]>[-]'), prefix_segments('[[.]')
+    (['+[.]', ']>[-]'], ['[[.]'])
+
+    """
+    segments, depth, start, end = [], 0, 0, 0
+    for part in source.split(']')[:-1]:  # each part ends by a ]
+        depth += part.count('[')
+        end += len(part) + 1
+        if depth == 0:  # unmatched ] jumps to the end of the whole source
+            break
+        depth -= 1
+        if depth == 0:
+            segments.append(source[start:end])
+            start = end
+    segments.append(source[start:])
+    return segments
+
+
+def static_analysis(source:str) -> StaticAnalysis:
+    """Return what is known of any run of given source without running it:
+    the maximal length of its output, or None if it may output in a loop,
+    and whether it reads its input at all.
+
+    >>> static_analysis('+++[>++<-]>.,.')
+    StaticAnalysis(max_output_length=2, reads_input=True)
+    >>> static_analysis('+[.+]')
+    StaticAnalysis(max_output_length=None, reads_input=False)
+
+    """
+    reads_input = ',' in source
+    if '.' not in source:
+        return StaticAnalysis(0, reads_input)
+    depth, outputs = 0, 0
+    for char in source:
+        if char == '[':
+            depth += 1
+        elif char == ']':
+            depth = max(0, depth - 1)  # unmatched ] only jump to the end
+        elif char == '.':
+            if depth:
+                return StaticAnalysis(None, reads_input)
+            outputs += 1
+    return StaticAnalysis(outputs, reads_input)
+
+
+class Op(ctypes.Structure):
+    """Instruction of a compiled program, mirroring bf_op"""
+    _fields_ = [
+        ('code', ctypes.c_uint8),
+        ('arg', ctypes.c_int32),
+        ('lo', ctypes.c_int32),
+        ('hi', ctypes.c_int32),
+        ('first', ctypes.c_uint32),
+        ('count', ctypes.c_uint32),
+        ('src', ctypes.c_uint32),
+    ]
+
+
+class Term(ctypes.Structure):
+    """Term of a mul loop, mirroring bf_term"""
+    _fields_ = [
+        ('offset', ctypes.c_int32),
+        ('factor', ctypes.c_uint8),
+    ]
+
+
+class Program:
+    """A brainfuck source compiled once by the C interpreter,
+    that can then be run on any number of inputs.
+
+    >>> program = load_interpreter().program('++++>,<[->+<]>.')
+    >>> program.run('a'), program.run('b')
+    ('e', 'f')
+
+    """
+
+    def __init__(self, source:str, *, interpreter:ctypes.cdll):
+        self.source = str(source)
+        self._interpreter = interpreter
+        self._handle = interpreter.compile_bf(self.source.encode())
+
+    def __del__(self):
+        if getattr(self, '_handle', None):
+            self._interpreter.free_bf(self._handle)
+            self._handle = None
+
+    def __len__(self):
+        """Number of instructions in the compiled program"""
+        return self._interpreter.program_size(self._handle)
+
+    def ops(self) -> [Op]:
+        """Return the instructions of the compiled program"""
+        return self._interpreter.program_ops(self._handle)[:len(self)]
+
+    def terms(self) -> [Term]:
+        """Return the terms of the mul loops of the compiled program"""
+        nb_terms = max((op.first + op.count + 1 for op in self.ops() if op.code == OP_MUL), default=0)
+        return self._interpreter.program_terms(self._handle)[:nb_terms]
+
+    def run(self, input:str="", *, max_output_size:int=2**16) -> str:
+        return default_context(self._interpreter, max_output_size).text(self, input)
+
+    def steps(self, input:str="", *, max_output_size:int=2**16) -> int:
+        """Return the number of instructions executed when running on given input"""
+        context = default_context(self._interpreter, max_output_size)
+        context.run(self, input)
+        return context.steps
+
+
+class RunStatus(ctypes.Structure):
+    """Description of the last run of a context, mirroring bf_result"""
+    END, BUDGET, OUTPUT_FULL, ABORTED, CYCLE = range(5)  # termination reasons
+    _fields_ = [
+        ('output_length', ctypes.c_uint64),
+        ('steps', ctypes.c_uint64),
+        ('distance', ctypes.c_uint64),
+        ('termination', ctypes.c_uint8),
+    ]
+
+
+class TraceBuffers(ctypes.Structure):
+    """Statistics collected by the C interpreter, mirroring bf_trace"""
+    _fields_ = [
+        ('highest_cell', ctypes.c_int32),
+        ('counts', ctypes.POINTER(ctypes.c_uint64)),
+        ('counts_size', ctypes.c_uint64),
+        ('output_sources', ctypes.POINTER(ctypes.c_uint32)),
+    ]
+
+
+class InterpreterContext:
+    """Memory, output buffer and compilation tables of the C interpreter,
+    allocated once and reused by all runs.
+
+    A context must not be shared between threads: each worker should hold its own.
+
+    budget -- maximal number of instructions of a run, or None for the default
+        MAXIMAL_INSTRUCTION_EXECUTION of the C interpreter.
+    detect_cycles -- if True, runs that come back to a state they already
+        were in are stopped early, since they would never end.
+
+    >>> context = load_interpreter().context(16)
+    >>> bytes(context.run('++++++++[>++++++++<-]>+.+.'))
+    b'AB'
+    >>> context.text(load_interpreter().program(',+.'), 'a')
+    'b'
+
+    """
+
+    def __init__(self, max_output_size:int=2**16, *, budget:int=None,
+                 detect_cycles:bool=True, interpreter:ctypes.cdll):
+        self.max_output_size = int(max_output_size)
+        self._interpreter = interpreter
+        self._handle = interpreter.new_context(self.max_output_size)
+        self.configure(budget, detect_cycles)
+        address = interpreter.context_output(self._handle)
+        self._output = memoryview((ctypes.c_ubyte * self.max_output_size).from_address(address)).cast('B')
+        self.result = interpreter.context_result(self._handle).contents  # updated by each run
+
+    def __del__(self):
+        if getattr(self, '_handle', None):
+            self._output.release()
+            self._interpreter.free_context(self._handle)
+            self._handle = None
+
+    def configure(self, budget:int=None, detect_cycles:bool=True):
+        """Set the budget and cycle detection of next runs. See class doc"""
+        self.budget, self.detect_cycles = budget, bool(detect_cycles)
+        self._interpreter.configure_context(self._handle, budget or 0, self.detect_cycles)
+
+    @property
+    def steps(self) -> int:
+        """Number of instructions executed by the last run"""
+        return self.result.steps
+
+    def run(self, source:str or Program, input:str="") -> memoryview:
+        """Run given source or Program on given input, and return its output.
+
+        The returned memoryview is a view on the context buffer:
+        it is only valid until the next run.
+
+        """
+        input = input.encode()
+        if isinstance(source, Program):
+            length = self._interpreter.context_run(self._handle, source._handle, input, len(input))
+        else:
+            source = source.encode()
+            length = self._interpreter.context_interpret(self._handle, source, len(source), input, len(input))
+        return self._output[:length]
+
+    def text(self, source:str or Program, input:str="") -> str:
+        """Like run, but return the output as a string"""
+        return str(self.run(source, input), encoding="ISO-8859-1")  # use ascii, because brainfuck
+
+    def score(self, source:str or Program, input:str, expected:str, bound:int) -> int:
+        """Run given source or Program on given input, and return the distance
+        between its output and expected output, as computed by compare_str.c.
+
+        The run is aborted as soon as the distance exceeds given bound,
+        in which case the returned distance is only a lower bound.
+        The output is then available in self.output.
+
+        """
+        input, expected = input.encode(), expected.encode()
+        if isinstance(source, Program):
+            return self._interpreter.context_score(self._handle, source._handle, input, len(input), expected, len(expected), bound)
+        source = source.encode()
+        return self._interpreter.context_interpret_score(self._handle, source, len(source), input, len(input), expected, len(expected), bound)
+
+    def trace(self, source:str or Program, input:str="", expected:str=None, bound:int=2**64-1) -> RunTrace:
+        """Run given source or Program like run, or like score if expected
+        is given, and return the statistics of the run.
+
+        Only this run pays for their collection: the other runs
+        of the context are executed without any trace code.
+
+        """
+        source_size = len((source.source if isinstance(source, Program) else source).encode())
+        buffers = TraceBuffers(0, (ctypes.c_uint64 * source_size)(), source_size,
+                               (ctypes.c_uint32 * self.max_output_size)())
+        self._interpreter.context_trace(self._handle, buffers)
+        try:
+            if expected is None:
+                self.run(source, input)
+            else:
+                self.score(source, input, expected, bound)
+        finally:
+            self._interpreter.context_trace(self._handle, None)
+        return RunTrace(self.steps, self.result.termination, buffers.highest_cell,
+                        tuple(buffers.counts[:source_size]),
+                        tuple(buffers.output_sources[:self.result.output_length]))
+
+    @property
+    def output(self) -> memoryview:
+        """Output of the last run"""
+        return self._output[:self.result.output_length]
+
+    @property
+    def aborted(self) -> bool:
+        """True if the last run was aborted because its distance exceeded the bound"""
+        return self.result.termination == RunStatus.ABORTED
+
+    @property
+    def cycled(self) -> bool:
+        """True if the last run was stopped because it would never end"""
+        return self.result.termination == RunStatus.CYCLE
+
+
+class Checkpoint:
+    """State of an InterpreterContext at the end of a run"""
+
+    def __init__(self, context:InterpreterContext):
+        self._interpreter = context._interpreter
+        self._handle = self._interpreter.context_checkpoint(context._handle)
+        self.steps = context.steps
+
+    def __del__(self):
+        if getattr(self, '_handle', None):
+            self._interpreter.free_checkpoint(self._handle)
+            self._handle = None
+
+
+class PrefixCheckpoints:
+    """Runs of sources on a fixed input, that save a Checkpoint at the end
+    of each of their segments (see prefix_segments).
+
+    A source sharing its first segments with an already run one
+    starts from the checkpoint of the last shared segment, instead of
+    from its first instruction. Checkpoints are indexed in a trie of segments.
+
+    Saving checkpoints has a cost: they are only saved for runs executing
+    at least min_steps instructions after their starting checkpoint.
+    Because segments are compiled separately, the number of executed
+    instructions may differ a little from the one of a direct run.
+
+    If expected is given, the distance between outputs and expected output
+    is computed during the runs, like with InterpreterContext.score.
+
+    >>> checkpoints = load_interpreter().checkpoints('a', max_output_size=16, min_steps=0)
+    >>> checkpoints.text(',[->+<]>+.'), checkpoints.text(',[->+<]>++.')
+    ('b', 'c')
+    >>> checkpoints.resumed
+    1
+
+    """
+
+    def __init__(self, input:str="", expected:str=None, bound:int=2**64-1, *,
+                 max_output_size:int=2**16, budget:int=None, capacity:int=2**14,
+                 min_steps:int=2**16, interpreter:ctypes.cdll):
+        self.input, self.expected, self.bound = input, expected, bound
+        self._input, self._expected = input.encode(), None if expected is None else expected.encode()
+        self.capacity = int(capacity)  # maximal number of kept checkpoints
+        self.min_steps = int(min_steps)
+        self.context = InterpreterContext(max_output_size, budget=budget, interpreter=interpreter)
+        self._interpreter = interpreter
+        self._trie = {}  # segment -> (checkpoint, {next segment -> ...})
+        self.size = 0  # number of checkpoints in the trie
+        self.resumed = 0  # number of runs that started from a checkpoint
+
+    def run(self, source:str) -> memoryview:
+        """Run given source, and return its output.
+
+        As for InterpreterContext.run, the returned memoryview
+        is only valid until the next run.
+
+        """
+        if self.size >= self.capacity:
+            self._trie.clear()
+            self.size = 0
+        segments = prefix_segments(source)
+        # find the checkpoint of the longest already run prefix
+        checkpoint, children, shared = None, self._trie, 0
+        while shared < len(segments) - 1 and segments[shared] in children:
+            checkpoint, children = children[segments[shared]]
+            shared += 1
+        self.resumed += bool(shared)
+        if checkpoint is None:
+            self._run(source)
+        else:
+            self._restore(checkpoint)
+            self._continue(''.join(segments[shared:]))
+        start_steps = checkpoint.steps if checkpoint else 0
+        if shared < len(segments) - 1 and self.context.steps - start_steps >= self.min_steps:
+            # costly run: run it again, saving the state after each segment
+            self._restore(checkpoint)
+            for segment in segments[shared:-1]:
+                self._continue(segment)
+                children[segment] = Checkpoint(self.context), {}
+                children = children[segment][1]
+                self.size += 1
+            self._continue(segments[-1])
+        return self.context.output
+
+    def _restore(self, checkpoint:Checkpoint or None):
+        self._interpreter.context_restore(self.context._handle, checkpoint and checkpoint._handle)
+
+    def _run(self, source:str):
+        if self.expected is None:
+            self.context.run(source, self.input)
+        else:
+            self.context.score(source, self.input, self.expected, self.bound)
+
+    def _continue(self, segment:str):
+        segment = segment.encode()
+        expected_size = 0 if self._expected is None else len(self._expected)
+        self._interpreter.context_continue(self.context._handle, segment, len(segment), self._input, len(self._input),
+                                           self._expected, expected_size, self.bound)
+
+    def text(self, source:str) -> str:
+        """Like run, but return the output as a string"""
+        return str(self.run(source), encoding="ISO-8859-1")
+
+    def score(self, source:str) -> int:
+        """Run given source, and return the distance between its output
+        and expected output. See InterpreterContext.score.
+
+        """
+        self.run(source)
+        return self.context.result.distance
+
+
+class BatchResult:
+    """Outputs of N sources run on M inputs, stored in a single contiguous buffer.
+
+    >>> result = load_interpreter().batch([',.', ',+.'], ['a', 'b'])
+    >>> result.output(1, 0), list(result)
+    ('b', [['a', 'b'], ['b', 'c']])
+
+    """
+
+    def __init__(self, nb_sources:int, nb_inputs:int, max_output_size:int):
+        self.shape = nb_sources, nb_inputs
+        self.max_output_size = int(max_output_size)
+        self.outputs = ctypes.create_string_buffer(nb_sources * nb_inputs * self.max_output_size)
+        self.lengths = (ctypes.c_uint64 * (nb_sources * nb_inputs))()
+
+    def raw_output(self, source_idx:int, input_idx:int) -> memoryview:
+        """Return the output of given source on given input, without copy"""
+        idx = source_idx * self.shape[1] + input_idx
+        start = idx * self.max_output_size
+        return memoryview(self.outputs)[start:start + self.lengths[idx]]
+
+    def output(self, source_idx:int, input_idx:int) -> str:
+        return self.raw_output(source_idx, input_idx).tobytes().decode(encoding="ISO-8859-1")
+
+    def __iter__(self):
+        """Yield, for each source, the list of outputs for each input"""
+        for source_idx in range(self.shape[0]):
+            yield [self.output(source_idx, input_idx) for input_idx in range(self.shape[1])]
+
+
+# Code of the native programs. The run function follows execute in bfinterp.c,
+#  with one label per op, and without cycle detection.
+NATIVE_HEADER = """#include <stddef.h>
+#include <stdint.h>
+
+static inline int32_t clamp(const int32_t value, const int32_t lo, const int32_t hi) {
+    return value < lo ? lo : (value > hi ? hi : value);
+}
+
+static inline uint64_t letter_distance(const char expected, const char found) {
+    const int8_t one = (int8_t)(expected %% (INT8_MAX + 1));
+    const int8_t two = (int8_t)(found %% (INT8_MAX + 1));
+    const int64_t diff = one - two;
+    return (uint64_t)(diff < 0 ? -diff : diff) %% (INT8_MAX + 1);
+}
+
+// results receives the number of executed instructions, the termination
+//  and the distance to expected output, if expected is not NULL.
+uint64_t run(char const* input, const uint64_t input_size, char* output, const uint64_t output_size,
+             const uint64_t budget, char const* expected, const uint64_t expected_size, uint64_t* results) {
+    uint8_t memory[%(memory_size)d] = {0};
+    int32_t p = 0;
+    uint64_t count = 0;
+    uint8_t termination = %(end)d;
+    char const* p_input = input;
+    char* p_output = output;
+"""
+NATIVE_FOOTER = """
+    if(count >= budget) termination = %(budget)d;
+end:
+    *p_output = '\\0';
+    const uint64_t output_length = p_output - output;
+    uint64_t distance = 0;
+    if(expected != NULL) {
+        for(uint64_t idx = 0 ; idx < output_length ; idx++) {
+            distance += idx < expected_size ? letter_distance(expected[idx], output[idx]) : %(uint8_max)d;
+        }
+        if(output_length < expected_size) distance += %(uint8_max)d * (expected_size - output_length);
+    }
+    results[0] = count;
+    results[1] = termination;
+    results[2] = distance;
+    return output_length;
+}
+"""
+
+
+def native_source(program:Program) -> str:
+    """Return the C code of a function running given program,
+    with the same output and number of executed instructions than
+    the C interpreter without cycle detection.
+
+    """
+    ops, terms = program.ops(), program.terms()
+    code = [NATIVE_HEADER % {'memory_size': MEMORY_SIZE, 'end': RunStatus.END}]
+    for idx, op in enumerate(ops):
+        code.append(f'op{idx}:\n    if(count >= budget) goto op{len(ops)};\n')
+        if op.code == OP_MOVE:
+            code.append(f'    p = clamp(p + {op.arg}, {op.lo}, {op.hi});\n')
+        elif op.code == OP_ADD:
+            code.append(f'    memory[p] += {op.arg};\n')
+        elif op.code == OP_IN:
+            code.append(f'    for(int32_t i = 0 ; i < {op.arg} ; i++) memory[p] = p_input < &input[input_size] ? *p_input++ : 0;\n')
+        elif op.code == OP_OUT:
+            code.append(f'    for(int32_t i = 0 ; i < {op.arg} ; i++) {{\n'
+                        f'        *p_output++ = memory[p] % 128;\n'
+                        f'        if(p_output >= &output[output_size-1]) {{ ++count; termination = {RunStatus.OUTPUT_FULL}; goto end; }}\n'
+                        f'    }}\n')
+        elif op.code == OP_CLEAR:
+            code.append('    memory[p] = 0;\n')
+        elif op.code == OP_SCAN:
+            code.append(f'    while(memory[p]) {{\n'
+                        f'        const int32_t next = clamp(p + {op.arg}, {op.lo}, {op.hi});\n'
+                        f'        if(next == p || count >= budget) {{ count = budget; break; }}\n'
+                        f'        p = next;\n'
+                        f'        ++count;\n'
+                        f'    }}\n')
+        elif op.code == OP_MUL:
+            loop = terms[op.first:op.first + op.count + 1]
+            times = '(uint8_t)-memory[p]' if loop[0].factor == 1 else 'memory[p]'
+            code.append(f'    if(p + {op.lo} < 0 || p + {op.hi} >= {MEMORY_SIZE}) {{ ++count; goto op{idx + 1}; }}\n'
+                        f'    if(memory[p]) {{\n'
+                        f'        const uint8_t times = {times};\n')
+            code.extend(f'        memory[p + {term.offset}] += {term.factor} * times;\n' for term in loop[1:])
+            code.append(f'        memory[p] = 0;\n'
+                        f'    }}\n'
+                        f'    ++count;\n'
+                        f'    goto op{op.arg};\n')
+            continue
+        elif op.code == OP_JZ:
+            code.append(f'    if(!memory[p]) {{ ++count; goto op{op.arg}; }}\n')
+        elif op.code == OP_JNZ:
+            code.append(f'    if(memory[p]) {{ ++count; goto op{op.arg}; }}\n')
+        else:
+            raise ValueError(f"op {op.code} can't be compiled to native code")
+        code.append('    ++count;\n')
+    code.append(f'op{len(ops)}:')
+    code.append(NATIVE_FOOTER % {'budget': RunStatus.BUDGET, 'uint8_max': UINT8_MAX})
+    return ''.join(code)
+
+
+class NativeProgram:
+    """A program compiled to native code by gcc, loaded from its shared object"""
+
+    def __init__(self, path:str):
+        self.path = path
+        self._run = ctypes.cdll.LoadLibrary(path).run
+        self._run.argtypes = (ctypes.c_char_p, ctypes.c_uint64, ctypes.c_char_p, ctypes.c_uint64, ctypes.c_uint64,
+                              ctypes.c_char_p, ctypes.c_uint64, ctypes.POINTER(ctypes.c_uint64))
+        self._run.restype = ctypes.c_uint64  # output length
+        self._output = ctypes.create_string_buffer(0)  # reused while the output size is the same
+        self._results = (ctypes.c_uint64 * 3)()
+        self.steps, self.termination = 0, RunStatus.END  # of the last run
+
+    @staticmethod
+    def build(program:Program, path:str):
+        """Compile given program in a shared object at given path.
+        Concurrent builds of the same path are harmless.
+
+        """
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        with tempfile.TemporaryDirectory(dir=directory) as tmpdir:
+            c_file, so_file = os.path.join(tmpdir, 'program.c'), os.path.join(tmpdir, 'program.so')
+            with open(c_file, 'w') as fd:
+                fd.write(native_source(program))
+            subprocess.run(('gcc', *JIT_GCC_OPTIONS, '-o', so_file, c_file), check=True, capture_output=True)
+            os.replace(so_file, path)  # atomic: other processes see a complete file, or none
+
+    def run(self, input:str="", expected:str=None, *, max_output_size:int=2**16,
+            budget:int=None) -> (str, int):
+        """Return the output on given input, and its distance to expected
+        output, as computed by compare_str.c, or 0 if expected is None.
+
+        """
+        if len(self._output) != max_output_size:
+            self._output = ctypes.create_string_buffer(max_output_size)
+        input = input.encode()
+        expected = None if expected is None else expected.encode()
+        length = self._run(input, len(input), self._output, max_output_size, budget or MAXIMAL_INSTRUCTION_EXECUTION,
+                           expected, len(expected or b''), self._results)
+        self.steps, self.termination, distance = self._results
+        return ctypes.string_at(self._output, length).decode(encoding="ISO-8859-1"), distance
+
+
+class JitEngine:
+    """Interpreter compiling to native code the sources it runs often or long,
+    usable in place of the one of load_interpreter by the scoring functions.
+
+    Sources are run by the C interpreter until one of their runs executes
+    at least min_steps instructions, or until they were run min_runs times.
+    Their canonical form (see canonical.py) is then compiled by gcc into
+    a shared object of cache_dir, named after its hash: all sources
+    with the same canonical form share it, and it is reused by later sessions.
+    A source with a shared object in cache_dir is never interpreted.
+
+    Native runs have no cycle detection and are never aborted: their
+    distance to expected output is always exact. Their call costs a few µs
+    more than an interpreted run, so that only long runs are faster.
+
+    >>> jit = load_interpreter().jit()
+    >>> jit.inline('++++>,<[->+<]>.', 'a'), jit.inline('++++>,<[->+<]>.', 'b')
+    ('e', 'f')
+
+    """
+
+    def __init__(self, *, min_runs:int=JIT_MIN_RUNS, min_steps:int=JIT_MIN_STEPS,
+                 cache_dir:str=JIT_CACHE_DIR, capacity:int=2**16, interpreter:ctypes.cdll):
+        self.min_runs, self.min_steps = int(min_runs), int(min_steps)
+        self.cache_dir = cache_dir
+        self.capacity = int(capacity)  # maximal number of sources with counted runs
+        self._interpreter = interpreter
+        self._keys = {}  # source -> hash of its canonical form
+        self._runs = {}  # hash -> number of interpreted runs
+        self._natives = {}  # hash -> NativeProgram, or None if it can't be compiled
+        self.inline = lru_cache(maxsize=CACHE_SIZE)(self.interprete)
+        self.inline_scored = lru_cache(maxsize=CACHE_SIZE)(self.interprete_scored)
+
+    def _key(self, source:str) -> str:
+        """Return the hash of the canonical form of given source"""
+        key = self._keys.get(source)
+        if key is None:
+            import canonical  # canonical depends on this module
+            if len(self._keys) >= self.capacity:
+                self._keys.clear()
+            key = self._keys[source] = canonical.source_hash(source)
+        return key
+
+    def native(self, source:str) -> NativeProgram or None:
+        """Return the native program of given source, if already compiled"""
+        key = self._key(source)
+        if key in self._natives:
+            return self._natives[key]
+        # the cache directory is only looked at before the first interpreted run
+        if key not in self._runs and os.path.exists(self._path(key)):
+            self._natives[key] = NativeProgram(self._path(key))
+            return self._natives[key]
+        return None
+
+    def _path(self, key:str) -> str:
+        return os.path.join(self.cache_dir, f'{key}-{JIT_VERSION}.so')
+
+    def _count(self, source:str, steps:int):
+        """Count an interpreted run of given source, and compile it if it costs enough.
+        Sources that failed to compile are not counted anymore."""
+        import canonical
+        key = self._key(source)
+        if key in self._natives:
+            return
+        if len(self._runs) >= self.capacity:
+            self._runs.clear()
+        self._runs[key] = self._runs.get(key, 0) + 1
+        if self._runs[key] >= self.min_runs or steps >= self.min_steps:
+            del self._runs[key]
+            self._natives[key] = self._compiled(canonical.canonical_source(source), self._path(key))
+
+    def _compiled(self, source:str, path:str) -> NativeProgram or None:
+        if not os.path.exists(path):
+            try:
+                NativeProgram.build(Program(source, interpreter=self._interpreter), path)
+            except (OSError, ValueError, subprocess.CalledProcessError):
+                return None  # no gcc, or a breakpoint in the program: it stays interpreted
+        return NativeProgram(path)
+
+    def interprete(self, source:str, input:str="", *, max_output_size:int=2**16, budget:int=None) -> str:
+        native = self.native(source)
+        if native is not None:
+            return native.run(input, max_output_size=max_output_size, budget=budget)[0]
+        context = default_context(self._interpreter, max_output_size, budget)
+        output = context.text(source, input)
+        self._count(source, context.steps)
+        return output
+
+    def interprete_scored(self, source:str, input:str, expected:str, bound:int, *,
+                          max_output_size:int=2**16, budget:int=None) -> (int, str):
+        """Like interpreter.interprete_scored"""
+        native = self.native(source)
+        if native is not None:
+            found, distance = native.run(input, expected, max_output_size=max_output_size, budget=budget)
+            return distance, found
+        context = default_context(self._interpreter, max_output_size, budget)
+        distance = context.score(source, input, expected, bound)
+        self._count(source, context.steps)
+        return distance, str(context.output, encoding="ISO-8859-1")
+
+    def checkpointed_scored(self, source:str, input:str, expected:str, *,
+                            max_output_size:int=2**16, budget:int=None) -> (int, str):
+        return self.inline_scored(source, input, expected, 2**64-1, max_output_size=max_output_size, budget=budget)
+
+    def batch(self, sources:[str], inputs:[str]=('',), *, max_output_size:int=2**16) -> BatchResult:
+        """Like interpreter.interprete_batch"""
+        sources, inputs = tuple(sources), tuple(inputs)
+        result = BatchResult(len(sources), len(inputs), max_output_size)
+        for source_idx, source in enumerate(sources):
+            for input_idx, input in enumerate(inputs):
+                idx = source_idx * len(inputs) + input_idx
+                output = self.interprete(source, input, max_output_size=max_output_size).encode(encoding="ISO-8859-1")
+                ctypes.memmove(ctypes.addressof(result.outputs) + idx * result.max_output_size, output, len(output))
+                result.lengths[idx] = len(output)
+        return result
+
+
+def _packed(strings:[str]) -> (bytes, ctypes.Array):
+    """Return the concatenation of given strings, and the offsets of each of them"""
+    encoded = tuple(string.encode() for string in strings)
+    offsets = (ctypes.c_uint64 * (len(encoded) + 1))()
+    for idx, string in enumerate(encoded):
+        offsets[idx + 1] = offsets[idx] + len(string)
+    return b''.join(encoded), offsets
+
+
+def interprete_batch(sources:[str], inputs:[str]=('',), *, interpreter:ctypes.cdll=None,
+                     max_output_size:int=2**16) -> BatchResult:
+    """Run all sources on all inputs in a single call to the C interpreter.
+
+    Each source is compiled only once. Because the interpreter is loaded
+    through ctypes.cdll, the GIL is released during the whole call.
+
+    """
+    sources, inputs = tuple(sources), tuple(inputs)
+    result = BatchResult(len(sources), len(inputs), max_output_size)
+    packed_sources, source_offsets = _packed(sources)
+    packed_inputs, input_offsets = _packed(inputs)
+    interpreter.run_bf_batch(packed_sources, source_offsets, len(sources),
+                             packed_inputs, input_offsets, len(inputs),
+                             result.outputs, result.lengths, max_output_size)
+    return result
+
+
 def interprete(source:str, input:str="", *, interpreter:ctypes.cdll=None,
-               max_output_size:int=2**16) -> str:
-    # remove weird things in source
-    source = simplified_source_code(source)
-
-    output = ('\0' * max_output_size).encode()
-    # print(source)
-    interpreter.interpret_bf(source.encode(), input.encode(), output, max_output_size)
-    output = output.decode(encoding="ISO-8859-1")  # use ascii, because brainfuck
-    return output.rstrip('\0')
+               max_output_size:int=2**16, budget:int=None) -> str:
+    return default_context(interpreter, max_output_size, budget).text(source, input)
+
+
+def interprete_scored(source:str, input:str, expected:str, bound:int, *,
+                      interpreter:ctypes.cdll=None, max_output_size:int=2**16,
+                      budget:int=None) -> (int, str):
+    """Return the distance between output of given source and expected output,
+    and the output itself. See InterpreterContext.score.
+
+    """
+    context = default_context(interpreter, max_output_size, budget)
+    distance = context.score(source, input, expected, bound)
+    return distance, str(context.output, encoding="ISO-8859-1")
+
+
+def interprete_traced(source:str, input:str, expected:str, bound:int, *,
+                      interpreter:ctypes.cdll=None, max_output_size:int=2**16,
+                      budget:int=None) -> (int, str, RunTrace):
+    """Like interprete_scored, but also return the statistics of the run.
+    See InterpreterContext.trace.
+
+    """
+    context = default_context(interpreter, max_output_size, budget)
+    trace = context.trace(source, input, expected, bound)
+    return context.result.distance, str(context.output, encoding="ISO-8859-1"), trace
+
+
+def interprete_checkpointed(source:str, input:str, expected:str, *,
+                            interpreter:ctypes.cdll=None, max_output_size:int=2**16,
+                            budget:int=None) -> (int, str):
+    """Like interprete_scored, but starting from the checkpoints of previous
+    runs of sources sharing a prefix with given one. See PrefixCheckpoints.
+
+    Runs are never aborted, so that their checkpoints can be used
+    whatever the bound.
+
+    """
+    key = input, expected, max_output_size, budget
+    prefixes = thread_state(interpreter, 'prefixes')
+    checkpoints = prefixes.get(key)
+    if checkpoints is None:
+        if len(prefixes) >= PREFIX_TRIES:
+            del prefixes[next(iter(prefixes))]  # the oldest one
+        checkpoints = PrefixCheckpoints(input, expected, max_output_size=max_output_size,
+                                        budget=budget, interpreter=interpreter)
+        prefixes[key] = checkpoints
+    distance = checkpoints.score(source)
+    return distance, str(checkpoints.context.output, encoding="ISO-8859-1")
 
 
 def test_interprete():
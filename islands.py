@@ -0,0 +1,209 @@
+"""Island model of the meta meta heuristic.
+
+Each population, an island, evolves in its own process with its own
+specialized Configuration, and the islands regularly exchange their best
+units. Islands run by epochs of migrate_every steps: the processes are
+forked at each epoch, inheriting the configurations, that hold closures
+and therefore can't be pickled, and only send back their population.
+Islands therefore need the fork start method, that macOS and Windows lack.
+
+At the end of each epoch, each island sends copies of its best units to
+another island, chosen according to the topology:
+- 'ring': island i sends to island i + 1
+- 'random': each island sends to a random other island
+Immigrants replace random members, since the last population of an island
+is not scored yet.
+
+"""
+
+
+import random
+import multiprocessing
+
+from unit import Unit
+from config import Configuration
+from mmh import MMH, genalg_functions
+from evaluation import default_processes
+
+
+TOPOLOGIES = ('ring', 'random')
+DEFAULT_MIGRATION_PERIOD = 5  # number of steps between two migrations
+DEFAULT_MIGRANTS = 2  # number of units sent by each island at each migration
+ISLAND_BACKEND = 'serial'  # each island scores its units in its own process
+
+# state of the current epoch, inherited by the forked island processes:
+#  (case, pop_size, configs, populations, first step, number of steps)
+_EPOCH = None
+
+
+def _evolve(idx:int) -> (tuple, list, set, list):
+    """Run the steps of current epoch on island of given index.
+
+    Return its new population, the data given to callback_stats at each step,
+    the sources of its winners, and its best units of last scored step.
+
+    """
+    case, pop_size, configs, populations, first_step, steps = _EPOCH
+    config, pop = configs[idx], populations[idx]
+    stats, winners, scored, survival = [], set(), {}, None
+    for step_number in range(first_step, first_step + steps):
+        pop, scored, new_winners, survival = config.step(
+            pop, case, pop_size,
+            **genalg_functions(config),
+            step_number=step_number,
+            callback_stats=lambda **data: stats.append(dict(data, step=step_number)),
+            backend=ISLAND_BACKEND,
+            **({} if survival is None else {'min_score': survival}),
+        )
+        winners |= {winner.source for winner in new_winners}
+    bests = sorted(scored, key=lambda unit: scored[unit].score, reverse=True)
+    return tuple(pop), stats, winners, bests
+
+
+class _IslandsScoring:
+    """Evaluator of IslandMMH, that doesn't start workers:
+    each island scores its units in its own process"""
+
+    def __init__(self, processes:int):
+        self.processes = processes
+
+
+class IslandMMH(MMH):
+    """MMH evolving its populations in parallel processes, with migrations.
+
+    Each step call runs an epoch of migrate_every steps on all islands,
+    followed by a migration. Populations can be split and merged between
+    two epochs.
+
+    Islands are forked processes: on platforms without the fork start
+    method, like macOS and Windows, the constructor raises RuntimeError.
+
+    """
+
+    def __init__(self, case:'Case', pop_size:int, config:Configuration,
+                 pop_number:int=None, data_handler:callable=None, processes:int=None, *,
+                 topology:str='ring', migrate_every:int=DEFAULT_MIGRATION_PERIOD, migrants:int=DEFAULT_MIGRANTS):
+        """
+
+        pop_number -- number of islands, default to the number of CPUs
+        processes -- number of islands evolving at the same time,
+            default to the number of CPUs
+        topology -- how islands are connected, one of TOPOLOGIES
+        migrate_every -- number of steps of each epoch
+        migrants -- number of units sent by each island at each migration
+        Other parameters are the ones of MMH.
+
+        data_handler also gets the index of the island.
+
+        """
+        if 'fork' not in multiprocessing.get_all_start_methods():
+            raise RuntimeError("Islands inherit their configurations from forked processes, "
+                               "but the fork start method is not available on this platform.")
+        if topology not in TOPOLOGIES:
+            raise ValueError(f"Topology {topology} is not known. Expecteds are: {', '.join(TOPOLOGIES)}.")
+        self.topology = topology
+        self.migrate_every = max(1, int(migrate_every))
+        self.migrants = int(migrants)
+        self.processes = int(processes or default_processes())
+        self._islands = int(pop_number or default_processes())
+        super().__init__(case, pop_size, config, self._islands, data_handler, processes,
+                         evaluator=_IslandsScoring(self.processes))
+        self.populations = tuple(self.populations)
+
+
+    def _init_config(self):
+        """Give each island its own specialization of the template config"""
+        self.configs = [self.config_template.specialize() for _ in range(self._islands)]
+        self.config = self.configs[0]
+        for idx, config in enumerate(self.configs):
+            print(f'ISLAND {idx} CONFIG:\n' + str(config))
+
+
+    def step(self):
+        """Compute next epoch, and migrate the best units"""
+        global _EPOCH
+        epoch = range(self.current_step, self.current_step + self.migrate_every)
+        self.changed_config = any(map(self.change_config_at, epoch))
+        if self.changed_config:
+            self._init_config()
+
+        if any(map(self.prompt_at, epoch)):
+            input('?')
+
+        _EPOCH = self.case, self.pop_size, self.configs, self.populations, self.current_step, self.migrate_every
+        try:
+            # islands must inherit their configurations
+            context = multiprocessing.get_context('fork')
+            with context.Pool(processes=min(self.processes, len(self.populations))) as pool:
+                results = pool.map(_evolve, range(len(self.populations)), chunksize=1)
+        finally:
+            _EPOCH = None
+        for idx, (_, stats, winners, _) in enumerate(results):
+            self.found_solutions |= winners
+            if self.data_handler:
+                for data in stats:
+                    self.data_handler(**data, config=genalg_functions(self.configs[idx]), island=idx)
+        self.populations = self.migrate([pop for pop, *_ in results], [bests for *_, bests in results])
+
+        self.current_step += self.migrate_every
+
+        return self.populations
+
+
+    def targets(self) -> [int]:
+        """Return the index of the island receiving the migrants of each island"""
+        size = len(self.populations)
+        if size < 2:
+            return list(range(size))
+        if self.topology == 'ring':
+            return [(idx + 1) % size for idx in range(size)]
+        return [random.choice([other for other in range(size) if other != idx]) for idx in range(size)]
+
+
+    def migrate(self, populations:[tuple], bests:[list]) -> tuple:
+        """Return given populations, where each island received copies of
+        the first units of the bests of another one.
+
+        """
+        populations = [list(pop) for pop in populations]
+        for source, target in enumerate(self.targets()):
+            if source == target:
+                continue
+            pop = populations[target]
+            migrants = bests[source][:min(self.migrants, len(pop))]
+            for idx, unit in zip(random.sample(range(len(pop)), len(migrants)), migrants):
+                pop[idx] = Unit(unit.source, unit.chrom_size, unit.mutation_rate, unit.additional_mutation_rate)
+        return tuple(map(tuple, populations))
+
+
+    def split(self, idx:int) -> int:
+        """Split island of given index in two islands, each one getting half
+        of its population, that the next steps will grow back to pop_size.
+        The new island gets a new specialization of the template config.
+
+        Return the index of the new island.
+
+        """
+        pop = list(self.populations[idx])
+        random.shuffle(pop)
+        half = len(pop) // 2
+        if not half:
+            raise ValueError(f"Population of island {idx} is too small to be split.")
+        self.populations = self.populations[:idx] + (tuple(pop[:half]),) + self.populations[idx + 1:] + (tuple(pop[half:]),)
+        self.configs.append(self.config_template.specialize())
+        self._islands = len(self.populations)
+        return len(self.populations) - 1
+
+
+    def merge(self, idx:int, other:int):
+        """Merge the population of island other into the one of island idx,
+        which keeps its config. The next steps will reduce it to pop_size.
+
+        """
+        if idx == other:
+            raise ValueError(f"Island {idx} can't be merged with itself.")
+        merged = self.populations[idx] + self.populations[other]
+        self.populations = tuple(merged if island == idx else pop
+                                 for island, pop in enumerate(self.populations) if island != other)
+        del self.configs[other]
+        self._islands = len(self.populations)
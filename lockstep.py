@@ -0,0 +1,285 @@
+"""Interpreter running a whole population of brainfuck sources at once,
+using NumPy instead of the C library.
+
+The tapes of all units are the rows of a single uint8 matrix, and all program
+counters advance together: each step applies, with masked NumPy operations,
+the current instruction of every unit still running.
+
+The LockstepInterpreter exposes the same inline, inline_scored and batch
+interface than the object returned by interpreter.load_interpreter,
+so that it can be given to scoring functions. Its scored_batch runs the
+sources of a whole population at once: stepping calls it before scoring
+the units one by one, whose runs are then taken from that batch.
+
+"""
+
+import re
+from functools import lru_cache
+
+import numpy as np
+
+from interpreter import simplified_source_code, BatchResult, CACHE_SIZE, MEMORY_SIZE, MEMORY_END, UINT8_MAX
+
+
+# A population runs as long as its slowest unit: the budget is far lower
+#  than the MAXIMAL_INSTRUCTION_EXECUTION of the C interpreter.
+DEFAULT_BUDGET = 2**16
+CHUNK_SIZE = 2**12  # maximal number of runs in lockstep, limiting memory usage
+CYCLE_CHECK = 2**6  # number of steps between two searches of cycles
+TAIL_SIZE = 32  # below this number of running units, they are run one by one
+IGNORED = re.compile(r"[^<>+\-\[\],.0]")  # characters without effect on output
+
+# Instructions, with the same meaning than the ones of the C interpreter
+MOVE, ADD, IN, OUT, CLEAR, JZ, JNZ, HALT = range(8)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def lowered(source:str) -> np.ndarray:
+    """Return the instructions of given source, as an array of rows
+    (code, arg, lo, hi), with runs folded like the C interpreter does.
+
+    Moves bring the memory pointer p to clamp(p + arg, lo, hi).
+    Jumps go to the instruction following the matching bracket,
+    or to the end for unmatched brackets.
+
+    >>> lowered('++>-<<.').tolist()
+    [[1, 2, 0, 0], [0, 1, 1, 2047], [1, 255, 0, 0], [0, -2, 0, 2045], [3, 0, 0, 0]]
+
+    """
+    ops, stack = [], []
+    for char in IGNORED.sub('', simplified_source_code(source)):
+        last = ops[-1] if ops else None
+        if char in '<>':
+            delta = 1 if char == '>' else -1
+            _, arg, lo, hi = ops.pop() if last and last[0] == MOVE else (MOVE, 0, 0, MEMORY_END)
+            lo, hi = min(max(lo + delta, 0), MEMORY_END), min(max(hi + delta, 0), MEMORY_END)
+            if (arg + delta, lo, hi) != (0, 0, MEMORY_END):  # else moves cancelled each others
+                ops.append([MOVE, arg + delta, lo, hi])
+        elif char in '+-':
+            _, arg, _, _ = ops.pop() if last and last[0] == ADD else (ADD, 0, 0, 0)
+            arg = (arg + (1 if char == '+' else -1)) % 256
+            if arg:  # else additions cancelled each others
+                ops.append([ADD, arg, 0, 0])
+        elif char == '[':
+            stack.append(len(ops))
+            ops.append([JZ, None, 0, 0])
+        elif char == ']' and stack:
+            start = stack.pop()
+            ops.append([JNZ, start + 1, 0, 0])
+            ops[start][1] = len(ops)
+        else:
+            ops.append([{',': IN, '.': OUT, '0': CLEAR, ']': JNZ}[char], None, 0, 0])
+    for op in ops:
+        if op[1] is None:  # unmatched brackets jump to the end
+            op[1] = len(ops) if op[0] in (JZ, JNZ) else 0
+    return np.array(ops, dtype=np.int32).reshape(len(ops), 4)
+
+
+def run_lockstep(sources:[str], inputs:[str], max_output_size:int, budget:int=DEFAULT_BUDGET) -> (np.ndarray, np.ndarray):
+    """Run each source on each input, all together.
+
+    Return the matrix of outputs, where run of source i on input j
+    is the row i * len(inputs) + j, and the array of output lengths.
+
+    """
+    nb_runs = len(sources) * len(inputs)
+    outputs = np.zeros((nb_runs, max_output_size), dtype=np.uint8)
+    lengths = np.zeros(nb_runs, dtype=np.int64)
+    programs = [lowered(source) for source in sources]
+    encoded = [input.encode() for input in inputs]
+    for start in range(0, nb_runs, CHUNK_SIZE):
+        runs = range(start, min(start + CHUNK_SIZE, nb_runs))
+        chunk_outputs, chunk_lengths = _run_chunk(
+            [programs[run // len(inputs)] for run in runs],
+            [encoded[run % len(inputs)] for run in runs],
+            max_output_size, budget
+        )
+        outputs[runs.start:runs.stop], lengths[runs.start:runs.stop] = chunk_outputs, chunk_lengths
+    return outputs, lengths
+
+
+def _run_chunk(programs:[np.ndarray], inputs:[bytes], max_output_size:int, budget:int) -> (np.ndarray, np.ndarray):
+    """Run each program on its input, in lockstep"""
+    nb_runs = len(programs)
+    ops = np.zeros((nb_runs, max(map(len, programs)) + 1, 4), dtype=np.int32)
+    ops[:, :, 0] = HALT
+    for run, program in enumerate(programs):
+        ops[run, :len(program)] = program
+    codes, args, los, his = (ops[:, :, field] for field in range(4))
+    stdin = np.zeros((nb_runs, max(map(len, inputs)) + 1), dtype=np.uint8)
+    for run, input in enumerate(inputs):
+        stdin[run, :len(input)] = np.frombuffer(input, dtype=np.uint8)
+    stdin_size = np.array([len(input) for input in inputs], dtype=np.int64)
+
+    memory = np.zeros((nb_runs, MEMORY_SIZE), dtype=np.uint8)
+    outputs = np.zeros((nb_runs, max_output_size), dtype=np.uint8)
+    lengths = np.zeros(nb_runs, dtype=np.int64)
+    p, pc, read = (np.zeros(nb_runs, dtype=np.int64) for _ in range(3))
+    running, snapshot = np.arange(nb_runs), None
+    # all running units executed the same number of instructions
+    for step in range(budget):
+        current = codes[running, pc[running]]
+        alive = (current != HALT) & (lengths[running] < max_output_size - 1)
+        if step >= CYCLE_CHECK and step & (step - 1) == 0:  # Brent's cycle detection
+            snapshot = running, _state(running, memory, p, pc, read, lengths)
+        elif snapshot is not None and step % CYCLE_CHECK == 0:
+            # units in the same state than at snapshot will never halt nor output
+            at_snapshot = np.searchsorted(snapshot[0], running)
+            now, then = _state(running, memory, p, pc, read, lengths), (array[at_snapshot] for array in snapshot[1])
+            alive &= ~np.all([(one == two).reshape(running.size, -1).all(axis=1) for one, two in zip(now, then)], axis=0)
+        if not alive.all():
+            running, current = running[alive], current[alive]
+        if running.size <= TAIL_SIZE:  # masked operations cost more than they share
+            for row in running:
+                p[row], pc[row], read[row], lengths[row] = _run_alone(
+                    ops[row].tolist(), inputs[row], memory[row], outputs[row],
+                    int(p[row]), int(pc[row]), int(read[row]), int(lengths[row]), budget - step
+                )
+            break
+        for code in range(HALT):
+            rows = running[current == code]
+            if not rows.size:
+                continue
+            cells, op = p[rows], pc[rows]
+            if code == MOVE:
+                p[rows] = np.clip(cells + args[rows, op], los[rows, op], his[rows, op])
+            elif code == ADD:
+                memory[rows, cells] += args[rows, op].astype(np.uint8)
+            elif code == IN:
+                available = read[rows] < stdin_size[rows]
+                memory[rows, cells] = np.where(available, stdin[rows, read[rows]], 0)
+                read[rows] += available
+            elif code == OUT:
+                outputs[rows, lengths[rows]] = memory[rows, cells] % 128  # no extended ascii
+                lengths[rows] += 1
+            elif code == CLEAR:
+                memory[rows, cells] = 0
+            elif code == JZ:
+                pc[rows] = np.where(memory[rows, cells] == 0, args[rows, op] - 1, op)
+            elif code == JNZ:
+                pc[rows] = np.where(memory[rows, cells] != 0, args[rows, op] - 1, op)
+        pc[running] += 1
+    return outputs, lengths
+
+
+def _run_alone(program:[list], input:bytes, memory:np.ndarray, output:np.ndarray,
+               p:int, pc:int, read:int, length:int, budget:int) -> (int, int, int, int):
+    """Continue the run of a single unit, updating its memory and output.
+    Return its final (p, pc, read, length).
+
+    """
+    cells, max_length = bytearray(memory.tobytes()), len(output) - 1
+    written = bytearray()
+    for _ in range(budget):
+        code, arg, lo, hi = program[pc]
+        if code == HALT or length + len(written) >= max_length:
+            break
+        if code == MOVE:
+            p = min(max(p + arg, lo), hi)
+        elif code == ADD:
+            cells[p] = (cells[p] + arg) % 256
+        elif code == IN:
+            cells[p] = input[read] if read < len(input) else 0
+            read += read < len(input)
+        elif code == OUT:
+            written.append(cells[p] % 128)
+        elif code == CLEAR:
+            cells[p] = 0
+        elif (code == JZ) == (cells[p] == 0):
+            pc = arg - 1
+        pc += 1
+    memory[:] = np.frombuffer(cells, dtype=np.uint8)
+    output[length:length + len(written)] = np.frombuffer(written, dtype=np.uint8)
+    return p, pc, read, length + len(written)
+
+
+def _state(rows:np.ndarray, *arrays:np.ndarray) -> [np.ndarray]:
+    """Return the values of given rows in each array"""
+    return [array[rows] for array in arrays]
+
+
+def letter_distances(expected:str, outputs:np.ndarray, lengths:np.ndarray) -> np.ndarray:
+    """Return the distance between expected output and each output,
+    as computed by compare_str.c.
+
+    """
+    expected = np.frombuffer(expected.encode(), dtype=np.int8).astype(np.int64)
+    common = min(len(expected), outputs.shape[1])
+    found = outputs[:, :common].astype(np.int64)
+    # C remainder of signed chars keeps the sign of the dividend
+    diffs = np.abs(np.fmod(expected[:common], 128) - found) % 128
+    diffs[np.arange(common) >= lengths[:, None]] = 0
+    return diffs.sum(axis=1) + UINT8_MAX * np.abs(lengths - len(expected))
+
+
+class LockstepInterpreter:
+    """Interpreter usable in place of the one of interpreter.load_interpreter.
+
+    >>> lockstep = LockstepInterpreter()
+    >>> lockstep.inline('++++>,<[->+<]>.', 'a')
+    'e'
+    >>> list(lockstep.batch([',.', ',+.'], ['a', 'b']))
+    [['a', 'b'], ['b', 'c']]
+
+    """
+
+    def __init__(self, budget:int=DEFAULT_BUDGET):
+        self.budget = budget
+        self.inline = lru_cache(maxsize=CACHE_SIZE)(self.interprete)
+        self.inline_scored = lru_cache(maxsize=CACHE_SIZE)(self.interprete_scored)
+        self.last_batch = {}  # (source, input, expected, max_output_size, budget): (distance, output)
+
+    def batch(self, sources:[str], inputs:[str]=('',), *, max_output_size:int=2**16) -> BatchResult:
+        """Run all sources on all inputs, like interpreter.interprete_batch"""
+        sources, inputs = tuple(sources), tuple(inputs)
+        result = BatchResult(len(sources), len(inputs), max_output_size)
+        outputs, lengths = run_lockstep(sources, inputs, max_output_size, self.budget)
+        np.frombuffer(result.outputs, dtype=np.uint8)[:outputs.size] = outputs.ravel()
+        np.frombuffer(result.lengths, dtype=np.uint64)[:] = lengths
+        return result
+
+    def scored_batch(self, sources:[str], input:str, expected:str, *,
+                     max_output_size:int=2**16, budget:int=None) -> [(int, str)]:
+        """Return the distance to expected output and the output
+        of each source run on given input.
+
+        The results are kept in last_batch, where interprete_scored
+        finds them until the next call.
+
+        """
+        sources, budget = tuple(sources), budget or self.budget
+        results = self._scored_runs(sources, input, expected, max_output_size, budget)
+        self.last_batch = {(source, input, expected, max_output_size, budget): result
+                           for source, result in zip(sources, results)}
+        return results
+
+    def _scored_runs(self, sources:(str,), input:str, expected:str, max_output_size:int, budget:int) -> [(int, str)]:
+        outputs, lengths = run_lockstep(sources, (input,), max_output_size, budget)
+        distances = letter_distances(expected, outputs, lengths)
+        return [(int(distance), outputs[run, :length].tobytes().decode(encoding="ISO-8859-1"))
+                for run, (distance, length) in enumerate(zip(distances, lengths))]
+
+    def interprete(self, source:str, input:str="", *, max_output_size:int=2**16, budget:int=None) -> str:
+        if budget is not None and budget != self.budget:
+            return LockstepInterpreter(budget).interprete(source, input, max_output_size=max_output_size)
+        return self.batch((source,), (input,), max_output_size=max_output_size).output(0, 0)
+
+    def interprete_scored(self, source:str, input:str, expected:str, bound:int, *,
+                          max_output_size:int=2**16, budget:int=None) -> (int, str):
+        """Like interpreter.interprete_scored. Runs are never aborted,
+        so the distance is always exact.
+
+        """
+        budget = budget or self.budget
+        batched = self.last_batch.get((source, input, expected, max_output_size, budget))
+        if batched is not None:
+            return batched
+        return self._scored_runs((source,), input, expected, max_output_size, budget)[0]
+
+    def checkpointed_scored(self, source:str, input:str, expected:str, *,
+                            max_output_size:int=2**16, budget:int=None) -> (int, str):
+        """Like interpreter.interprete_checkpointed: runs are independent,
+        so there is no prefix to share.
+
+        """
+        return self.inline_scored(source, input, expected, 0, max_output_size=max_output_size, budget=budget)
@@ -1,63 +1,311 @@
 #include <stdio.h>
 #include <stdint.h>
 #include <stdlib.h>
+#include <string.h>
+#include <fcntl.h>
+#include <unistd.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
 
 #include "bfinterp.h"
 
 
-const uint64_t MAXIMAL_SOURCE_CODE_SIZE = 2048*2048*16;
+const uint64_t DEFAULT_OUTPUT_SIZE = 2048*32;
+const char* TERMINATIONS[] = {"end", "budget", "output_full", "aborted", "cycle"};
+const char* USAGE = "usage: <source> [input]\n"
+                    "       --batch [--nul] [--budget N] [--output-size N] [records]\n"
+                    "In batch mode, records are read from given file, or from stdin:\n"
+                    " JSON lines like {\"source\": \"+[.+]\", \"input\": \"ab\"}, or with --nul,\n"
+                    " sources and inputs terminated by a NUL character.\n"
+                    "A JSON line {\"output\": ..., \"steps\": ..., \"termination\": ...}\n"
+                    " is written for each record, in order.\n";
 
 
-char* readFile(char* fileName) {
-    LOGOK
-    FILE *file = fopen(fileName, "r");
-    char *code;
-    size_t n = 0;
-    int c;
+// Records read from a mapped file, or from a stream.
+typedef struct {
+    char const* data;  // the mapped file, or NULL when reading a stream
+    uint64_t size;
+    uint64_t position;
+    FILE* stream;
+} bf_reader;
+
+
+// Map given file in memory if it is a regular file, else prepare to read it as a stream.
+void open_reader(bf_reader* reader, FILE* file) {
+    struct stat stats;
+    reader->data = NULL;
+    reader->size = reader->position = 0;
+    reader->stream = file;
+    if(fstat(fileno(file), &stats) == 0 && S_ISREG(stats.st_mode) && stats.st_size > 0) {
+        void* data = mmap(NULL, stats.st_size, PROT_READ, MAP_PRIVATE, fileno(file), 0);
+        if(data != MAP_FAILED) {
+            madvise(data, stats.st_size, MADV_SEQUENTIAL);
+            reader->data = (char const*)data;
+            reader->size = stats.st_size;
+        }
+    }
+}
 
-    if (file == NULL)
-        return NULL; // could not open file
 
-    code = malloc(MAXIMAL_SOURCE_CODE_SIZE);
+void close_reader(bf_reader* reader) {
+    if(reader->data != NULL) munmap((void*)reader->data, reader->size);
+}
 
-    while ((c = fgetc(file)) != EOF) {
-        code[n++] = (char) c;
+
+// Set *field to the next field terminated by delimiter (or by the end of input),
+//  and return its length, or -1 at the end of input. Fields of mapped files
+//  point into the map, others are read in *buffer, grown as needed.
+int64_t next_field(bf_reader* reader, const char delimiter, char const** field, char** buffer, size_t* capacity) {
+    if(reader->data == NULL) {
+        ssize_t length = getdelim(buffer, capacity, delimiter, reader->stream);
+        if(length < 0) return -1;
+        if((*buffer)[length - 1] == delimiter) length--;
+        *field = *buffer;
+        return length;
     }
+    if(reader->position >= reader->size) return -1;
+    char const* start = reader->data + reader->position;
+    char const* end = memchr(start, delimiter, reader->size - reader->position);
+    const uint64_t length = end ? (uint64_t)(end - start) : reader->size - reader->position;
+    reader->position += length + 1;
+    *field = start;
+    return length;
+}
 
-    // don't forget to terminate with the null character
-    code[n] = '\0';
 
-    LOGOK
-    return code;
+// Parse the JSON string starting at *text, and write its letters in decoded.
+//  Escapes \u00XX give the letter XX, like latin-1 encoding.
+//  Return its length, or -1 if it isn't a valid string of letters. *text is
+//  set just after the closing quote.
+int64_t json_string(char const** text, char const* end, char* decoded) {
+    char const* p = *text;
+    int64_t length = 0;
+    if(p >= end || *p != '"') return -1;
+    for(p++ ; p < end && *p != '"' ; p++) {
+        if(*p != '\\') {
+            decoded[length++] = *p;
+            continue;
+        }
+        if(++p >= end) return -1;
+        switch(*p) {
+            case 'n': decoded[length++] = '\n'; break;
+            case 't': decoded[length++] = '\t'; break;
+            case 'r': decoded[length++] = '\r'; break;
+            case 'b': decoded[length++] = '\b'; break;
+            case 'f': decoded[length++] = '\f'; break;
+            case '"': case '\\': case '/': decoded[length++] = *p; break;
+            case 'u': {
+                unsigned int code = 0;
+                if(p + 4 >= end) return -1;
+                for(int digit = 1 ; digit <= 4 ; digit++) {
+                    if(!isxdigit((unsigned char)p[digit])) return -1;
+                    code = code * 16 + (isdigit((unsigned char)p[digit]) ? p[digit] - '0' : (tolower(p[digit]) - 'a' + 10));
+                }
+                if(code > 0xff) return -1;
+                decoded[length++] = (char)code;
+                p += 4;
+                break;
+            }
+            default: return -1;
+        }
+    }
+    if(p >= end) return -1;
+    *text = p + 1;
+    return length;
+}
+
+
+char const* skip_spaces(char const* p, char const* end) {
+    while(p < end && isspace((unsigned char)*p)) p++;
+    return p;
+}
+
+
+// Decode the "source" and "input" strings of the JSON object in line, the
+//  other members being ignored. Both are written in decoded, that must hold
+//  the length of line. Return 0 if the line isn't such an object.
+int json_record(char const* line, const uint64_t size, char* decoded,
+                char** source, uint64_t* source_size, char** input, uint64_t* input_size) {
+    char const* end = line + size;
+    char const* p = skip_spaces(line, end);
+    int64_t key_size, value_size;
+    *source = *input = decoded;
+    *source_size = *input_size = 0;
+    if(p >= end || *p != '{') return 0;
+    p = skip_spaces(p + 1, end);
+    while(p < end && *p != '}') {
+        char* key = decoded;
+        if((key_size = json_string(&p, end, key)) < 0) return 0;
+        p = skip_spaces(p, end);
+        if(p >= end || *p != ':') return 0;
+        p = skip_spaces(p + 1, end);
+        char* value = key + key_size;
+        if((value_size = json_string(&p, end, value)) < 0) return 0;
+        if(key_size == 6 && memcmp(key, "source", 6) == 0) {
+            *source = memmove(key, value, value_size);
+            *source_size = value_size;
+            decoded = key + value_size;
+        } else if(key_size == 5 && memcmp(key, "input", 5) == 0) {
+            *input = memmove(key, value, value_size);
+            *input_size = value_size;
+            decoded = key + value_size;
+        }
+        p = skip_spaces(p, end);
+        if(p < end && *p == ',') p = skip_spaces(p + 1, end);
+    }
+    return p < end;
+}
+
+
+void write_json_string(char const* text, const uint64_t size, FILE* file) {
+    fputc('"', file);
+    for(uint64_t i = 0 ; i < size ; i++) {
+        const unsigned char letter = text[i];
+        if(letter == '"' || letter == '\\') {
+            fputc('\\', file);
+            fputc(letter, file);
+        } else if(letter < 0x20 || letter >= 0x7f) {
+            fprintf(file, "\\u%04x", letter);
+        } else {
+            fputc(letter, file);
+        }
+    }
+    fputc('"', file);
+}
+
+
+void write_result(bf_context const* context, FILE* file) {
+    bf_result const* result = context_result(context);
+    fputs("{\"output\": ", file);
+    write_json_string(context_output(context), result->output_length, file);
+    fprintf(file, ", \"steps\": %" PRIu64 ", \"termination\": \"%s\"}\n",
+            result->steps, TERMINATIONS[result->termination]);
+}
+
+
+// Run each record read from file with the same context, and write a result for each.
+//  Results of records read from a stream are flushed at once, so that the
+//  binary can be driven through pipes.
+int run_batch(FILE* file, const int nul_delimited, const uint64_t budget, const uint64_t output_size) {
+    bf_context* context = new_context(output_size);
+    configure_context(context, budget, 1);
+    bf_reader reader;
+    open_reader(&reader, file);
+    char *buffer = NULL, *input_buffer = NULL, *decoded = NULL;
+    size_t capacity = 0, input_capacity = 0, decoded_capacity = 0;
+    char const *line, *source, *input;
+    int64_t size;
+    uint64_t source_size, input_size, record = 0;
+    int status = 0;
+    while((size = next_field(&reader, nul_delimited ? '\0' : '\n', &line, &buffer, &capacity)) >= 0) {
+        record++;
+        if(nul_delimited) {
+            source = line;
+            source_size = size;
+            int64_t length = next_field(&reader, '\0', &input, &input_buffer, &input_capacity);
+            input_size = length < 0 ? 0 : length;
+        } else {
+            if(skip_spaces(line, line + size) == line + size) continue;  // blank line
+            if((size_t)size > decoded_capacity) {
+                decoded_capacity = size;
+                decoded = realloc(decoded, decoded_capacity);
+                if(decoded == NULL) {
+                    fprintf(stderr, "Malloc of record failed.\n");
+                    exit(1);
+                }
+            }
+            char *decoded_source, *decoded_input;
+            if(!json_record(line, size, decoded, &decoded_source, &source_size, &decoded_input, &input_size)) {
+                fprintf(stderr, "Record %" PRIu64 " is not a JSON object of strings.\n", record);
+                fputs("{\"error\": \"invalid record\"}\n", stdout);
+                status = 1;
+                continue;
+            }
+            source = decoded_source;
+            input = decoded_input;
+        }
+        context_interpret(context, source, source_size, input, input_size);
+        write_result(context, stdout);
+        if(reader.data == NULL) fflush(stdout);
+    }
+    close_reader(&reader);
+    free(buffer);
+    free(input_buffer);
+    free(decoded);
+    free_context(context);
+    return status;
+}
+
+
+// Return the content of given file, mapped in memory, and set *size to its size.
+char const* map_file(char const* filename, uint64_t* size) {
+    int descriptor = open(filename, O_RDONLY);
+    struct stat stats;
+    if(descriptor < 0) return NULL;  // could not open file
+    if(fstat(descriptor, &stats) != 0) {
+        close(descriptor);
+        return NULL;
+    }
+    *size = stats.st_size;
+    if(*size == 0) {
+        close(descriptor);
+        return "";
+    }
+    void* data = mmap(NULL, *size, PROT_READ, MAP_PRIVATE, descriptor, 0);
+    close(descriptor);
+    return data == MAP_FAILED ? NULL : (char const*)data;
 }
 
 
 int main(int argc, char *argv[]) {
     LOGOK
-    if(argc < 2) {
-        printf("usage: <source> [input].\n");
-        exit(1);
+    int batch = 0, nul_delimited = 0;
+    uint64_t budget = 0, output_size = DEFAULT_OUTPUT_SIZE;
+    char* positionals[2] = {NULL, NULL};
+    int nb_positionals = 0;
+    for(int i = 1 ; i < argc ; i++) {
+        if(strcmp(argv[i], "--batch") == 0) batch = 1;
+        else if(strcmp(argv[i], "--nul") == 0) nul_delimited = 1;
+        else if(strcmp(argv[i], "--budget") == 0 && i + 1 < argc) budget = strtoull(argv[++i], NULL, 10);
+        else if(strcmp(argv[i], "--output-size") == 0 && i + 1 < argc) output_size = strtoull(argv[++i], NULL, 10);
+        else if(nb_positionals < 2 && (argv[i][0] != '-' || argv[i][1] == '\0')) positionals[nb_positionals++] = argv[i];
+        else {
+            fputs(USAGE, stderr);
+            exit(1);
+        }
     }
-    LOGOK
-    char* source_code = readFile(argv[1]);
-    if(source_code == NULL) {
-        printf("Given filename can't be read.\n");
+    if(output_size < 1) {  // the output needs room for its null terminator
+        fputs(USAGE, stderr);
         exit(1);
     }
     LOGOK
-    char* output = malloc(MAXIMAL_SOURCE_CODE_SIZE);
-    for(uint64_t i = 0; i < MAXIMAL_SOURCE_CODE_SIZE; i++) output[i] = '\0';
-    if(output == NULL) {
-        printf("Output can't be malloc'd.\n");
+    if(batch) {
+        FILE* file = stdin;
+        if(positionals[0] != NULL && strcmp(positionals[0], "-") != 0) file = fopen(positionals[0], "r");
+        if(file == NULL) {
+            printf("Given filename can't be read.\n");
+            exit(1);
+        }
+        return run_batch(file, nul_delimited, budget, output_size);
+    }
+    if(positionals[0] == NULL) {
+        printf("%s", USAGE);
         exit(1);
     }
-    char* input = "";
-    if(argc > 2) {
-        input = argv[2];
+    uint64_t source_size;
+    char const* source_code = map_file(positionals[0], &source_size);
+    if(source_code == NULL) {
+        printf("Given filename can't be read.\n");
+        exit(1);
     }
     LOGOK
-    interpret_bf(source_code, input, output, MAXIMAL_SOURCE_CODE_SIZE);
+    char const* input = positionals[1] ? positionals[1] : "";
+    bf_context* context = new_context(output_size);
+    configure_context(context, budget, 1);
+    const uint64_t output_length = context_interpret(context, source_code, source_size, input, strlen(input));
     LOGOK
-    printf("%s\n", output);
+    fwrite(context_output(context), 1, output_length, stdout);
+    putchar('\n');
+    free_context(context);
     return 0;
 }
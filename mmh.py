@@ -6,6 +6,19 @@
 
 import itertools
 from config import Configuration
+from evaluation import EvaluationService
+
+
+def genalg_functions(config:Configuration) -> dict:
+    """Return the functions of given specialized config, as expected by its step function"""
+    return {
+        'score': config.score,
+        'select': config.select,
+        'mutate': config.mutate,
+        'reproduce': config.reproduce,
+        'cross': config.cross,
+        # 'create': config.create,
+    }
 
 
 class MMH:
@@ -17,7 +30,8 @@ class MMH:
     """
 
     def __init__(self, case:'Case', pop_size:int, config:Configuration,
-                 pop_number:int=1, data_handler:callable=None):
+                 pop_number:int=1, data_handler:callable=None, processes:int=None,
+                 evaluator:EvaluationService=None):
         """
 
         case -- a test case to validate
@@ -25,6 +39,11 @@ class MMH:
         config -- the Configuration instance describing the metaheuristic
         pop_number -- number of populations to spawn at start
         data_handler -- a callback called at each step with multiple parameters
+        processes -- number of worker processes scoring the units,
+            or None for the number of CPUs
+        evaluator -- the service scoring the units, like a farm.WorkerFarm,
+            instead of an EvaluationService of given number of processes.
+            It is not closed by close.
 
         data_handler should expects:
         - current step number
@@ -41,11 +60,21 @@ class MMH:
         self.config_template = config
         self._init_config()
         self.populations = [tuple(self.config.create(self.pop_size)) for _ in range(pop_number)]
+        self.survivals = (None,) * pop_number  # see stepping.StepResult
         self.current_step = 1
         self.change_config_at = lambda sn: sn % 5 == 0
         self.prompt_at = lambda sn: sn % 5 == 0
         self.data_handler = data_handler
         self.found_solutions = set()  # set of sources that succeed
+        # workers are kept for all steps, populations and cases
+        self._own_evaluator = evaluator is None
+        self.evaluator = EvaluationService(processes) if evaluator is None else evaluator
+
+
+    def close(self):
+        """Stop the workers scoring the units, if they were started by this instance"""
+        if self._own_evaluator:
+            self.evaluator.close()
 
 
     def _init_config(self):
@@ -55,14 +84,7 @@ class MMH:
 
 
     def get_specific_genalg_functions(self) -> dict:
-        return {
-            'score': self.config.score,
-            'select': self.config.select,
-            'mutate': self.config.mutate,
-            'reproduce': self.config.reproduce,
-            'cross': self.config.cross,
-            # 'create': self.config.create,
-        }
+        return genalg_functions(self.config)
 
 
     def run(self, step:int=0):
@@ -100,33 +122,44 @@ class MMH:
         self.changed_config = self.change_config_at(self.current_step)
         if self.changed_config:
             self._init_config()
+            # survivals were computed with other functions, maybe on another scale of scores
+            self.survivals = (None,) * len(self.populations)
 
         if self.prompt_at(self.current_step):
             input('?')
 
-        new_pops = []
-        for pop in self.populations:
+        new_pops, survivals = [], []
+        for pop, survival in zip(self.populations, self.survivals):
             len_pop = len(pop)
-            new_pop, scored_old_pop, winners = self.algogen_call(pop)
+            new_pop, scored_old_pop, winners, survival = self.algogen_call(pop, survival)
             assert len(pop) == len(new_pop)
-            assert new_pop != pop
+            # new_pop may be pop, when no child of a steady-state step scored better
             new_pops.append(new_pop)
+            survivals.append(survival)
             self.found_solutions |= {winner.source for winner in winners}
         self.populations = tuple(new_pops)
+        self.survivals = tuple(survivals)
 
         self.current_step += 1
 
         return self.populations
 
 
-    def algogen_call(self, pop) -> tuple:
-        """Call algogen step function, return the StepResult instance"""
+    def algogen_call(self, pop, survival:int=None) -> tuple:
+        """Call algogen step function, return the StepResult instance.
+
+        survival is the one of the previous step of the population, if any,
+        that step functions get as min_score.
+
+        """
         self.current_config = self.get_specific_genalg_functions()
         return self.config.step(
             pop, self.case, self.pop_size,
             **self.current_config,
             step_number=self.current_step,
             callback_stats=self.callback_stat_adaptator,
+            evaluator=self.evaluator,
+            **({} if survival is None else {'min_score': survival}),
         )
 
     def callback_stat_adaptator(self, **data):
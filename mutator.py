@@ -45,6 +45,20 @@ def _apply_mutations_randomly(mutators, unit):
             random.choice(mutators)(unit)  # one more time !
 
 
+class _RandomMutations:
+    """Mutation function applying randomly given mutators, named after the
+    function returning it. Unlike a closure, it can be sent to other processes.
+
+    """
+
+    def __init__(self, mutators:tuple, named_after:callable):
+        self.mutators = tuple(mutators)
+        functools.update_wrapper(self, named_after)
+
+    def __call__(self, unit):
+        _apply_mutations_randomly(self.mutators, unit)
+
+
 def no_mutators() -> callable:
     """Return a function that never mutate input unit."""
     @functools.wraps(no_mutators)
@@ -57,11 +71,7 @@ def all_mutators() -> callable:
     mutation method.
 
     """
-    methods = MUT_FUNC_FUNCTIONAL + MUT_FUNC_STRING
-    @functools.wraps(all_mutators)
-    def all_mutators_wrapped(unit):
-        _apply_mutations_randomly(methods, unit)
-    return all_mutators_wrapped
+    return _RandomMutations(MUT_FUNC_FUNCTIONAL + MUT_FUNC_STRING, all_mutators)
 
 
 def function_mutators() -> callable:
@@ -69,10 +79,7 @@ def function_mutators() -> callable:
     mutation method oriented toward modification of functional parts.
 
     """
-    @functools.wraps(function_mutators)
-    def function_mutators_wrapped(unit):
-        _apply_mutations_randomly(MUT_FUNC_FUNCTIONAL, unit)
-    return function_mutators_wrapped
+    return _RandomMutations(MUT_FUNC_FUNCTIONAL, function_mutators)
 
 
 def string_mutators() -> tuple:
@@ -83,7 +90,4 @@ def string_mutators() -> tuple:
     the consequences of the change.
 
     """
-    @functools.wraps(string_mutators)
-    def string_mutators_wrapped(unit):
-        _apply_mutations_randomly(MUT_FUNC_STRING, unit)
-    return string_mutators_wrapped
+    return _RandomMutations(MUT_FUNC_STRING, string_mutators)
@@ -9,7 +9,7 @@ import itertools
 import utils
 import mutator
 from unit import Unit
-from utils import named_functions_interface_decorator, choices
+from utils import named_functions_interface_decorator
 
 
 DEFAULT_PARTHENOGENESIS = 0.01
@@ -52,15 +52,13 @@ def pairing_with_replacement(scored_parents:iter, n:int, crossing_func:callable,
         print(f"same_with_childs: population of {len(new)} parents can't reproduce, "
               f"because final population already have {n} individuals")
     assert len(new) <= n
-    while len(new) < n:
-        # pick two parents
-        if parent_score_weight:
-            weights = [v.score if v.score > 0 else 1 for v in scored_parents.values()]  # replace null and negative score by the minimal acceptable weight of 1
-            parents = choices(scored_parents.keys(), weights=weights, k=2, replacement=False)
-        else:
-            parents = choices(scored_parents.keys(), k=2, replacement=False)
+    parents_pool, weights = list(scored_parents), None
+    if parent_score_weight:
+        weights = [v.score if v.score > 0 else 1 for v in scored_parents.values()]  # replace null and negative score by the minimal acceptable weight of 1
+    # pick two parents for each child
+    for first, second in utils.distinct_pairs(len(parents_pool), max(0, n - len(new)), weights).tolist():
+        parents = parents_pool[first], parents_pool[second]
         new.append(Unit.mutated(Unit.child_from_crossed(parents, crossing_func), mutator))
-        if len(new) >= n: break
     yield from new
 
 
@@ -0,0 +1,210 @@
+"""Cache of interpreter runs shared by all processes, and kept between sessions.
+
+Runs are stored in a file mapped in memory by each process, holding a
+hash table of fixed size: a key, hashing the source, the input, the
+budget and the output size, is stored in one of the PROBES slots
+following its hash (the file ends with PROBES - 1 more slots, so that
+they never wrap). When they are all used, one of them is evicted with
+the CLOCK algorithm: slots read since the last eviction get a second
+chance.
+
+Only complete runs are stored: scored runs aborted because their
+distance to the expected output exceeded the bound have a partial output.
+The distance to the expected output is computed from the cached output,
+so that the same run serves all expected outputs.
+
+All accesses are serialized by a lock on the file, which also keeps
+the number of hits and misses of all processes, and by a lock shared by
+the threads of the process, that the lock on the file doesn't exclude.
+
+"""
+
+import os
+import mmap
+import fcntl
+import struct
+import hashlib
+import threading
+from contextlib import contextmanager
+from collections import namedtuple
+
+from interpreter import BatchResult
+
+
+RUN_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.runcache')
+RUN_CACHE_VERSION = 1  # to increase when the file layout changes, invalidating the cache
+RUN_CACHE_SLOTS = 2**16  # the file is about RUN_CACHE_SLOTS * SLOT_SIZE bytes large
+PROBES = 8  # number of slots where a key can be stored
+MAGIC = b'BFRUNS'
+HEADER = struct.Struct('<6sHQQQ')  # magic, version, number of slots, hits, misses
+HEADER_SIZE = 64
+SLOT = struct.Struct('<16sBxH')  # key, referenced since last eviction, output length
+SLOT_SIZE = 256
+MAX_OUTPUT_LENGTH = SLOT_SIZE - SLOT.size  # longer outputs are not cached
+EMPTY_KEY = bytes(16)
+
+CacheStats = namedtuple('CacheStats', 'hits misses entries slots')
+
+
+def run_key(source:str, input:str, max_output_size:int, budget:int or None) -> bytes:
+    """Return the key identifying the run of given source on given input"""
+    text = f'{len(source)}:{source}{len(input)}:{input}{max_output_size}:{budget}'
+    return hashlib.blake2b(text.encode(), digest_size=16).digest()
+
+
+class SharedRunCache:
+    """Interpreter answering from the shared cache of runs at path, and
+    running the misses with given interpreter. It is usable in place of
+    the one of interpreter.load_interpreter by the scoring functions.
+
+    The file is created, or reset if its layout doesn't match, with given
+    number of slots. It must be opened by each process: the lock
+    on a file inherited by a fork would be shared with the parent.
+
+    >>> import tempfile, interpreter
+    >>> cache = SharedRunCache(interpreter.load_interpreter(), tempfile.mktemp(), slots=64)
+    >>> cache.inline('++++>,<[->+<]>.', 'a'), cache.inline('++++>,<[->+<]>.', 'a')
+    ('e', 'e')
+    >>> cache.stats()
+    CacheStats(hits=1, misses=1, entries=1, slots=64)
+
+    """
+
+    def __init__(self, interpreter, path:str=RUN_CACHE_PATH, *, slots:int=RUN_CACHE_SLOTS):
+        self._interpreter = interpreter
+        self.path = path
+        self.slots = int(slots)
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        size = HEADER_SIZE + (self.slots + PROBES - 1) * SLOT_SIZE
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            header = os.pread(self._fd, HEADER.size, 0)
+            if len(header) < HEADER.size or HEADER.unpack(header)[:3] != (MAGIC, RUN_CACHE_VERSION, self.slots) \
+                    or os.fstat(self._fd).st_size != size:
+                os.ftruncate(self._fd, 0)  # reset the slots to empty ones
+                os.ftruncate(self._fd, size)
+                os.pwrite(self._fd, HEADER.pack(MAGIC, RUN_CACHE_VERSION, self.slots, 0, 0), 0)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._map = mmap.mmap(self._fd, size)
+        self._lock = threading.Lock()
+        self.inline = self.interprete
+        self.inline_scored = self.interprete_scored
+
+    def close(self):
+        self._map.close()
+        os.close(self._fd)
+
+    @contextmanager
+    def _locked(self):
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _count(self, hits:int, misses:int):
+        _, _, _, old_hits, old_misses = HEADER.unpack_from(self._map, 0)
+        HEADER.pack_into(self._map, 0, MAGIC, RUN_CACHE_VERSION, self.slots, old_hits + hits, old_misses + misses)
+
+    def _offsets(self, key:bytes) -> range:
+        """Return the offsets of the slots where given key can be stored"""
+        first = HEADER_SIZE + int.from_bytes(key[:8], 'little') % self.slots * SLOT_SIZE
+        return range(first, first + PROBES * SLOT_SIZE, SLOT_SIZE)
+
+    def get(self, key:bytes) -> bytes or None:
+        """Return the output of the run of given key, or None if not cached"""
+        with self._locked():
+            for offset in self._offsets(key):
+                if self._map[offset:offset + len(key)] == key:
+                    _, _, length = SLOT.unpack_from(self._map, offset)
+                    self._map[offset + len(key)] = 1  # referenced
+                    self._count(1, 0)
+                    return self._map[offset + SLOT.size:offset + SLOT.size + length]
+            self._count(0, 1)
+            return None
+
+    def put(self, key:bytes, output:bytes):
+        """Store the output of the run of given key, if it fits in a slot"""
+        if len(output) > MAX_OUTPUT_LENGTH:
+            return
+        with self._locked():
+            offsets = self._offsets(key)
+            keys = [self._map[offset:offset + len(key)] for offset in offsets]
+            if key in keys:
+                chosen = offsets[keys.index(key)]
+            elif EMPTY_KEY in keys:
+                chosen = offsets[keys.index(EMPTY_KEY)]
+            else:  # CLOCK: the first slot not referenced since last pass, clearing the references
+                for chosen in (*offsets, offsets[0]):
+                    if not self._map[chosen + len(key)]:
+                        break
+                    self._map[chosen + len(key)] = 0
+            self._map[chosen + SLOT.size:chosen + SLOT.size + len(output)] = output
+            SLOT.pack_into(self._map, chosen, key, 0, len(output))
+
+    def stats(self) -> CacheStats:
+        """Return the number of hits and misses of all processes, and of used slots"""
+        _, _, _, hits, misses = HEADER.unpack_from(self._map, 0)
+        entries = sum(self._map[offset:offset + len(EMPTY_KEY)] != EMPTY_KEY
+                      for offset in range(HEADER_SIZE, len(self._map), SLOT_SIZE))
+        return CacheStats(hits, misses, entries, self.slots)
+
+    def interprete(self, source:str, input:str="", *, max_output_size:int=2**16, budget:int=None) -> str:
+        key = run_key(source, input, max_output_size, budget)
+        output = self.get(key)
+        if output is None:
+            output = self._interpreter.inline(source, input, max_output_size=max_output_size, budget=budget)
+            output = output.encode(encoding="ISO-8859-1")
+            self.put(key, output)
+        return output.decode(encoding="ISO-8859-1")
+
+    def interprete_scored(self, source:str, input:str, expected:str, bound:int, *,
+                          max_output_size:int=2**16, budget:int=None) -> (int, str):
+        """Like interpreter.interprete_scored. Cached runs are complete,
+        so that their distance is exact, whatever the bound.
+
+        """
+        from scoring import compare_str  # scoring uses this module
+        key = run_key(source, input, max_output_size, budget)
+        output = self.get(key)
+        if output is not None:
+            found = output.decode(encoding="ISO-8859-1")
+            return compare_str(expected, found), found
+        distance, found = self._interpreter.inline_scored(source, input, expected, bound,
+                                                          max_output_size=max_output_size, budget=budget)
+        if distance <= bound:  # else the run was aborted, and found is partial
+            self.put(key, found.encode(encoding="ISO-8859-1"))
+        return distance, found
+
+    def checkpointed_scored(self, source:str, input:str, expected:str, *,
+                            max_output_size:int=2**16, budget:int=None) -> (int, str):
+        return self.inline_scored(source, input, expected, 2**64-1, max_output_size=max_output_size, budget=budget)
+
+    def batch(self, sources:[str], inputs:[str]=('',), *, max_output_size:int=2**16) -> BatchResult:
+        """Like interpreter.interprete_batch"""
+        sources, inputs = tuple(sources), tuple(inputs)
+        result = BatchResult(len(sources), len(inputs), max_output_size)
+        for source_idx, source in enumerate(sources):
+            for input_idx, input in enumerate(inputs):
+                idx = source_idx * len(inputs) + input_idx
+                output = self.interprete(source, input, max_output_size=max_output_size).encode(encoding="ISO-8859-1")
+                result.outputs[idx * max_output_size:idx * max_output_size + len(output)] = output
+                result.lengths[idx] = len(output)
+        return result
+
+
+_OPENED = {}  # (pid, id of interpreter, path) -> SharedRunCache
+
+
+def shared_cache(interpreter, path:str=None) -> SharedRunCache:
+    """Return the SharedRunCache of given interpreter opened by the current
+    process, at given path or RUN_CACHE_PATH.
+
+    """
+    path = path or RUN_CACHE_PATH
+    key = os.getpid(), id(interpreter), path
+    if key not in _OPENED:
+        _OPENED[key] = SharedRunCache(interpreter, path)
+    return _OPENED[key]
@@ -8,6 +8,8 @@ import itertools
 from functools import partial
 from collections import namedtuple
 
+import canonical
+import runcache
 import interpreter
 from utils import named_functions_interface_decorator
 
@@ -17,15 +19,30 @@ MAX_OUT_SIZE = 2048  # maximal size of program output
 
 # Access the string comparison function implemented in C
 COMPARE_STR_C_LIB = './compare_str.so'
-c_func_compare_str = ctypes.cdll.LoadLibrary(COMPARE_STR_C_LIB).distance
-c_func_compare_str.restype = ctypes.c_uint64  # specify output type
-
-RunResult = namedtuple('RunResult', 'score expected found')
+try:
+    c_func_compare_str = ctypes.cdll.LoadLibrary(COMPARE_STR_C_LIB).distance
+    c_func_compare_str.restype = ctypes.c_uint64  # specify output type
+except OSError:  # not built: compare_str_py is used instead
+    c_func_compare_str = None
+
+# trace is the interpreter.RunTrace of the run when TRACE_RUNS is set, else an
+#  empty tuple, that keeps the results comparable (see selection).
+RunResult = namedtuple('RunResult', 'score expected found trace', defaults=((),))
 SCORE_BASE = 10_000
 SCORE_MINIMAL = 0  # any score below this threshold will be set to this threshold
 
 UINT8_MAX = 255  # comes from C stdint.h
 
+# if True, runs of units sharing a prefix with already run ones
+#  start from the end of that prefix. See interpreter.PrefixCheckpoints.
+USE_PREFIX_CHECKPOINTS = False
+# if True, the statistics of each run are collected and given in the
+#  trace field of RunResult. Runs are slower, and can't share a cache.
+TRACE_RUNS = False
+# if True, runs are looked up in the cache shared by all processes and
+#  sessions, see runcache.SharedRunCache.
+USE_SHARED_CACHE = False
+
 
 @named_functions_interface_decorator
 def named_functions() -> dict:
@@ -50,49 +67,113 @@ def anonymous_functions() -> tuple:
     return ()
 
 
-def io_comparison_with_bonus(unit, test, interpreter=INTERPRETER, bonus=SCORE_BASE) -> float:
+def io_comparison_with_bonus(unit, test, interpreter=INTERPRETER, bonus=SCORE_BASE,
+                             min_score:int=SCORE_MINIMAL, budget:int=None, prescreened:bool=False) -> float:
     """Like io_comparison, but giving a bonus of score if found the
     expected result, so that finding the correct results ensure a large.
 
     """
-    score, expected, found = io_comparison(unit, test, interpreter)
+    score, expected, found, trace = io_comparison(unit, test, interpreter, min_score=min_score, budget=budget,
+                                                  prescreened=prescreened)
     if bonus and found == expected:
         score += bonus  # scores of successful units belong to another scoring level.
-    return RunResult(max(SCORE_MINIMAL, int(score)), expected, found)
+    return RunResult(max(SCORE_MINIMAL, int(score)), expected, found, trace)
 
 
-def io_comparison_with_size_malus(unit, test, interpreter=INTERPRETER, malus=1) -> float:
+def io_comparison_with_size_malus(unit, test, interpreter=INTERPRETER, malus=1,
+                                  min_score:int=SCORE_MINIMAL, budget:int=None, prescreened:bool=False) -> float:
     """Like io_comparison, but giving a malus of malus*source code size.
 
     """
-    score, expected, found = io_comparison(unit, test, interpreter)
+    score, expected, found, trace = io_comparison(unit, test, interpreter, min_score=min_score + len(unit.source) * malus,
+                                                  budget=budget, prescreened=prescreened)
     score -= len(unit.source) * malus
-    return RunResult(max(SCORE_MINIMAL, int(score)), expected, found)
+    return RunResult(max(SCORE_MINIMAL, int(score)), expected, found, trace)
 
 
-def io_comparison(unit, test, interpreter=INTERPRETER) -> float:
-    stdin, expected = test
-    # compute and return score
-    found = interpreter.inline(unit.source, stdin, max_output_size=MAX_OUT_SIZE)
-    # print('UOGHDP:', interpreter.inline.cache_info())
-    assert len(expected) < MAX_OUT_SIZE
-    score = SCORE_BASE - compare_str(expected, found)
-    return RunResult(max(SCORE_MINIMAL, int(score)), expected, found)
+def prescreen(unit, test, min_score:int=SCORE_MINIMAL) -> RunResult or None:
+    """Return the result of io_comparison for given unit and test if it can
+    be deduced from the source alone, or None if the unit must be run.
+
+    A unit without output instruction has an empty output. A unit whose
+    output is too short to reach min_score whatever its letters get
+    the best score it could reach, and an empty found output.
 
+    """
+    stdin, expected = test
+    max_output_length, _ = interpreter.static_analysis(unit.source)
+    if max_output_length == 0:
+        score = SCORE_BASE - UINT8_MAX * len(expected)
+        return RunResult(max(SCORE_MINIMAL, int(score)), expected, '')
+    if max_output_length is not None and max_output_length < len(expected):
+        score = SCORE_BASE - UINT8_MAX * (len(expected) - max_output_length)
+        if score <= min_score:
+            return RunResult(max(SCORE_MINIMAL, int(score)), expected, '')
+    return None
+
+
+def io_comparison(unit, test, interpreter=INTERPRETER, min_score:int=SCORE_MINIMAL,
+                  budget:int=None, prescreened:bool=False) -> float:
+    """Score is SCORE_BASE minus the distance between found and expected outputs.
+
+    min_score -- units that can't reach this score are stopped as soon as
+        their output diverges too much from the expected one. Their score
+        is then only an upper bound, and their found output is partial.
+        Since scores are floored to SCORE_MINIMAL, the default value
+        gives exact scores.
+    budget -- maximal number of instructions executed by the unit,
+        or None for the interpreter default. See Case.budget.
+    prescreened -- True when the caller already knows that prescreen can't
+        score the unit, so that it is run at once. Units that can't reach
+        min_score then get the found output of their run instead of ''.
 
-def io_comparison_with_bonus_and_size_malus(unit, test, interpreter=INTERPRETER, bonus=SCORE_BASE, malus=1) -> float:
+    """
+    stdin, expected = test
+    assert len(expected) < MAX_OUT_SIZE
+    screened = None if prescreened else prescreen(unit, test, min_score)
+    if screened is not None:
+        return screened
+    # compute and return score, stopping the run when the score is already too low
+    bound = max(0, SCORE_BASE - min_score)
+    source, trace = unit.source, ()
+    if TRACE_RUNS:  # the unit itself is run, so that the trace refers to its source
+        distance, found, trace = interpreter.traced(unit.source, stdin, expected, bound,
+                                                    max_output_size=MAX_OUT_SIZE, budget=budget)
+    elif USE_SHARED_CACHE:
+        # units with the same canonical form share the same cached run. Elsewhere, computing
+        #  that form costs more than most runs, that the interpreter caches only briefly.
+        source = canonical.canonical_source(source)
+        distance, found = runcache.shared_cache(interpreter).inline_scored(source, stdin, expected, bound,
+                                                                           max_output_size=MAX_OUT_SIZE, budget=budget)
+    elif USE_PREFIX_CHECKPOINTS:
+        distance, found = interpreter.checkpointed_scored(source, stdin, expected,
+                                                          max_output_size=MAX_OUT_SIZE, budget=budget)
+    else:
+        distance, found = interpreter.inline_scored(source, stdin, expected, bound,
+                                                    max_output_size=MAX_OUT_SIZE, budget=budget)
+    # print('UOGHDP:', interpreter.inline_scored.cache_info())
+    score = SCORE_BASE - distance
+    return RunResult(max(SCORE_MINIMAL, int(score)), expected, found, trace)
+
+
+def io_comparison_with_bonus_and_size_malus(unit, test, interpreter=INTERPRETER, bonus=SCORE_BASE, malus=1,
+                                            min_score:int=SCORE_MINIMAL, budget:int=None,
+                                            prescreened:bool=False) -> float:
     """Like io_comparison, but giving a malus of malus*source code size, and a bonus for exact answers.
 
     """
-    score, expected, found = io_comparison(unit, test, interpreter)
+    score, expected, found, trace = io_comparison(unit, test, interpreter, min_score=min_score + len(unit.source) * malus,
+                                                  budget=budget, prescreened=prescreened)
     if bonus and found == expected:
         score += bonus  # scores of successful units belong to another scoring level.
     score -= len(unit.source) * malus
-    return RunResult(max(SCORE_MINIMAL, int(score)), expected, found)
+    return RunResult(max(SCORE_MINIMAL, int(score)), expected, found, trace)
 
 
 def compare_str_c(one, two) -> int:
     """Wrapper around C function implementing string comparison"""
+    if c_func_compare_str is None:
+        raise RuntimeError(f"{COMPARE_STR_C_LIB} is not built (see make compile): use compare_str instead")
     one, two = one.encode(), two.encode()
     return c_func_compare_str(one, two, len(one), len(two), UINT8_MAX, 1, 0)
 
@@ -104,5 +185,4 @@ def compare_str_py(one, two, length_penalty:int=UINT8_MAX) -> int:
 
 
 # choose the implementation exposed to the outside
-compare_str = compare_str_c
-# compare_str = compare_str_py
+compare_str = compare_str_c if c_func_compare_str else compare_str_py
@@ -5,12 +5,26 @@ Steps:
     - select parents
     - build next generation
 
+Steady-state steps don't wait for a whole generation: children are scored
+as they are produced, and inserted in the population as their results arrive.
+
 """
 
+import heapq
+import queue
+import random
+import inspect
 import itertools
+from functools import partial, lru_cache
+from contextlib import contextmanager
 from multiprocessing import Pool
+from concurrent.futures import ThreadPoolExecutor
 from collections import Counter, namedtuple
 
+import scoring
+import selection
+import evaluation
+import reproduction
 from case import Case
 from unit import Unit
 from utils import named_functions_interface_decorator
@@ -18,10 +32,21 @@ from utils import named_functions_interface_decorator
 
 MULTIPROC_PROCESSES = 16
 MULTIPROC_TASK_PER_CHILD = 32
+# backends of _multisolve_scoring: 'process' sends units to a pool of
+#  processes, 'thread' scores them in a pool of MULTIPROC_PROCESSES threads,
+#  'serial' scores them in the current thread
+BACKENDS = ('process', 'thread', 'serial')
+THREAD_CHUNKS = 4  # number of chunks of units given to each thread
+# steady-state steps
+INSERTIONS = ('worst', 'tournament')  # how a child replaces a member of the population
+TOURNAMENT_SIZE = 4  # number of members among which the worst is replaced by tournament insertion
+IN_FLIGHT_PER_WORKER = 2  # number of children being scored by each worker
 # printing
 MAX_PRINTED_PROPS = 10
 
-StepResult = namedtuple('StepResult', 'pop, scored_old_pop, winners')
+# survival is the lowest score of the units selected by the step, when units of
+#  the next generation that can't reach it can't be selected either (see _truncates)
+StepResult = namedtuple('StepResult', 'pop, scored_old_pop, winners, survival', defaults=(None,))
 
 
 @named_functions_interface_decorator
@@ -29,17 +54,23 @@ def named_functions() -> dict:
     """Return GA functions"""
     return {
         'DIV': step,
+        'DIVT': partial(step, backend='thread'),
+        'DIVC': partial(step, create_in_workers=True),
+        'SSW': partial(steady_state, insertion='worst'),
+        'SST': partial(steady_state, insertion='tournament'),
         # 'SCR': step_cross_first,  # TODO: DOESN'T WORK PROPERLY (LOGIC PROBLEM)
     }
 
 def default_functions() -> tuple:
     """Return default GA functions"""
-    return named_functions.as_tuple()
+    return (named_functions('DIV'),)
 
 
 def step(pop, case, pop_size:int, score:callable,
          select:callable, reproduce:callable, cross: callable, mutate:callable,
-         step_number:int=None, callback_stats:callable=(lambda **kwargs: None)) -> 'pop':
+         step_number:int=None, callback_stats:callable=(lambda **kwargs: None),
+         backend:str='process', evaluator:'EvaluationService'=None,
+         create_in_workers:bool=False, min_score:int=None) -> 'pop':
     """Compute one step, return the new population
 
     This implementation first select the population, then produce
@@ -56,6 +87,19 @@ def step(pop, case, pop_size:int, score:callable,
     mutate -- function used for mutation
     step_number -- number of the current step ; only for cosmetic/logging purpose
     callback_stats -- a callback that will get (step, scored_pop, max, min)
+    backend -- how the units are scored in parallel, one of BACKENDS
+    evaluator -- the evaluation.EvaluationService scoring the units with the
+        'process' backend, instead of a pool of processes created for this step
+    create_in_workers -- with the 'process' backend, the children are created
+        and scored by the workers of the evaluator (see _create_scored),
+        so that the next step doesn't score them again
+    min_score -- the survival of the previous step, if any: units that can't
+        reach it are given to the scoring function as its min_score, so that
+        their runs are aborted as soon as their output diverges too much
+        (see scoring.io_comparison). The children created in the workers
+        are scored with the survival of this step. Steps only have a
+        survival with truncation selection and kept parents, so that units
+        scored approximately are never selected.
 
     """
     assert callable(score)
@@ -73,7 +117,8 @@ def step(pop, case, pop_size:int, score:callable,
         print('\n\n# Step {}'.format(step_number))
 
     stdin, expected = case
-    scored_pop = _multisolve_scoring(stdin, expected, pop, score)
+    score = _budgeted(score, case.budget(stdin))
+    scored_pop = _multisolve_scoring(stdin, expected, pop, _bounded(score, min_score), backend, evaluator)
 
     best_unit = max(pop, key=lambda u: scored_pop[u].score)
     best_result = scored_pop[best_unit]
@@ -96,9 +141,117 @@ def step(pop, case, pop_size:int, score:callable,
     selected = dict(select(scored_pop))
     assert len(selected) > 1, selected
     assert selected, "at least one individual must be selected"
-    final = tuple(reproduce(selected, pop_size, cross, mutator=mutate))
+    survival = min(result.score for result in selected.values()) if _truncates(select, reproduce) else None
+    if create_in_workers and backend == 'process' and (evaluator is None or hasattr(evaluator, 'create_scored')):
+        final = _create_scored(selected, pop_size, reproduce, cross, mutate, (stdin, expected),
+                               _bounded(score, survival), evaluator)
+    else:
+        final = tuple(reproduce(selected, pop_size, cross, mutator=mutate))
     assert len(final) == pop_size, "new pop must have a size of {} ({}), not {}".format(pop_size, type(pop_size), len(final))
-    return StepResult(final, scored_pop, winners)
+    return StepResult(final, scored_pop, winners, survival)
+
+
+def steady_state(pop, case, pop_size:int, score:callable,
+                 select:callable, reproduce:callable, cross:callable, mutate:callable,
+                 step_number:int=None, callback_stats:callable=(lambda **kwargs: None),
+                 backend:str='process', evaluator:'EvaluationService'=None,
+                 insertion:str='worst', births:int=None, stats_every:int=None,
+                 min_score:int=None) -> 'pop':
+    """Compute one steady-state step, return the new population
+
+    Once given population is scored, children are produced and scored
+    one by one, keeping all workers busy, and each child is inserted in
+    the population as soon as its result arrives, without waiting for
+    the slowest ones. A child replaces, if it scores better:
+    - with insertion='worst', the worst member of the population
+    - with insertion='tournament', the worst of TOURNAMENT_SIZE random members
+
+    Parents are picked among the ones selected by select in the population,
+    selection being done again every stats_every insertions.
+    reproduce is not used: the children are made one by one with cross and mutate.
+
+    births -- number of children to produce, default to pop_size
+    stats_every -- number of insertions between two calls to callback_stats,
+        that gets the same data than with step. Default to pop_size.
+    Other parameters are the ones of step. min_score is not used: the
+    children are scored with the lowest score of the members as min_score,
+    since children that can't reach it are never inserted.
+
+    """
+    assert callable(score)
+    assert callable(select)
+    assert callable(cross)
+    assert callable(mutate)
+    assert callable(callback_stats)
+    assert isinstance(pop_size, int)
+    assert all(isinstance(unit, Unit) for unit in pop)
+    assert isinstance(case, Case)
+    assert pop
+    if insertion not in INSERTIONS:
+        raise ValueError(f"Insertion {insertion} is not known. Expecteds are: {', '.join(INSERTIONS)}.")
+    births = pop_size if births is None else int(births)
+    stats_every = max(1, int(stats_every or pop_size))
+
+    if step_number is not None:
+        print('\n\n# Step {}'.format(step_number))
+
+    stdin, expected = case
+    test = stdin, expected
+    score = _budgeted(score, case.budget(stdin))
+    workers = evaluator.processes if backend == 'process' and evaluator is not None else MULTIPROC_PROCESSES
+    workers = 1 if backend == 'serial' else workers
+    with _async_scoring(test, score, backend, evaluator) as (submit, arrived):
+        for unit in pop:
+            submit(unit)
+        scored_pop = dict(arrived() for _ in pop)
+        # the population is resized to pop_size, keeping the bests
+        members = sorted(pop, key=lambda u: scored_pop[u].score, reverse=True)
+        members = [members[idx % len(members)] for idx in range(pop_size)]
+        results = [scored_pop[unit] for unit in members]
+        worsts = [(result.score, idx) for idx, result in enumerate(results)]
+        heapq.heapify(worsts)
+        winners = [unit for unit, result in scored_pop.items() if result.found == expected]
+
+        def parents_pool() -> tuple:
+            selected = tuple(unit for unit, _ in select(dict(zip(members, results))))
+            assert len(selected) > 1, selected
+            return selected
+
+        def send_child():
+            couple = random.sample(parents, 2)
+            lowest = worsts[0][0] if insertion == 'worst' else min(result.score for result in results)
+            submit(Unit.mutated(Unit.child_from_crossed(couple, cross), mutate), _bounded(score, lowest))
+
+        parents, sent = parents_pool(), 0
+        while sent < min(births, workers * IN_FLIGHT_PER_WORKER):
+            send_child()
+            sent += 1
+        for inserted in range(1, births + 1):
+            child, result = arrived()
+            if result.found == expected:
+                winners.append(child)
+            if insertion == 'worst':
+                if result.score > worsts[0][0]:
+                    _, idx = heapq.heapreplace(worsts, (result.score, worsts[0][1]))
+                    members[idx], results[idx] = child, result
+            else:
+                idx = min(random.sample(range(pop_size), min(TOURNAMENT_SIZE, pop_size)), key=lambda i: results[i].score)
+                if result.score > results[idx].score:
+                    members[idx], results[idx] = child, result
+            if inserted % stats_every == 0:
+                parents = parents_pool()
+                scores = tuple(result.score for result in results)
+                callback_stats(popsize=pop_size, max_score=max(scores), min_score=min(scores),
+                               diversity=len(set(unit.source for unit in members)) / pop_size)
+            if sent < births:
+                send_child()
+                sent += 1
+
+    best = max(range(pop_size), key=lambda idx: results[idx].score)
+    print('OF', pop_size, 'BEST:', round(results[best].score, 3), f'AFTER {births} BIRTHS')
+    print(f"OUTPUTS: \"{results[best].found}\"\t(expect {expected})", ('[SUCCESS]' if results[best].found == expected else ''))
+    print('SOURCE:', members[best].source)
+    return StepResult(tuple(members), scored_pop, tuple(winners))
 
 
 def step_cross_first(pop, case, pop_size:int, score:callable,
@@ -146,13 +299,202 @@ def step_cross_first(pop, case, pop_size:int, score:callable,
     return StepResult(tuple(select(scored_pop)), scored_pop)
 
 
-def _multisolve_scoring(stdin, expected, pop, score:callable) -> dict:
+def _budgeted(score:callable, budget:int or None) -> callable:
+    """Return given scoring function, limited to given instruction budget if any"""
+    return score if budget is None else partial(score, budget=budget)
+
+
+@lru_cache(maxsize=64)
+def _accepts(score:callable, parameter:str) -> bool:
+    return parameter in inspect.signature(score).parameters
+
+
+def _bounded(score:callable, min_score:int or None) -> callable:
+    """Return given scoring function, given min_score if any and if it accepts one"""
+    if min_score is None or not _accepts(score, 'min_score'):
+        return score
+    return partial(score, min_score=min_score)
+
+
+def _keyword(func:callable, name:str):
+    """Return the value given function gets for given keyword argument"""
+    if isinstance(func, partial) and name in func.keywords:
+        return func.keywords[name]
+    return inspect.signature(func).parameters[name].default
+
+
+def _truncates(select:callable, reproduce:callable) -> bool:
+    """True if units below the survival of a step can't be selected by the
+    next one, with the same functions.
+
+    This holds when select keeps the top slice of the ranking, and reproduce
+    keeps the selected parents: the next selection takes as many units as
+    this one, and these parents, whose scores are exact and at least the
+    survival, outrank the units below it.
+
+    """
+    func = select.func if isinstance(select, partial) else select
+    if func is not selection.ranking_slices or 'keep_parents' not in inspect.signature(reproduce).parameters:
+        return False
+    pattern = tuple(_keyword(select, 'pattern'))
+    return len(pattern) == 1 and pattern[0][0] == 0 and bool(_keyword(reproduce, 'keep_parents'))
+
+
+def _screened(unit:Unit, test, score:callable) -> bool:
+    """True if given unit can be scored by given scoring function without
+    running it, see scoring.prescreen"""
+    min_score = score.keywords.get('min_score', scoring.SCORE_MINIMAL) if isinstance(score, partial) else scoring.SCORE_MINIMAL
+    return scoring.prescreen(unit, test, min_score) is not None
+
+
+def _prescreened(score:callable) -> callable:
+    """Return given scoring function, told that the units it gets were
+    prescreened, if it accepts it, so that the workers don't do it again"""
+    return partial(score, prescreened=True) if _accepts(score, 'prescreened') else score
+
+
+def _batched(score:callable, units:[Unit], test) -> bool:
+    """Run given units at once if the interpreter of given scoring function
+    has a scored_batch method, like lockstep.LockstepInterpreter, so that
+    scoring them then finds their runs. Return True if they were run.
+
+    """
+    if not _accepts(score, 'interpreter') or scoring.TRACE_RUNS or scoring.USE_SHARED_CACHE:
+        return False  # these runs are not the ones of the interpreter
+    interpreter = _keyword(score, 'interpreter')
+    if not hasattr(interpreter, 'scored_batch'):
+        return False
+    stdin, expected = test
+    interpreter.scored_batch([unit.source for unit in units], stdin, expected,
+                             max_output_size=scoring.MAX_OUT_SIZE,
+                             budget=_keyword(score, 'budget') if _accepts(score, 'budget') else None)
+    return True
+
+
+def _multisolve_scoring(stdin, expected, pop, score:callable, backend:str='process',
+                        evaluator:'EvaluationService'=None) -> dict:
     """Perform the scoring of given population for given stdin and
     expected result, using given scoring function.
 
     Return {individual: score}.
 
+    Units that can be scored without running them are scored
+    in the current process, the others are sent to the pool
+    of processes or threads, according to given backend (see BACKENDS).
+    The pool of processes is given evaluator if any, else a new one.
+    When the interpreter of the scoring function runs whole populations
+    (see _batched), they are all scored in the current process instead.
+
+    """
+    test = stdin, expected
+    results = {unit: score(unit, test) for unit in pop if _screened(unit, test, score)}
+    to_run = tuple(unit for unit in pop if unit not in results)
+    score = _prescreened(score)
+    if to_run and _batched(score, to_run, test):
+        results.update((unit, score(unit, test)) for unit in to_run)
+    elif to_run and backend == 'serial':
+        results.update((unit, score(unit, test)) for unit in to_run)
+    elif to_run and backend == 'thread':
+        results.update(_thread_scoring(to_run, test, score))
+    elif to_run and backend == 'process' and evaluator is not None:
+        results.update(evaluator.score(to_run, test, score))
+    elif to_run and backend == 'process':
+        # most expensive units first, in chunks given to the next idle process
+        costs = evaluation.CostModel()
+        ordered = sorted(to_run, key=costs.predict, reverse=True)
+        ranges = evaluation.guided_chunks([costs.predict(unit) for unit in ordered], MULTIPROC_PROCESSES)
+        with Pool(processes=MULTIPROC_PROCESSES, maxtasksperchild=MULTIPROC_TASK_PER_CHILD) as p:
+            scored = p.starmap(_score_units, ((score, test, ordered[start:stop]) for start, stop in ranges), chunksize=1)
+            results.update(zip(ordered, itertools.chain.from_iterable(scored)))
+    elif to_run:
+        raise ValueError(f"Backend {backend} is not known. Expecteds are: {', '.join(BACKENDS)}.")
+    return {unit: results[unit] for unit in pop}
+
+
+@contextmanager
+def _async_scoring(test, score:callable, backend:str='process', evaluator:'EvaluationService'=None):
+    """Yield (submit, arrived): submit(unit) starts the scoring of given unit,
+    and arrived() waits for the next (unit, result), in order of completion.
+    submit(unit, score) scores the unit with another scoring function.
+
+    Units that can be scored without running them are scored in the current
+    process, the others by the pool of processes or threads of given backend,
+    like with _multisolve_scoring. Errors of the scoring function are raised
+    by arrived.
+
+    """
+    done = queue.SimpleQueue()  # (unit, result, error)
+
+    def arrived() -> (Unit, 'RunResult'):
+        unit, result, error = done.get()
+        if error is not None:
+            raise error
+        return unit, result
+
+    def prescreened(send:callable) -> callable:
+        def submit(unit:Unit, unit_score:callable=score):
+            if _screened(unit, test, unit_score):
+                done.put((unit, unit_score(unit, test), None))
+            else:
+                send(unit, _prescreened(unit_score))
+        return submit
+
+    if backend == 'serial':
+        yield prescreened(lambda unit, score: done.put((unit, score(unit, test), None))), arrived
+    elif backend == 'thread':
+        with ThreadPoolExecutor(max_workers=MULTIPROC_PROCESSES) as executor:
+            def send(unit:Unit, score:callable):
+                executor.submit(score, unit, test).add_done_callback(
+                    lambda future: done.put((unit, None, future.exception()) if future.exception()
+                                            else (unit, future.result(), None)))
+            yield prescreened(send), arrived
+    elif backend == 'process':
+        def sender(submit:callable) -> callable:
+            return lambda unit, score: submit(unit, test, score, callback=lambda result: done.put((unit, result, None)),
+                                              error_callback=lambda error: done.put((unit, None, error)))
+        if evaluator is not None:
+            yield prescreened(sender(evaluator.submit)), arrived
+        else:
+            with Pool(processes=MULTIPROC_PROCESSES, maxtasksperchild=MULTIPROC_TASK_PER_CHILD) as pool:
+                def submit(unit:Unit, test, score:callable, **callbacks):
+                    pool.apply_async(score, (unit, test), **callbacks)
+                yield prescreened(sender(submit)), arrived
+    else:
+        raise ValueError(f"Backend {backend} is not known. Expecteds are: {', '.join(BACKENDS)}.")
+
+
+def _score_units(score:callable, test, units:[Unit]) -> list:
+    """Return the results of given units"""
+    return [score(unit, test) for unit in units]
+
+
+def _create_scored(selected:dict, pop_size:int, reproduce:callable, cross:callable, mutate:callable,
+                   test, score:callable, evaluator:'EvaluationService'=None) -> tuple:
+    """Return the next generation of given selected parents, like reproduce,
+    whose children are created and scored by the workers of given evaluator,
+    or of a new one. reproduce must have a keep_parents parameter.
+
+    """
+    keep_parents = inspect.signature(reproduce).parameters['keep_parents'].default
+    kept = tuple(selected) if keep_parents else ()
+    if evaluator is None:
+        with evaluation.EvaluationService(MULTIPROC_PROCESSES) as evaluator:
+            children = evaluator.create_scored(selected, pop_size - len(kept), reproduce, cross, mutate, test, score)
+    else:
+        children = evaluator.create_scored(selected, pop_size - len(kept), reproduce, cross, mutate, test, score)
+    return kept + tuple(children)
+
+
+def _thread_scoring(units:tuple, test, score:callable) -> dict:
+    """Return {unit: score} of given units, scored by a pool of threads.
+
+    Units and results are not pickled, and the threads share the
+    caches of the interpreter. The C interpreter releases the GIL during
+    the runs, and each thread has its own contexts.
+
     """
-    inputs = itertools.repeat((stdin, expected))
-    with Pool(processes=MULTIPROC_PROCESSES, maxtasksperchild=MULTIPROC_TASK_PER_CHILD) as p:
-        return dict(zip(pop, p.starmap(score, zip(pop, inputs))))
+    size = -(-len(units) // (MULTIPROC_PROCESSES * THREAD_CHUNKS))
+    chunks = (units[start:start + size] for start in range(0, len(units), size))
+    with ThreadPoolExecutor(max_workers=MULTIPROC_PROCESSES) as executor:
+        scored = executor.map(lambda chunk: [score(unit, test) for unit in chunk], chunks)
+        return dict(zip(units, itertools.chain.from_iterable(scored)))
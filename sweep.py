@@ -0,0 +1,153 @@
+"""Sweep of MMH runs over cases, configuration codes and seeds.
+
+Each combination of a case and codes of named functions, as given to
+Configuration.from_codes, is run once per seed, until a unit solves the
+case or max_steps steps are computed. Runs are asyncmmh.AsyncMMH runs
+driven by the same event loop, sharing:
+- an asyncmmh.ProcessPoolBackend of `processes` workers, scoring the units of all runs
+- the runcache of the interpreter runs, so that runs of the same case don't
+  run again the units found by another one
+
+The CPU budget is therefore the workers of the pool, plus the process
+running the steps of the runs, whose threads share the same interpreter.
+At most `concurrent_runs` runs are in progress at once.
+
+Seeds set the initial population of each run. The next steps of
+concurrent runs draw in the same random generators, in the order of
+their threads, so they are not reproducible.
+
+The summary gives, for each combination, the number of runs that solved
+the case, and the median number of steps and seconds they needed.
+
+"""
+
+
+import csv
+import time
+import random
+import asyncio
+import itertools
+from collections import namedtuple
+import numpy as np
+from numpy.random import default_rng
+
+import utils
+import scoring
+from config import Configuration
+from asyncmmh import AsyncMMH, ProcessPoolBackend
+from evaluation import default_processes
+
+
+ROLES = ('score', 'select', 'mutate', 'reproduce', 'cross', 'create', 'step')
+DEFAULT_MAX_STEPS = 100  # steps after which a run is considered failed
+SUMMARY_FIELDS = ('case', 'codes', 'runs', 'solved', 'median_steps', 'median_seconds')
+
+SweepRun = namedtuple('SweepRun', 'case codes seed solved steps seconds')
+
+
+def code_grid(**codes) -> [dict]:
+    """Return all combinations of given codes of each role.
+
+    >>> code_grid(select=('PLDD', 'RSD'), reproduce='PRPW')
+    [{'select': 'PLDD', 'reproduce': 'PRPW'}, {'select': 'RSD', 'reproduce': 'PRPW'}]
+
+    """
+    for role in codes:
+        if role not in ROLES:
+            raise ValueError(f"Role {role} is not known. Expecteds are: {', '.join(ROLES)}.")
+    choices = [(role, (values,) if isinstance(values, str) else tuple(values)) for role, values in codes.items()]
+    return [dict(zip(codes, combination)) for combination in itertools.product(*(values for _, values in choices))]
+
+
+def codes_label(codes:dict) -> str:
+    """Return the label of given codes in the summary
+
+    >>> codes_label({'select': 'PLDD', 'score': 'IOCBM'})
+    'score=IOCBM select=PLDD'
+
+    """
+    return ' '.join(f'{role}={codes[role]}' for role in ROLES if role in codes)
+
+
+def summarize(runs:[SweepRun]) -> [dict]:
+    """Return one row of SUMMARY_FIELDS for each combination of case and codes of given runs
+
+    >>> summarize([SweepRun('a', 'step=DIV', 1, True, 3, 2.), SweepRun('a', 'step=DIV', 2, False, 10, 5.),
+    ...            SweepRun('a', 'step=DIV', 3, True, 5, 4.)])
+    [{'case': 'a', 'codes': 'step=DIV', 'runs': 3, 'solved': 2, 'median_steps': 4.0, 'median_seconds': 3.0}]
+
+    """
+    combinations = {}
+    for run in runs:
+        combinations.setdefault((run.case, run.codes), []).append(run)
+    rows = []
+    for (case, codes), runs in combinations.items():
+        solved = [run for run in runs if run.solved]
+        rows.append({
+            'case': case, 'codes': codes, 'runs': len(runs), 'solved': len(solved),
+            'median_steps': float(np.median([run.steps for run in solved])) if solved else None,
+            'median_seconds': float(np.median([run.seconds for run in solved])) if solved else None,
+        })
+    return rows
+
+
+def write_summary(rows:[dict], filename:str):
+    """Write given summary rows in given csv file"""
+    with open(filename, 'w', newline='') as fd:
+        writer = csv.DictWriter(fd, fieldnames=SUMMARY_FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+async def _run(case_name:str, case:'Case', codes:dict, seed:int, pop_size:int, max_steps:int,
+               backend:ProcessPoolBackend, slots:asyncio.Semaphore) -> SweepRun:
+    async with slots:
+        random.seed(seed)
+        utils.np_rng = default_rng(seed)
+        mmh = AsyncMMH(case, pop_size, Configuration.from_codes(**codes), backend=backend)
+        start = time.perf_counter()
+        try:
+            while not mmh.found_solutions and mmh.current_step <= max_steps:
+                await mmh.step()
+        finally:
+            mmh.close()
+        return SweepRun(case_name, codes_label(codes), seed, bool(mmh.found_solutions),
+                        mmh.current_step - 1, time.perf_counter() - start)
+
+
+async def sweep(cases:{str: 'Case'}, codes:[dict], seeds:[int]=(0,), *, pop_size:int=400,
+                max_steps:int=DEFAULT_MAX_STEPS, processes:int=None, concurrent_runs:int=None,
+                shared_cache:bool=True) -> [SweepRun]:
+    """Return the SweepRun of each case, codes and seed, in this order.
+
+    cases -- {name: Case}
+    codes -- the codes of each configuration, as given to Configuration.from_codes
+    processes -- number of workers scoring the units of all runs, default to the number of CPUs
+    concurrent_runs -- number of runs in progress at once, default to twice the workers,
+        so that they are kept busy while runs compute their next population
+    shared_cache -- whether the workers keep their runs in the runcache
+
+    """
+    processes = int(processes or default_processes())
+    slots = asyncio.Semaphore(int(concurrent_runs or 2 * processes))
+    backend = ProcessPoolBackend(processes)
+    use_shared_cache = scoring.USE_SHARED_CACHE
+    scoring.USE_SHARED_CACHE = shared_cache  # inherited by the workers forked by the backend
+    try:
+        return await asyncio.gather(*(
+            _run(case_name, case, config_codes, seed, pop_size, max_steps, backend, slots)
+            for case_name, case in cases.items()
+            for config_codes in codes
+            for seed in seeds
+        ))
+    finally:
+        backend.close()
+        scoring.USE_SHARED_CACHE = use_shared_cache
+
+
+def run_sweep(cases:{str: 'Case'}, codes:[dict], seeds:[int]=(0,), filename:str=None, **kwargs) -> [dict]:
+    """Run the sweep, write its summary in given csv file if any, and return it"""
+    rows = summarize(asyncio.run(sweep(cases, codes, seeds, **kwargs)))
+    if filename:
+        write_summary(rows, filename)
+    return rows
@@ -0,0 +1,68 @@
+import asyncio
+import pytest
+import scoring
+import stepping
+import selection
+from case import Case
+from config import Configuration
+from asyncmmh import AsyncMMH, ProcessPoolBackend
+
+
+def config() -> Configuration:
+    return Configuration(score=scoring.io_comparison, select=selection.named_functions('RSD'),
+                         step=stepping.named_functions('DIV'))
+
+
+def test_concurrent_runs():
+    async def monitor(mmh, events:list):
+        async for data in mmh.progress():
+            events.append(data)
+
+    async def main():
+        backend = ProcessPoolBackend(processes=2)
+        runs = [AsyncMMH(Case('a', expected), pop_size=10, config=config(), backend=backend) for expected in 'bcd']
+        events = [[] for _ in runs]
+        monitors = [asyncio.create_task(monitor(mmh, evts)) for mmh, evts in zip(runs, events)]
+        await asyncio.sleep(0)  # let the monitors subscribe
+        await asyncio.gather(*(mmh.run(2) for mmh in runs))
+        await asyncio.gather(*monitors)
+        for mmh in runs:
+            mmh.close()
+        backend.close()
+        return runs, events
+
+    runs, events = asyncio.run(main())
+    assert all(mmh.current_step == 4 for mmh in runs)
+    assert all([data['step'] for data in evts] == [1, 2, 3] for evts in events)
+
+
+def test_corun_with_evaluator():
+    async def main():
+        mmh = AsyncMMH(Case('a', 'b'), pop_size=10, config=config(), processes=2)
+        steps = 0
+        async for pops in mmh.corun(1):
+            assert len(pops) == 1 and len(pops[0]) == 10
+            steps += 1
+        mmh.close()
+        return steps, mmh
+
+    steps, mmh = asyncio.run(main())
+    assert steps == 2 and mmh.evaluator._pool is None, "the evaluation service is stopped"
+
+
+@pytest.mark.parametrize('step', ['SSW', 'SST', 'DIVC'])
+@pytest.mark.parametrize('shared_backend', [True, False])
+def test_steps_using_the_evaluator(step, shared_backend):
+    async def main():
+        backend = ProcessPoolBackend(processes=2) if shared_backend else None
+        configuration = Configuration(score=scoring.io_comparison, select=selection.named_functions('RSD'),
+                                      step=stepping.named_functions(step))
+        mmh = AsyncMMH(Case('a', 'b'), pop_size=10, config=configuration, backend=backend, processes=2)
+        pops = [await mmh.step() for _ in range(2)]
+        mmh.close()
+        if backend:
+            backend.close()
+        return pops
+
+    pops = asyncio.run(main())
+    assert all(len(pop) == 10 for pops in pops for pop in pops)
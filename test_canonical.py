@@ -0,0 +1,42 @@
+
+import random
+
+from canonical import canonical_source, canonical_moves, move_effect, source_hash
+from interpreter import load_interpreter
+
+
+def test_neutral_differences():
+    assert canonical_source('+-++.') == canonical_source('++.') == '++.'
+    assert canonical_source('+++>,<') == canonical_source('') == '', "no output at all"
+    assert canonical_source('++ >+-.') == canonical_source('++>.') == '++>.'
+    assert canonical_source('+[].') == canonical_source('+.') == '+.'
+    assert canonical_source('+.[>+<-]>,') == '+.'
+    assert canonical_source('+[>.<--+]') == canonical_source('+[>.<-]') == '+[>.<-]'
+    assert canonical_source(',[+].') == canonical_source(',[---].') == ',0.'
+    assert source_hash('+.>') == source_hash('+.') != source_hash('-.')
+
+
+def test_meaningful_differences():
+    assert canonical_source('<>.') != canonical_source('.'), "moves are stopped by memory boundaries"
+    assert canonical_source('+[ ].') != canonical_source('+.'), "only empty loops are removed"
+    assert canonical_source(',[--+-].') != canonical_source(',0.'), "[--] may never end"
+    assert canonical_source(',[--+-].') != canonical_source(',[--].')
+
+
+def test_moves():
+    for _ in range(300):
+        moves = ''.join(random.choice('<>') for _ in range(random.randint(1, 100)))
+        canonical = canonical_moves(moves)
+        assert move_effect(canonical) == move_effect(moves)
+        assert len(canonical) <= len(moves)
+        assert canonical_moves(canonical) == canonical
+
+
+def test_same_outputs():
+    interpret = load_interpreter().inline
+    for _ in range(200):
+        source = ''.join(random.choice('<>+-[],. ') for _ in range(random.randint(1, 60)))
+        canonical = canonical_source(source)
+        assert canonical_source(canonical) == canonical
+        for stdin in ('', 'ab'):
+            assert interpret(source, stdin, max_output_size=64) == interpret(canonical, stdin, max_output_size=64), source
@@ -1,6 +1,8 @@
 
 
 import random
+
+import case
 from case import Case
 
 
@@ -32,3 +34,11 @@ def test_case_basic_api():
     stdin, stdout = c
     assert stdout.startswith('hello ')
     assert stdin == ''.join(reversed(stdout[len('hello '):-2]))
+
+
+def test_case_budget():
+    assert Case('', 'hi !').budget('') is None
+    c = Case('', 'a', reference='+++++++[>++++++++++++++<-]>-.', budget_factor=2)
+    assert c.budget('') == case.MINIMAL_BUDGET, "the reference runs in a few instructions"
+    c = Case('', '\3', reference='-[>-[>-[>+<-]<-]<-]+++.', budget_factor=2)
+    assert c.budget('') > case.MINIMAL_BUDGET
@@ -1,8 +1,11 @@
 
 
+import pytest
+import scoring
 from scoring import compare_str_c, compare_str_py, UINT8_MAX
 
 
+@pytest.mark.skipif(scoring.c_func_compare_str is None, reason='compare_str library not built')
 def test_compare_str_c():
     assert compare_str_c('a', 'b') == 1
     assert compare_str_c('a', 'bc') == abs(ord('a') - ord('b')) + abs(UINT8_MAX)
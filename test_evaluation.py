@@ -0,0 +1,77 @@
+import os
+import pytest
+import scoring
+import stepping
+import creation
+import crossing
+import mutator
+import reproduction
+import evaluation
+from unit import Unit
+from functools import partial
+from evaluation import EvaluationService
+
+
+@pytest.fixture
+def service():
+    with EvaluationService(processes=2) as service:
+        yield service
+
+
+def shared_blocks() -> set:
+    return set(os.listdir('/dev/shm')) if os.path.isdir('/dev/shm') else set()
+
+
+def test_same_results(service):
+    # long outputs and outputs with extended letters are given back by pickling
+    pop = tuple(creation.memory_oriented_diversity(100)) + (Unit('+[>+<]'), Unit('+[>+<]'), Unit('+[.+]'), Unit('-.'))
+    blocks = shared_blocks()
+    expected = stepping._multisolve_scoring('ab', 'hello', pop, scoring.io_comparison)
+    assert stepping._multisolve_scoring('ab', 'hello', pop, scoring.io_comparison, evaluator=service) == expected
+    pool = service._pool
+    stepping._multisolve_scoring('a', 'b', pop, partial(scoring.io_comparison, budget=100), evaluator=service)
+    assert service._pool is pool, "workers are kept between calls"
+    assert shared_blocks() == blocks, "shared memory is released"
+    assert service.score([], ('a', 'b'), scoring.io_comparison) == {}
+
+
+def test_trace(monkeypatch):
+    monkeypatch.setattr(scoring, 'TRACE_RUNS', True)
+    pop = (Unit(',.'), Unit('++[>+++<-]>[.-]'))
+    with EvaluationService(processes=2) as service:  # started after the patch, so that workers see it
+        results = service.score(pop, ('a', 'b'), scoring.io_comparison)
+    assert results == {unit: scoring.io_comparison(unit, ('a', 'b')) for unit in pop}
+    assert all(result.trace for result in results.values())
+
+
+def test_close(service):
+    unit = Unit(',.')
+    assert service.score([unit], ('a', 'a'), scoring.io_comparison)[unit].score == scoring.SCORE_BASE
+    service.close()
+    assert service._pool is None
+    assert service.score([unit], ('a', 'b'), scoring.io_comparison)[unit].score == scoring.SCORE_BASE - 1, "restarted"
+
+
+def test_cost_model(service, monkeypatch):
+    slow = Unit('-[>-[>-[-]<-]<-].')  # runs millions of instructions
+    pop = tuple(creation.memory_oriented_diversity(50)) + (slow,)
+    monkeypatch.setattr(evaluation, 'USE_COST_MODEL', False)
+    unscheduled = service.score(pop, ('a', 'b'), scoring.io_comparison)
+    monkeypatch.setattr(evaluation, 'USE_COST_MODEL', True)
+    assert service.score(pop, ('a', 'b'), scoring.io_comparison) == unscheduled
+    costs = service.costs
+    assert set(costs.measured) == {unit.source for unit in pop}
+    assert max(costs.measured, key=costs.measured.get) == slow.source
+    assert costs.predict(Unit(slow.source + '+', parents=[slow.source])) == costs.measured[slow.source]
+    assert service.last_stats.wall > 0 and service.last_stats.cpu >= costs.measured[slow.source]
+
+
+def test_create_scored(service):
+    parents = {unit: scoring.io_comparison(unit, ('a', 'b')) for unit in creation.memory_oriented_diversity(20)}
+    reproduce, cross, mutate = (next(iter(mod.default_functions())) for mod in (reproduction, crossing, mutator))
+    children = service.create_scored(parents, 30, reproduce, cross, mutate, ('a', 'b'), scoring.io_comparison)
+    assert len(children) == 30 and all(result == scoring.io_comparison(unit, ('a', 'b')) for unit, result in children.items())
+    # the next generation is not scored again
+    pop = tuple(children) + tuple(parents)
+    assert service.score(pop, ('a', 'b'), scoring.io_comparison) == {unit: children.get(unit, parents.get(unit)) for unit in pop}
+    assert service.costs.measured == {}, "nothing was sent to the workers"
@@ -0,0 +1,100 @@
+import time
+import pytest
+import scoring
+import stepping
+import selection
+import creation
+from unit import Unit
+from case import Case
+from functools import partial
+from multiprocessing import Process
+from multiprocessing.connection import Client
+from config import Configuration
+from mmh import MMH
+from farm import WorkerFarm, serve
+
+
+@pytest.fixture
+def farm():
+    with WorkerFarm(batch_size=16, heartbeat_timeout=1., timeout=10) as farm:
+        yield farm
+
+
+def start_worker(farm, **kwargs) -> Process:
+    worker = Process(target=serve, args=(farm.address, farm.authkey), kwargs=kwargs)
+    worker.start()
+    return worker
+
+
+def test_same_results(farm):
+    workers = [start_worker(farm), start_worker(farm, processes=2)]
+    assert farm.wait_workers(2, timeout=10)
+    pop = tuple(creation.memory_oriented_diversity(100)) + (Unit('+[>+<]'), Unit('+[.+]'))
+    expected = stepping._multisolve_scoring('ab', 'hello', pop, scoring.io_comparison, 'serial')
+    assert stepping._multisolve_scoring('ab', 'hello', pop, scoring.io_comparison, evaluator=farm) == expected
+    stats = farm.stats()
+    to_run = {unit.source for unit in pop if scoring.prescreen(unit, ('ab', 'hello')) is None}
+    assert len(stats) == 2 and sum(worker.units for worker in stats.values()) == len(to_run)
+    assert all(worker.lost == 0 for worker in stats.values())
+    farm.close()
+    for worker in workers:
+        worker.join(timeout=10)
+        assert worker.exitcode == 0
+
+
+def test_lost_batches(farm):
+    # a worker taking a batch and never answering
+    silent = Client(farm.address, authkey=farm.authkey)
+    silent.send(('hello', 'silent'))
+    assert farm.wait_workers(1, timeout=10)
+    worker = start_worker(farm, heartbeat_period=0.1)
+    pop = tuple(Unit('+' * size + '.') for size in range(1, 50))
+    start = time.monotonic()
+    results = farm.score(pop, ('', 'a'), scoring.io_comparison)
+    assert results == {unit: scoring.io_comparison(unit, ('', 'a')) for unit in pop}
+    assert farm.stats()['silent'] == (0, 0, 0., 1), "its batch was given to the other worker"
+    assert time.monotonic() - start >= 1., "after the heartbeat timeout"
+    silent.close()
+    farm.close()
+    worker.join(timeout=10)
+
+
+def test_idle_workers(farm):
+    start_worker(farm, heartbeat_period=0.1)
+    pop = tuple(Unit('+' * size + '.') for size in range(1, 20))
+    expected = {unit: scoring.io_comparison(unit, ('', 'a')) for unit in pop}
+    assert farm.score(pop, ('', 'a'), scoring.io_comparison) == expected
+    time.sleep(2 * farm.heartbeat_timeout)  # like between two generations
+    assert farm.score(pop, ('', 'a'), scoring.io_comparison) == expected
+    assert all(worker.lost == 0 for worker in farm.stats().values())
+
+
+def test_errors(farm):
+    start_worker(farm)
+    with pytest.raises(TypeError):
+        farm.score([Unit('+.')], ('', 'a'), partial(scoring.io_comparison, unknown=1))
+    pop = tuple(Unit('+' * size + '.') for size in range(1, 50))
+    assert farm.score(pop, ('', 'a'), scoring.io_comparison) == {unit: scoring.io_comparison(unit, ('', 'a')) for unit in pop}, "the worker is still used"
+    with WorkerFarm(timeout=0.2) as alone, pytest.raises(TimeoutError):
+        alone.score([Unit('+.')], ('', 'a'), scoring.io_comparison)
+
+
+def test_mmh_farm(farm):
+    start_worker(farm)
+    config = Configuration(score=scoring.io_comparison, step=stepping.named_functions('DIV'))
+    mmh = MMH(Case('a', 'b'), pop_size=20, config=config, evaluator=farm, data_handler=lambda **data: None)
+    mmh.run(1)
+    mmh.close()
+    assert sum(worker.units for worker in farm.stats().values()) > 0
+
+
+def test_steady_state_farm(farm):
+    start_worker(farm)
+    start_worker(farm)
+    assert farm.wait_workers(2, timeout=10)
+    config = Configuration(score=scoring.io_comparison, select=selection.named_functions('RSD'),
+                           step=stepping.named_functions('SSW'))
+    mmh = MMH(Case('a', 'b'), pop_size=20, config=config, evaluator=farm, data_handler=lambda **data: None)
+    mmh.run(1)
+    mmh.close()
+    assert sum(worker.units for worker in farm.stats().values()) > 0
@@ -1,4 +1,5 @@
 
+import pytest
 import mutator
 import scoring
 import crossing
@@ -6,9 +7,13 @@ import stepping
 import creation
 import selection
 import reproduction
+import interpreter
 
+from mmh import MMH
 from unit import Unit
 from case import Case
+from config import Configuration
+from evaluation import EvaluationService
 
 
 
@@ -25,6 +30,43 @@ def test_scoring_functions():
         assert isinstance(func(unit, test), scoring.RunResult)
 
 
+def test_scoring_prescreen():
+    test = 'a', 'hello'
+    for source in ('+++>,<-', '+++.>.', '+[>+.<-]>.', ',.' * 3):
+        unit = Unit(source)
+        screened = scoring.prescreen(unit, test)
+        if screened is not None:
+            assert screened.score == scoring.io_comparison(unit, test, min_score=-scoring.SCORE_BASE).score
+    assert scoring.prescreen(Unit('+++>,<-'), test) == scoring.RunResult(scoring.SCORE_BASE - 5 * 255, 'hello', '')
+    assert scoring.prescreen(Unit('+++.>.'), test) is None
+    assert scoring.prescreen(Unit('+++.>.'), test, min_score=scoring.SCORE_BASE) is not None
+    assert scoring.prescreen(Unit('.' * 5), ('', 'a' * 5)) is None
+    assert scoring.prescreen(Unit('.' * 50), ('', 'a' * 100)) == scoring.RunResult(scoring.SCORE_MINIMAL, 'a' * 100, '')
+
+
+def test_scoring_prescreened_once(monkeypatch):
+    pop, test = tuple(creation.memory_oriented_diversity(50)) + (Unit('+++'),), ('a', 'hello')
+    screened = sum(scoring.prescreen(unit, test) is not None for unit in pop)
+    expected = stepping._multisolve_scoring(*test, pop, scoring.io_comparison, 'serial')
+    calls, prescreen = [], scoring.prescreen
+    monkeypatch.setattr(scoring, 'prescreen', lambda *args: calls.append(args) or prescreen(*args))
+    assert stepping._multisolve_scoring(*test, pop, scoring.io_comparison, 'serial') == expected
+    # screened units are scored by the scoring function, that prescreens them again
+    assert len(calls) == len(pop) + screened
+
+
+def test_scoring_trace(monkeypatch):
+    unit, test = Unit('++[>+++<-]>[.-] end'), ('', 'abc')
+    untraced = [func(unit, test) for func in scoring.default_functions()]
+    assert all(result.trace == () for result in untraced)
+    monkeypatch.setattr(scoring, 'TRACE_RUNS', True)
+    for func, expected in zip(scoring.default_functions(), untraced):
+        result = func(unit, test)
+        assert result[:3] == expected[:3]
+        assert result.trace.steps == sum(result.trace.counts)
+        assert result.trace.output_sources == (unit.source.index('.'),) * 6
+
+
 def test_crossing_functions():
     parents = Unit('+'*80), Unit('-'*80)
     for func in crossing.default_functions():
@@ -55,3 +97,98 @@ def test_stepping_functions():
     functions = (next(iter(mod.default_functions())) for mod in (scoring, selection, reproduction, crossing, mutator))
     for func in stepping.default_functions():
         func(pop, Case('a', 'b'), len(pop), *functions)
+
+
+def test_stepping_backends():
+    pop = tuple(creation.memory_oriented_diversity(200)) + (Unit('+[>+<]'), Unit('+[.+]'))
+    results = [stepping._multisolve_scoring('ab', 'hello', pop, scoring.io_comparison, backend)
+               for backend in stepping.BACKENDS]
+    assert all(result == results[0] for result in results)
+    assert list(results[0]) == list(pop)
+    with pytest.raises(ValueError):
+        stepping._multisolve_scoring('ab', 'hello', pop, scoring.io_comparison, 'gpu')
+    step = stepping.named_functions('DIVT')
+    functions = (next(iter(mod.default_functions())) for mod in (scoring, selection, reproduction, crossing, mutator))
+    step(pop[:4], Case('a', 'b'), 4, *functions)
+
+
+def test_survival_bound(monkeypatch):
+    monkeypatch.setattr(scoring, 'TRACE_RUNS', True)  # the traces give the termination of the runs
+    case = Case('', 'hello, world!')
+    functions = (scoring.io_comparison, selection.named_functions('RSD'),
+                 next(iter(reproduction.default_functions())), next(iter(crossing.default_functions())),
+                 next(iter(mutator.default_functions())))
+    pop = tuple(creation.memory_oriented_diversity(200))
+    pop, _, _, survival = stepping.step(pop, case, 200, *functions, backend='serial')
+    assert survival > scoring.SCORE_MINIMAL
+    _, scored, *_ = stepping.step(pop, case, 200, *functions, backend='serial', min_score=survival)
+    aborted = [unit for unit, result in scored.items() if result.trace and result.trace.termination == interpreter.RunStatus.ABORTED]
+    assert aborted, "hopeless runs are aborted"
+    exact = {unit: scoring.io_comparison(unit, tuple(case)) for unit in aborted}
+    assert all(result.score < survival for result in exact.values())
+    assert all(exact[unit].score <= scored[unit].score <= survival for unit in aborted), "their scores are upper bounds"
+
+
+def test_survival_only_with_truncation():
+    rsd, rs2 = selection.named_functions('RSD'), selection.named_functions('RS2')
+    keeping, replacing = reproduction.named_functions('PRPW'), reproduction.named_functions('PRW')
+    assert stepping._truncates(rsd, keeping)
+    assert not stepping._truncates(rs2, keeping), "middle slices may select units below the survival"
+    assert not stepping._truncates(rsd, replacing), "children may all be below the survival"
+    assert not stepping._truncates(selection.named_functions('PLDD'), keeping)
+    pop = tuple(creation.memory_oriented_diversity(50))
+    functions = (scoring.io_comparison, rs2, keeping, next(iter(crossing.default_functions())),
+                 next(iter(mutator.default_functions())))
+    assert stepping.step(pop, Case('a', 'b'), 50, *functions, backend='serial').survival is None
+
+
+def test_mmh_survivals_reset():
+    config = Configuration(score=scoring.io_comparison, select=selection.named_functions('RSD'),
+                           reproduce=reproduction.named_functions('PRPW'), step=stepping.named_functions('DIV'))
+    mmh = MMH(Case('a', 'b'), pop_size=20, config=config, processes=2, data_handler=lambda **data: None)
+    mmh.prompt_at, mmh.change_config_at = (lambda step: False), (lambda step: True)
+    mmh.survivals = (scoring.SCORE_BASE * 2,)  # like after a step scored with a bonus
+    given, call = [], mmh.algogen_call
+    mmh.algogen_call = lambda pop, survival=None: given.append(survival) or call(pop, survival)
+    mmh.step()
+    mmh.close()
+    assert given == [None], "the survival of another config is not used"
+    assert mmh.survivals[0] is not None
+
+
+def test_mmh_workers():
+    config = Configuration(score=scoring.io_comparison, step=stepping.named_functions('DIV'))
+    mmh = MMH(Case('a', 'b'), pop_size=20, config=config, processes=2, data_handler=lambda **data: None)
+    mmh.run(1)
+    assert mmh.evaluator._pool is not None
+    mmh.close()
+
+
+@pytest.mark.parametrize('backend', stepping.BACKENDS)
+def test_steady_state(backend):
+    pop = tuple(creation.memory_oriented_diversity(20))
+    scored = stepping._multisolve_scoring('a', 'hello', pop, scoring.io_comparison)
+    functions = tuple(next(iter(mod.default_functions())) for mod in (scoring, selection, reproduction, crossing, mutator))
+    stats = []
+    step = stepping.named_functions('SSW')
+    new_pop, scored_pop, *_ = step(pop, Case('a', 'hello'), 20, *functions, backend=backend,
+                                     births=30, stats_every=10, callback_stats=lambda **data: stats.append(data))
+    assert len(new_pop) == 20 and scored_pop == scored
+    assert len(stats) == 3 and all(data['popsize'] == 20 for data in stats)
+    # replacing the worst never lowers the scores
+    assert min(data['min_score'] for data in stats) >= min(result.score for result in scored.values())
+    assert [data['min_score'] for data in stats] == sorted(data['min_score'] for data in stats)
+    with pytest.raises(ValueError):
+        stepping.steady_state(pop, Case('a', 'b'), 20, *functions, insertion='random')
+
+
+def test_stepping_create_in_workers():
+    pop = tuple(creation.memory_oriented_diversity(20))
+    functions = tuple(next(iter(mod.default_functions())) for mod in (scoring, selection, reproduction, crossing, mutator))
+    with EvaluationService(processes=2) as service:
+        new_pop, *_ = stepping.named_functions('DIVC')(pop, Case('a', 'b'), 20, *functions, evaluator=service)
+        assert len(new_pop) == 20
+        assert service._known[1], "the children are already scored"
+        stepping.named_functions('DIVC')(new_pop, Case('a', 'b'), 20, *functions, evaluator=service)
+    new_pop, *_ = stepping.named_functions('DIVC')(pop, Case('a', 'b'), 20, *functions)
+    assert len(new_pop) == 20
@@ -1,7 +1,11 @@
 
 
+import os
+import json
 import pytest
-from interpreter import load_interpreter
+import subprocess
+from interpreter import (load_interpreter, prefix_segments, interprete_scored,
+                         RunStatus, NativeProgram)
 
 
 @pytest.fixture
@@ -25,3 +29,186 @@ def test_basic_loop(interpret):
 
 def test_basic_move(interpret):
     assert ord(interpret(',>+.', input=chr(42))) == 1
+
+
+@pytest.mark.skipif(not os.path.exists('./bfinterp'), reason='standalone module not built')
+def test_standalone_batch(tmp_path):
+    sources = ('++++>,<[->+<]>.', '+[>+<]', ',[.,]', '+[.+]', '')
+    inputs = ('a', '', 'b\n"\\c', '', 'x')
+    records = tmp_path / 'records.jsonl'
+    records.write_text(''.join(json.dumps({'source': s, 'input': i}) + '\n' for s, i in zip(sources, inputs)))
+    nul_records = ''.join(f'{s}\0{i}\0' for s, i in zip(sources, inputs)).encode()
+    mapped = subprocess.run(['./bfinterp', '--batch', str(records)], capture_output=True, check=True)
+    streamed = subprocess.run(['./bfinterp', '--batch', '--nul'], input=nul_records, capture_output=True, check=True)
+    assert mapped.stdout == streamed.stdout
+    results = [json.loads(line) for line in mapped.stdout.decode().splitlines()]
+    interpret = load_interpreter().inline
+    assert [r['output'] for r in results] == [interpret(s, i) for s, i in zip(sources, inputs)]
+    assert [r['termination'] for r in results] == ['end', 'cycle', 'end', 'end', 'end']
+
+
+@pytest.mark.skipif(not os.path.exists('./bfinterp'), reason='standalone module not built')
+def test_standalone_invalid_output_size():
+    for size in ('0', 'x'):
+        run = subprocess.run(['./bfinterp', '--batch', '--nul', '--output-size', size], input=b'+.\0\0', capture_output=True)
+        assert run.returncode == 1 and run.stderr.startswith(b'usage:'), size
+
+
+def test_program():
+    interp = load_interpreter()
+    program = interp.program(',[.-]')
+    assert program.run('c') == 'cba' + ''.join(map(chr, range(96, 0, -1)))
+    assert program.run('') == ''
+    assert interp.program('+]').run() == ''
+
+
+def test_batch():
+    interp = load_interpreter()
+    sources = [',.', ',+.', '+[.+]', '']
+    inputs = ['a', '', 'z']
+    result = interp.batch(sources, inputs, max_output_size=64)
+    assert list(result) == [[interp.inline(source, input, max_output_size=64) for input in inputs] for source in sources]
+    assert result.output(0, 1) == '\0'
+    assert result.lengths[2 * len(inputs)] == 63, "output is limited to max_output_size-1 characters"
+
+
+def test_context():
+    interp = load_interpreter()
+    context = interp.context(8)
+    assert bytes(context.run('++++[>++++++++<-]>+.', '')) == b'!'
+    assert context.steps == 5
+    assert context.text(interp.program(',[.-]'), 'z') == 'zyxwvut', "output is limited to max_output_size-1 characters"
+    assert context.text('>+<.>.') == '\0\1', "memory is reset between two runs, output keeps null characters"
+    assert context.text('+++[>+<-]>.') == '\3'
+
+
+def test_scored_run():
+    from scoring import compare_str
+    interp = load_interpreter()
+    context = interp.context(64)
+    for source, input, expected in (('+++[>+++++++++++<-]>.', '', '!'), (',.+.', 'a', 'ab'),
+                                    (',.', 'c', 'abcd'), ('+[.+]', '', 'hi !'), ('', '', 'hello')):
+        found = context.text(source, input)
+        assert context.score(source, input, expected, 2**32) == compare_str(expected, found)
+        assert not context.aborted
+    # infinite output is stopped as soon as it becomes too different from expected
+    assert context.score('+[.]', '', 'aaaa', 1000) > 1000
+    assert context.aborted and len(context.output) < 10
+
+
+def test_cycle_detection():
+    interp = load_interpreter()
+    context = interp.context(64)
+    for source in ('+[>+<]', '+[[,,]-]', '+[<]', '+[>,+<]', '-[>[-]+<]', '>+[<+>]'):
+        context.text(source)
+        assert context.cycled, source
+        assert context.steps < 10_000, source
+    # states differing only by read input or written output are not cycles
+    assert context.text('+[,.+]', 'abc') == 'abc' + '\0' * 60 and not context.cycled
+    # cycles that print are stopped by the output limit, not by the detection
+    assert context.text('+[.]') == '\1' * 63
+    assert not context.cycled
+    # without detection, the whole budget is used
+    context.configure(budget=100_000, detect_cycles=False)
+    context.text('+[>+<]')
+    assert context.steps == 100_000 and context.result.termination == RunStatus.BUDGET
+
+
+def test_budget():
+    interp = load_interpreter()
+    context = interp.context(64, budget=10)
+    assert context.text('+.+.+.+.+.+.+.+.') == '\1\2\3\4\5'
+    assert context.steps == 10 and context.result.termination == RunStatus.BUDGET
+    assert interp.inline('+.+.+.', budget=4) == '\1\2'
+    assert interp.inline('+.+.+.') == '\1\2\3'
+
+
+def test_prefix_checkpoints():
+    interp = load_interpreter()
+    assert prefix_segments('') == ['']
+    assert ''.join(prefix_segments('+[>[+]<-]>.[,.]]+[')) == '+[>[+]<-]>.[,.]]+['
+    checkpoints = interp.checkpoints('ab', 'hello', max_output_size=64, min_steps=0)
+    context = interp.context(64)
+    parent = '+[>+<+]>[,.<]'
+    for child in (parent, parent + '.', parent + '[-]+.', '+[>+<+]>+.', parent[:-1]):
+        assert checkpoints.score(child) == context.score(child, 'ab', 'hello', 2**32)
+        assert bytes(checkpoints.context.output) == bytes(context.output)
+    assert checkpoints.resumed == 4
+    assert checkpoints.size == 3, "two checkpoints for parent, one more for the [-] loop"
+    # the state of an ended run is kept as is
+    checkpoints = interp.checkpoints(max_output_size=64, budget=100, min_steps=0)
+    assert checkpoints.text('+[>+<]+.') == checkpoints.text('+[>+<]++.') == ''
+    assert checkpoints.context.result.termination == RunStatus.BUDGET
+
+
+def test_trace():
+    interp = load_interpreter()
+    context = interp.context(64)
+    source = '++[>+++<-]>[.-]'
+    trace = context.trace(source)
+    assert trace.steps == context.steps == sum(trace.counts)
+    assert trace.termination == RunStatus.END and trace.highest_cell == 1
+    assert trace.counts[source.index('.')] == 6, "one . per loop iteration"
+    assert trace.counts[source.index('+')] == 1 and trace.counts[source.index('+') + 1] == 0, "runs are one instruction"
+    assert trace.output_sources == (source.index('.'),) * 6
+    assert context.trace('>>>>><<.').highest_cell == 3, "cells only passed over by a move are not used"
+    # runs without trace are not affected
+    assert context.text(source) == '\6\5\4\3\2\1' and context.steps == trace.steps
+    distance, found, trace = interp.traced(',.', 'ab', 'b', 100)
+    assert (distance, found, trace.counts) == (1, 'a', (1, 1))
+
+
+def test_jit(tmp_path):
+    interp = load_interpreter()
+    jit = interp.jit(min_runs=2, min_steps=1000, cache_dir=str(tmp_path))
+    source = '++++>,<[->+<]>.'
+    assert jit.inline(source, 'a') == 'e' and jit.native(source) is None
+    assert jit.inline(source, 'b') == 'f' and jit.native(source) is not None
+    assert jit.inline_scored(source, 'c', 'g', 0) == (0, 'g')
+    assert jit.native('++++ >,<[->+<]>. comment') is jit.native(source), "same canonical form"
+    # long runs are compiled at once
+    long_run = '-[>-[>+<-]<-]>>.'
+    assert jit.inline(long_run) == interp.inline(long_run) and jit.native(long_run) is not None
+    # compiled programs are kept between sessions
+    jit = interp.jit(cache_dir=str(tmp_path))
+    assert jit.native(source) is not None
+    assert list(jit.batch([source, ',.'], ['a', 'b'])) == [['e', 'f'], ['a', 'b']]
+    # native runs behave as the interpreter without cycle detection
+    native, context = jit.native(source), interp.context(4, budget=5, detect_cycles=False)
+    assert native.run('a', max_output_size=4, budget=5) == (context.text(source, 'a'), 0)
+    assert (native.steps, native.termination) == (context.steps, context.result.termination) == (5, RunStatus.BUDGET)
+
+
+def test_jit_failed_builds(tmp_path, monkeypatch):
+    builds = []
+    def build(program, path):
+        builds.append(path)
+        raise OSError('no gcc')
+    monkeypatch.setattr(NativeProgram, 'build', build)
+    jit = load_interpreter().jit(min_runs=2, cache_dir=str(tmp_path))
+    assert [jit.inline(',+.', letter) for letter in 'abcdef'] == list('bcdefg')
+    assert len(builds) == 1, "a failed build is not tried again"
+    assert jit.native(',+.') is None
+
+
+def test_program_optimizations():
+    interp = load_interpreter()
+    assert len(interp.program('+++---+-')) == 0, "runs should cancel each others"
+    assert len(interp.program('>>><<<<')) == 1, "moves are folded, whatever their direction"
+    assert len(interp.program('+++++>>>>>-----')) == 3, "runs should be folded"
+    assert len(interp.program('[-][+][>]')) == 3, "clear and scan loops are one instruction"
+    assert interp.program('++++++[->++++++++<]>.').steps() < 10, "multiply loops are one instruction"
+    # exact semantic of moves, on memory boundaries
+    assert interp.program('<>+<.>.').run() == '\0\1'
+    assert interp.program('+[->+<]>.').run() == '\1'
+
+
+def test_threads():
+    from concurrent.futures import ThreadPoolExecutor
+    interp = load_interpreter()
+    sources = [',[.-]', '++++[>+++<-]>[.-]', '+[>+<]', '-[>-[>+<-]<-]>>.', ',.,.', '+[.+]'] * 50
+    expected = [interprete_scored(source, 'ab', 'ba', 2**32, interpreter=interp, max_output_size=64) for source in sources]
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        found = list(executor.map(lambda source: interprete_scored(source, 'ab', 'ba', 2**32, interpreter=interp,
+                                                                   max_output_size=64), sources))
+    assert found == expected
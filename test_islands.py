@@ -0,0 +1,61 @@
+import pytest
+import multiprocessing
+import scoring
+import stepping
+import selection
+from unit import Unit
+from case import Case
+from config import Configuration
+from islands import IslandMMH
+from evaluation import EvaluationService
+
+
+@pytest.fixture
+def mmh():
+    stats = []
+    config = Configuration(score=scoring.io_comparison, select=selection.named_functions('RSD'),
+                           step=stepping.named_functions('DIV'))
+    mmh = IslandMMH(Case('a', 'b'), pop_size=10, config=config, pop_number=3, processes=2,
+                    data_handler=lambda **data: stats.append(data), migrate_every=2, migrants=1)
+    mmh.stats = stats
+    yield mmh
+    mmh.close()
+
+
+def test_epoch(mmh):
+    pops = mmh.step()
+    assert len(pops) == 3 and all(len(pop) == 10 for pop in pops)
+    assert mmh.current_step == 3
+    assert sorted((data['island'], data['step']) for data in mmh.stats) == [(i, s) for i in range(3) for s in (1, 2)]
+
+
+def test_migration(mmh):
+    pops = [tuple(Unit(f'{idx}') for _ in range(10)) for idx in range(3)]
+    bests = [[Unit(f'{idx}!')] for idx in range(3)]
+    assert mmh.targets() == [1, 2, 0]
+    migrated = mmh.migrate(pops, bests)
+    for idx, pop in enumerate(migrated):
+        assert sorted(unit.source for unit in pop) == sorted([f'{idx}'] * 9 + [f'{(idx - 1) % 3}!'])
+    mmh.topology = 'random'
+    assert all(target != idx for idx, target in enumerate(mmh.targets()))
+
+
+def test_split_merge(mmh):
+    new = mmh.split(1)
+    assert new == 3 and [len(pop) for pop in mmh.populations] == [10, 5, 10, 5]
+    mmh.merge(1, 3)
+    assert [len(pop) for pop in mmh.populations] == [10, 10, 10] and len(mmh.configs) == 3
+    mmh.step()
+    assert all(len(pop) == 10 for pop in mmh.populations)
+    with pytest.raises(ValueError):
+        mmh.merge(0, 0)
+
+
+def test_no_evaluation_service(mmh):
+    assert not isinstance(mmh.evaluator, EvaluationService), "islands score their own units"
+
+
+def test_fork_required(monkeypatch):
+    monkeypatch.setattr(multiprocessing, 'get_all_start_methods', lambda: ['spawn'])
+    with pytest.raises(RuntimeError):
+        IslandMMH(Case('a', 'b'), pop_size=10, config=Configuration(), pop_number=2)
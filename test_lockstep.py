@@ -0,0 +1,62 @@
+import pytest
+import scoring
+from unit import Unit
+from interpreter import load_interpreter
+from lockstep import LockstepInterpreter, lowered
+
+
+SOURCES = (
+    ',.', ',+.>,-.', '++++++++[>++++++++<-]>+.', ',[.-]', '+[>+<-]>.',
+    '<<<+.>>>>-.', ',[>+<-]>0+.', '[.]-.', ']+.', '+[.', '+.[-]]+.',
+    '++[>+++[>,.<-]<-]', '-[.-]',
+)
+
+
+@pytest.fixture
+def lockstep():
+    return LockstepInterpreter(budget=2**14)
+
+
+def test_lowered_jumps():
+    assert lowered('[>]').tolist() == [[5, 3, 0, 0], [0, 1, 1, 2047], [6, 1, 0, 0]]
+    assert lowered('+]').tolist() == [[1, 1, 0, 0], [6, 2, 0, 0]]
+    assert lowered('<').tolist() == [[0, -1, 0, 2046]]
+
+
+def test_same_outputs_than_c(lockstep):
+    inputs = ('', 'ab', 'z\x80')
+    expected = load_interpreter().batch(SOURCES, inputs, max_output_size=64)
+    assert list(lockstep.batch(SOURCES, inputs, max_output_size=64)) == list(expected)
+
+
+def test_budget(lockstep):
+    assert lockstep.inline('+[>+<]') == ''
+    assert lockstep.inline('+[.]', max_output_size=8) == '\1' * 7
+    assert lockstep.inline('+++[>+.<-]', budget=5) == '\1'
+
+
+def test_scoring(lockstep):
+    test = ('ab', 'hello!')
+    for source in SOURCES:
+        found = load_interpreter().inline(source, 'ab', max_output_size=scoring.MAX_OUT_SIZE)
+        assert lockstep.inline_scored(source, *test, 0, max_output_size=scoring.MAX_OUT_SIZE) \
+               == (scoring.compare_str('hello!', found), found)
+        # found outputs may differ, since the C interpreter aborts hopeless runs
+        assert scoring.io_comparison(Unit(source), test, interpreter=lockstep).score \
+               == scoring.io_comparison(Unit(source), test).score
+
+
+def test_population_scoring(lockstep, monkeypatch):
+    import stepping
+    from functools import partial
+    runs = []
+    scored_runs = lockstep._scored_runs
+    monkeypatch.setattr(lockstep, '_scored_runs', lambda sources, *args: runs.append(sources) or scored_runs(sources, *args))
+    pop = tuple(map(Unit, SOURCES))
+    test = ('ab', 'hello!')
+    score = partial(scoring.io_comparison, interpreter=lockstep, budget=2**12)
+    results = stepping._multisolve_scoring(*test, pop, score, backend='serial')
+    assert len(runs) == 1, "the units to run are run at once"
+    assert {unit: result.score for unit, result in results.items()} \
+           == {unit: scoring.io_comparison(unit, test).score for unit in pop}
+
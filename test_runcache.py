@@ -0,0 +1,69 @@
+import pytest
+import scoring
+import runcache
+from unit import Unit
+from multiprocessing import Pool
+from interpreter import load_interpreter
+from runcache import SharedRunCache, shared_cache
+
+
+SOURCES = ('++++>,<[->+<]>.', ',[.-]', '+[>+<]', '+[.]', '', ',.>,.')
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'runs')
+
+
+def _run_all(path:str) -> [str]:
+    return [shared_cache(load_interpreter(), path).inline(source, 'ab', max_output_size=64) for source in SOURCES]
+
+
+def test_shared_by_processes(path):
+    with Pool(processes=2) as pool:
+        outputs = pool.map(_run_all, [path] * 4)
+    interp = load_interpreter()
+    assert outputs == [[interp.inline(source, 'ab', max_output_size=64) for source in SOURCES]] * 4
+    cache = SharedRunCache(interp, path)
+    hits, misses, entries, _ = cache.stats()
+    assert hits + misses == 4 * len(SOURCES) and entries == len(SOURCES)
+    assert misses < 4 * len(SOURCES), "other processes found the runs of the first one"
+
+
+def test_eviction(path):
+    interp = load_interpreter()
+    cache = SharedRunCache(interp, path, slots=16)
+    sources = ['+' * n + '.' for n in range(1, 100)]
+    for source in sources:
+        assert cache.inline(source) == chr(source.count('+'))
+    hits, misses, entries, _ = cache.stats()
+    assert (hits, misses) == (0, len(sources)) and entries <= 16 + runcache.PROBES - 1, "the file size is bounded"
+    # referenced slots get a second chance
+    cache.inline(sources[-1])
+    for source in sources[:8]:
+        cache.inline(source)
+    assert cache.get(runcache.run_key(sources[-1], '', 2**16, None)) is not None
+
+
+def test_persistence(path):
+    interp = load_interpreter()
+    cache = SharedRunCache(interp, path, slots=64)
+    cache.inline(',.', 'a')
+    cache.close()
+    cache = SharedRunCache(interp, path, slots=64)
+    assert cache.inline(',.', 'a') == 'a' and cache.stats().hits == 1
+    # a file with another layout is reset
+    assert SharedRunCache(interp, path, slots=32).stats() == (0, 0, 0, 32)
+
+
+def test_scoring(path, monkeypatch):
+    monkeypatch.setattr(scoring, 'USE_SHARED_CACHE', True)
+    monkeypatch.setattr(runcache, 'RUN_CACHE_PATH', path)
+    test = ('ab', 'hello!')
+    cached = [scoring.io_comparison(Unit(source), test) for source in SOURCES]
+    monkeypatch.setattr(scoring, 'USE_SHARED_CACHE', False)
+    assert cached == [scoring.io_comparison(Unit(source), test) for source in SOURCES]
+    # hits give the exact distance, whatever the bound
+    monkeypatch.setattr(scoring, 'USE_SHARED_CACHE', True)
+    assert [scoring.io_comparison(Unit(source), test) for source in SOURCES] == cached
+    assert shared_cache(scoring.INTERPRETER, path).stats().hits > 0
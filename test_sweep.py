@@ -0,0 +1,24 @@
+import crossing
+import runcache
+import sweep
+from case import Case
+from config import Configuration
+
+
+def test_from_codes():
+    config = Configuration.from_codes(score='IOC', select='RSD', cross=('CM', 'CP'), step='DIV')
+    assert set(config._cross) == {crossing.named_functions('CM'), crossing.named_functions('CP')}
+
+
+def test_sweep(tmp_path, monkeypatch):
+    monkeypatch.setattr(runcache, 'RUN_CACHE_PATH', str(tmp_path / 'runs'))
+    cases = {'echo': Case('a', 'a'), 'hi': Case('', 'hi')}
+    codes = sweep.code_grid(score='IOC', select='RSD', reproduce=('PRPW', 'PAP'), step='DIV')
+    filename = tmp_path / 'sweep.csv'
+    rows = sweep.run_sweep(cases, codes, seeds=(1, 2), filename=filename, pop_size=20, max_steps=3, processes=2)
+    assert [(row['case'], row['codes'], row['runs']) for row in rows] == [
+        (case, f'score=IOC select=RSD reproduce={code} step=DIV', 2) for case in cases for code in ('PRPW', 'PAP')
+    ]
+    assert all((row['median_steps'] is None) == (row['solved'] == 0) for row in rows)
+    assert filename.read_text().splitlines()[0] == ','.join(sweep.SUMMARY_FIELDS)
+    assert len(filename.read_text().splitlines()) == 1 + len(rows)
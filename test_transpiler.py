@@ -0,0 +1,54 @@
+import pytest
+import scoring
+import transpiler
+import interpreter
+from unit import Unit
+from transpiler import PythonInterpreter, parsed, transpiled
+
+
+SOURCES = (
+    ',.', ',+.>,-.', '++++++++[>++++++++<-]>+.', ',[.-]', '+[>+<-]>.',
+    '<<<+.>>>>-.', ',[>+<-]>0+.', '[.]-.', ']+.', '+[.', '+.[-]]+.',
+    '++[>+++[>,.<-]<-]', '-[.-]', '-[>>+>+<<<-]>>.>.', '<+[-<+>]>.',
+    '>' * 2046 + '+[->+<]>.<.', '+[[.+]]', '[[.]',
+)
+
+
+@pytest.fixture
+def python():
+    return PythonInterpreter(budget=2**16)
+
+
+def test_parsed_unmatched():
+    assert parsed('+[[.]') == ['+', '[', ['.']]
+    assert parsed('+]-[') == ['+', ']', '-', '[']
+
+
+def test_same_outputs_than_c(python):
+    inputs = ('', 'ab', 'z\x80')
+    expected = interpreter.load_interpreter().batch(SOURCES, inputs, max_output_size=64)
+    assert list(python.batch(SOURCES, inputs, max_output_size=64)) == list(expected)
+
+
+def test_runaways(python):
+    for source in ('+[>+<]', '+[ ]', '+[<]', '+[>,+<]', '-[>[-]+<]'):
+        assert transpiled(source)(b'', 64, 2**20)[2] == interpreter.RunStatus.CYCLE, source
+    assert python.inline('+[.]', max_output_size=8) == '\1' * 7
+    output, steps, termination = transpiled('-[>-[>+.<-]<-]')(b'', 2**20, 1000)
+    assert termination == interpreter.RunStatus.BUDGET and 1000 < steps < 1000 + 2 * transpiler.CHECK_PERIOD
+
+
+def test_scoring(python):
+    test = ('ab', 'hello!')
+    for source in SOURCES:
+        assert scoring.io_comparison(Unit(source), test, interpreter=python).score \
+               == scoring.io_comparison(Unit(source), test).score
+    assert python.program('+[->+<]>.').steps() == interpreter.load_interpreter().program('+[->+<]>.').steps()
+
+
+def test_fallback(monkeypatch):
+    monkeypatch.setattr(interpreter, 'BFIA_C_LIB', './not-built.so')
+    with pytest.warns(UserWarning):
+        fallback = interpreter.load_interpreter()
+    assert isinstance(fallback, PythonInterpreter)
+    assert fallback.inline('++++>,<[->+<]>.', 'a') == 'e'
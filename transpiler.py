@@ -0,0 +1,235 @@
+"""Pure-Python interpreter, used when the C interpreter is not built.
+
+Each source is transpiled once into a Python function, where runs of
+moves and additions are single statements, loops are while loops, and
+multiply loops like [->++<] are replaced by their effect.
+
+The PythonInterpreter exposes the same inline, inline_scored, batch
+and program interface than the object returned by
+interpreter.load_interpreter, so that it can be given to scoring functions.
+
+"""
+
+import re
+from functools import lru_cache
+
+from canonical import move_effect
+from interpreter import simplified_source_code, BatchResult, RunStatus, CACHE_SIZE, MEMORY_SIZE, MEMORY_END
+
+
+# Python runs are far slower than the C ones: the budget is lower than
+#  the MAXIMAL_INSTRUCTION_EXECUTION of the C interpreter.
+DEFAULT_BUDGET = 2**20
+CHECK_PERIOD = 2**8  # number of instructions between two checks of budget and cycles
+TOKENS = re.compile(r"[<>]+|[+-]+|,+|\.+|[0\[\]]")  # other characters have no effect
+INDENT = '    '
+
+
+def parsed(source:str) -> list:
+    """Return the tree of given source: a list of tokens, where loops
+    are lists. Unmatched brackets are kept as '[' and ']' tokens.
+
+    >>> parsed('++[>+<-]].[')
+    ['++', ['>', '+', '<', '-'], ']', '.', '[']
+
+    """
+    stack = [[]]
+    for token in TOKENS.findall(simplified_source_code(source)):
+        if token == '[':
+            stack.append([])
+        elif token == ']' and len(stack) > 1:
+            loop = stack.pop()
+            stack[-1].append(loop)
+        else:
+            stack[-1].append(token)
+    while len(stack) > 1:  # unmatched [ jump to the end if the cell is zero
+        loop = stack.pop()
+        stack[-1].extend(['['] + loop)
+    return stack[0]
+
+
+def multiplication(loop:list) -> (dict, int, int) or None:
+    """Return {offset: factor} of the cells modified by each iteration of
+    given loop, and the lowest and highest offsets it visits,
+    if it is a multiply loop like [->++<], else None.
+
+    >>> multiplication(['-', '>>', '+++', '<<'])
+    ({0: 255, 2: 3}, 0, 2)
+
+    """
+    if not all(isinstance(token, str) and token[0] in '<>+-' for token in loop):
+        return None
+    offset, lowest, highest, factors = 0, 0, 0, {}
+    for token in loop:
+        if token[0] in '<>':
+            for move in token:
+                offset += 1 if move == '>' else -1
+                lowest, highest = min(lowest, offset), max(highest, offset)
+        else:
+            factors[offset] = (factors.get(offset, 0) + token.count('+') - token.count('-')) % 256
+    if offset != 0 or factors.get(0) not in (1, 255):
+        return None
+    return factors, lowest, highest
+
+
+def python_source(source:str) -> str:
+    """Return the code of a Python function run(input, limit, budget)
+    running given source on input bytes, and returning its output as a
+    bytearray of at most limit letters, the number of executed instructions
+    and the termination, as in RunStatus.
+
+    The budget is checked at the start of a loop iteration, once every
+    CHECK_PERIOD instructions, so that the number of executed instructions
+    may exceed it a little. At each check, the state of the run is compared
+    to a snapshot taken at a previous check, like the cycle detection of the
+    C interpreter: a run coming back to this state would never end.
+
+    """
+    lines = ['def run(input, limit, budget):',
+             INDENT + 'm, p, out, r, steps = bytearray(MEMORY_SIZE), 0, bytearray(), 0, 0',
+             INDENT + f'check, checks, snapshot = {CHECK_PERIOD}, 0, None']
+    _transpile(parsed(source), lines, 1)
+    lines.append(INDENT + f'return out, steps, END')
+    return '\n'.join(lines) + '\n'
+
+
+def _transpile(tree:list, lines:[str], depth:int, loops:[int]=None):
+    """Append the code of given tree to lines, at given indentation depth.
+    loops is the number of already transpiled loops, identifying each of them.
+
+    """
+    loops = [0] if loops is None else loops
+    indent = INDENT * depth
+    lines.append(indent + f'steps += {len(tree) + (depth > 1)}')  # loop bodies end by a jump
+    for token in tree:
+        if isinstance(token, list):
+            mul = multiplication(token)
+            if mul is not None:
+                # multiply loops are replaced by their effect, if they don't reach memory boundaries
+                factors, lowest, highest = mul
+                times = '256 - m[p]' if factors[0] == 1 else 'm[p]'
+                lines.append(indent + f'if m[p] and {-lowest} <= p < {MEMORY_SIZE - highest}:')
+                lines.append(indent + INDENT + f'times = {times}')
+                for offset, factor in factors.items():
+                    if offset and factor:
+                        lines.append(indent + INDENT + f'm[p + {offset}] = (m[p + {offset}] + {factor} * times) & 255')
+                lines.append(indent + INDENT + 'm[p] = 0')
+            loops[0] += 1
+            lines.extend(indent + line for line in (
+                'while m[p]:',
+                INDENT + 'if steps > check:',
+                INDENT * 2 + 'if steps > budget: return out, steps, BUDGET',
+                INDENT * 2 + f'check, checks, state = steps + {CHECK_PERIOD}, checks + 1, ({loops[0]}, p, r, len(out), bytes(m))',
+                INDENT * 2 + 'if state == snapshot: return out, steps, CYCLE',
+                INDENT * 2 + 'if checks & (checks - 1) == 0: snapshot = state',
+            ))
+            _transpile(token, lines, depth + 1, loops)
+        elif token[0] in '<>':
+            delta, lo, hi = move_effect(token)
+            if delta > 0 and lo == min(delta, MEMORY_END):
+                lines.append(indent + f'p = min(p + {delta}, {hi})')
+            elif delta < 0 and hi == max(MEMORY_END + delta, 0):
+                lines.append(indent + f'p = max(p - {-delta}, {lo})')
+            elif (delta, lo, hi) != (0, 0, MEMORY_END):
+                lines.append(indent + f'p = min(max(p + {delta}, {lo}), {hi})')
+        elif token[0] in '+-':
+            lines.append(indent + f'm[p] = (m[p] + {(token.count("+") - token.count("-")) % 256}) & 255')
+        elif token[0] == ',':
+            lines.append(indent + f'r += {len(token)}')
+            lines.append(indent + f'if r <= len(input): m[p] = input[r - 1]')
+            lines.append(indent + f'else: m[p], r = 0, len(input)')
+        elif token[0] == '.':
+            if len(token) == 1:
+                lines.append(indent + 'out.append(m[p] & 127)')  # no extended ascii
+            else:
+                lines.append(indent + f'out += bytes((m[p] & 127,)) * {len(token)}')
+            lines.append(indent + f'if len(out) >= limit: del out[limit:]; return out, steps, OUTPUT_FULL')
+        elif token == '0':
+            lines.append(indent + 'm[p] = 0')
+        elif token == '[':  # unmatched: jump to the end
+            lines.append(indent + 'if not m[p]: return out, steps, END')
+        elif token == ']':  # unmatched: jump to the end
+            lines.append(indent + 'if m[p]: return out, steps, END')
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def transpiled(source:str) -> callable:
+    """Return the Python function running given source, see python_source.
+
+    >>> transpiled('++++>,<[->+<]>.')(b'a', 16, 1000)
+    (bytearray(b'e'), 7, 0)
+
+    """
+    namespace = {'MEMORY_SIZE': MEMORY_SIZE, 'END': RunStatus.END, 'BUDGET': RunStatus.BUDGET,
+                 'OUTPUT_FULL': RunStatus.OUTPUT_FULL, 'CYCLE': RunStatus.CYCLE}
+    exec(compile(python_source(source), '<transpiled brainfuck>', 'exec'), namespace)
+    return namespace['run']
+
+
+class TranspiledProgram:
+    """Like interpreter.Program, for the PythonInterpreter"""
+
+    def __init__(self, source:str, budget:int=DEFAULT_BUDGET):
+        self.source = str(source)
+        self.budget = budget
+        self._run = transpiled(self.source)
+
+    def run(self, input:str="", *, max_output_size:int=2**16) -> str:
+        output, _, _ = self._run(input.encode(), max_output_size - 1, self.budget)
+        return output.decode(encoding="ISO-8859-1")
+
+    def steps(self, input:str="", *, max_output_size:int=2**16) -> int:
+        """Return the number of instructions executed when running on given input"""
+        return self._run(input.encode(), max_output_size - 1, self.budget)[1]
+
+
+class PythonInterpreter:
+    """Interpreter usable in place of the one of interpreter.load_interpreter.
+
+    >>> python = PythonInterpreter()
+    >>> python.inline('++++>,<[->+<]>.', 'a'), python.inline_scored(',.', 'a', 'b', 0)
+    ('e', (1, 'a'))
+
+    """
+
+    def __init__(self, budget:int=DEFAULT_BUDGET):
+        self.budget = budget
+        self.inline = lru_cache(maxsize=CACHE_SIZE)(self.interprete)
+        self.inline_scored = lru_cache(maxsize=CACHE_SIZE)(self.interprete_scored)
+
+    def program(self, source:str) -> TranspiledProgram:
+        return TranspiledProgram(source, self.budget)
+
+    def interprete(self, source:str, input:str="", *, max_output_size:int=2**16, budget:int=None) -> str:
+        output, _, _ = transpiled(source)(input.encode(), max_output_size - 1, budget or self.budget)
+        return output.decode(encoding="ISO-8859-1")
+
+    def interprete_scored(self, source:str, input:str, expected:str, bound:int, *,
+                          max_output_size:int=2**16, budget:int=None) -> (int, str):
+        """Like interpreter.interprete_scored. Runs are never aborted,
+        so the distance is always exact.
+
+        """
+        from scoring import compare_str_py  # scoring loads the interpreter
+        found = self.interprete(source, input, max_output_size=max_output_size, budget=budget)
+        return compare_str_py(expected, found), found
+
+    def checkpointed_scored(self, source:str, input:str, expected:str, *,
+                            max_output_size:int=2**16, budget:int=None) -> (int, str):
+        """Like interpreter.interprete_checkpointed: transpiled runs
+        can't be resumed, so there is no prefix to share.
+
+        """
+        return self.inline_scored(source, input, expected, 0, max_output_size=max_output_size, budget=budget)
+
+    def batch(self, sources:[str], inputs:[str]=('',), *, max_output_size:int=2**16) -> BatchResult:
+        """Run all sources on all inputs, like interpreter.interprete_batch"""
+        sources, inputs = tuple(sources), tuple(inputs)
+        result = BatchResult(len(sources), len(inputs), max_output_size)
+        for source_idx, source in enumerate(sources):
+            for input_idx, input in enumerate(inputs):
+                idx = source_idx * len(inputs) + input_idx
+                output, _, _ = transpiled(source)(input.encode(), max_output_size - 1, self.budget)
+                result.outputs[idx * max_output_size:idx * max_output_size + len(output)] = bytes(output)
+                result.lengths[idx] = len(output)
+        return result
@@ -12,8 +12,9 @@ from interpreter import BF_STATEMENTS
 class Unit:
 
     def __init__(self, bf_source:str, chrom_size:int=8, mutation_rate:float=0.05,
-                 additional_mutation_rate:float=0.1):
+                 additional_mutation_rate:float=0.1, parents:tuple=()):
         self.source = str(bf_source)
+        self.parents = tuple(parents)  # sources of the units it comes from
         self.chrom_size = chrom_size
         self.mutation_rate = float(mutation_rate)
         self.additional_mutation_rate = float(additional_mutation_rate)
@@ -57,7 +58,8 @@ class Unit:
                 random.choice(chars)
                 for chars in itertools.zip_longest(*[iter(parent.source) for parent in parents], fillvalue='')
             ),
-            chrom_size=chrom_size or random.choice([parent.chrom_size for parent in parents])
+            chrom_size=chrom_size or random.choice([parent.chrom_size for parent in parents]),
+            parents=(parent.source for parent in parents),
         )
 
     @staticmethod
@@ -68,7 +70,8 @@ class Unit:
             raise ValueError(f"Crossing function {crossing_func} returned an empty source for given parents {parents} of sources: {' and '.join(p.source for p in parents)}.")
         return Unit(
             bf_source=crossing_func(parents),
-            chrom_size=chrom_size or random.choice([parent.chrom_size for parent in parents])
+            chrom_size=chrom_size or random.choice([parent.chrom_size for parent in parents]),
+            parents=(parent.source for parent in parents),
         )
 
     @staticmethod
@@ -78,12 +81,13 @@ class Unit:
                 ''.join(random.choice(chroms))
                 for chroms in itertools.zip_longest(*[iter(parent) for parent in parents], fillvalue='')
             ),
-            chrom_size=chrom_size or random.choice([parent.chrom_size for parent in parents])
+            chrom_size=chrom_size or random.choice([parent.chrom_size for parent in parents]),
+            parents=(parent.source for parent in parents),
         )
 
     @staticmethod
     def mutated(unit, mutators:iter) -> 'unit':
-        new = Unit(unit.source, unit.chrom_size)
+        new = Unit(unit.source, unit.chrom_size, parents=(unit.source,) + unit.parents[:1])
         new.mutate(mutators)
         return new
 
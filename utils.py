@@ -2,6 +2,7 @@
 
 """
 
+import os
 import itertools
 import functools
 from collections import defaultdict, deque
@@ -10,6 +11,14 @@ from numpy.random import default_rng
 np_rng = default_rng()  # replace np.random ; see https://numpy.org/doc/stable/reference/random/index.html#random-quick-start
 
 
+def _reseed_np_rng():
+    """Give a new generator to a forked process, so that it doesn't draw
+    the same numbers than its parent and siblings, like random module does"""
+    global np_rng
+    np_rng = default_rng()
+os.register_at_fork(after_in_child=_reseed_np_rng)
+
+
 def named_functions_interface_decorator(named_funcs:callable):
     """Allow a named_functions function to expose a more complete API"""
     # this trick limits the dictionnary to be computed only one time,
@@ -121,6 +130,27 @@ def choices(population: iter, weights = None, k: int = 1, replacement: bool = Fa
     return np_rng.choice(list(population), size=k, replace=replacement, p=weights)
 
 
+def distinct_pairs(size:int, number:int, weights=None):
+    """Return an array of given number of pairs of distinct indexes in range(size),
+    drawn like choices(range(size), weights, k=2) for each pair, at once.
+
+    >>> pairs = distinct_pairs(3, 1000, weights=[1, 0, 1])
+    >>> pairs.shape, set(map(tuple, pairs.tolist())) == {(0, 2), (2, 0)}
+    ((1000, 2), True)
+
+    """
+    assert size >= 2, size
+    if weights is not None:
+        total_weight = sum(weights)
+        weights = [w/total_weight for w in weights]
+    pairs = np_rng.choice(size, size=(number, 2), p=weights)
+    same = pairs[:, 0] == pairs[:, 1]
+    while same.any():  # the second one is drawn among the others
+        pairs[same, 1] = np_rng.choice(size, size=int(same.sum()), p=weights)
+        same = pairs[:, 0] == pairs[:, 1]
+    return pairs
+
+
 def window(it:iter, size:int=2):
     it = iter(it)
     window = deque(itertools.islice(it, 0, size), maxlen=size)